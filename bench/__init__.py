@@ -0,0 +1,2 @@
+# Замеры и локальные серверы, которые изображают внешние API. В рабочих модулях их больше нет: бот и Web UI
+# не импортируют этот пакет. Каждый модуль запускается из корня проекта как `python -m bench.<модуль>`.
@@ -0,0 +1,118 @@
+import sys
+import json
+import time
+import email
+import logging
+import itertools
+import email.policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Локальный сервер, который изображает файлы и пакетные задания OpenAI, для проверки gpt_bulk.py без сети:
+# `python -m bench.batch_api [порт] [секунд]`, затем OPENAI_API_KEY=x GPT_BULK_BASE_URL=http://127.0.0.1:8766/v1
+
+
+# Локальный сервер вместо OpenAI: /v1/files, /v1/batches и /v1/files/<id>/content.
+# Задание завершается через seconds секунд после создания, ответ модели - заглушка по тексту запроса.
+# Запрос, в тексте которого есть "mock-error", завершается ошибкой
+class MockBatchServer(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    files = {}
+    batches = {}
+    seconds = 5.0
+    counter = itertools.count(1)
+
+    def log_message(self, format, *args):
+        logging.info(f"mock-server: {format % args}")
+
+    def _send(self, payload, status=200, raw=None):
+        body = raw if raw is not None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream' if raw is not None else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _file(self, data, filename, purpose):
+        file_id = f"file-{next(self.counter)}"
+        self.files[file_id] = {'data': data, 'object': {
+            'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+            'filename': filename, 'purpose': purpose, 'status': 'processed'}}
+        return self.files[file_id]['object']
+
+    @staticmethod
+    def _answer(request):
+        content = request['body']['messages'][-1]['content']
+        if 'mock-error' in content:
+            return {'id': request['custom_id'], 'custom_id': request['custom_id'], 'response': None,
+                    'error': {'code': 'mock_error', 'message': 'mock error'}}
+        description = content.split(':', 1)[-1].strip()
+        answer = {'dimensions': '20/20/20', 'weight': '1', 'vendor': (description.split() or ['NULL'])[0],
+                  'categoryId': '1', 'name': description, 'description': description}
+        body = {'id': f"chatcmpl-{request['custom_id'][:12]}", 'object': 'chat.completion', 'created': int(time.time()),
+                'model': request['body']['model'], 'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {
+                    'role': 'assistant', 'content': json.dumps(answer, ensure_ascii=False)}}]}
+        return {'id': f"batch-req-{request['custom_id'][:12]}", 'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': 'mock', 'body': body}, 'error': None}
+
+    def _batch(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= self.seconds:
+            lines = [json.loads(line) for line in self.files[batch['input_file_id']]['data'].decode('utf-8').splitlines()
+                     if line.strip()]
+            results = [self._answer(line) for line in lines]
+            output = ''.join(json.dumps(result, ensure_ascii=False) + '\n' for result in results)
+            batch['output_file_id'] = self._file(output.encode('utf-8'), f"{batch_id}_output.jsonl", 'batch_output')['id']
+            batch['request_counts'] = {'total': len(results), 'completed': sum(1 for r in results if r['error'] is None),
+                                       'failed': sum(1 for r in results if r['error'] is not None)}
+            batch['status'] = 'completed'
+        return batch
+
+    def do_POST(self):
+        body = self._body()
+        if self.path == '/v1/files':
+            # multipart/form-data разбирается как MIME-сообщение
+            message = email.message_from_bytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body, policy=email.policy.HTTP)
+            parts = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+            purpose = parts['purpose'].get_payload(decode=True).decode()
+            file = parts['file']
+            return self._send(self._file(file.get_payload(decode=True), file.get_filename() or 'upload.jsonl', purpose))
+        if self.path == '/v1/batches':
+            request = json.loads(body)
+            batch_id = f"batch-{next(self.counter)}"
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'], 'errors': None,
+                'input_file_id': request['input_file_id'], 'completion_window': request['completion_window'],
+                'status': 'in_progress', 'created_at': int(time.time()), 'output_file_id': None, 'error_file_id': None,
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0}}
+            return self._send(self.batches[batch_id])
+        if self.path.startswith('/v1/batches/') and self.path.endswith('/cancel'):
+            batch = self.batches[self.path.split('/')[3]]
+            batch['status'] = 'cancelled'
+            return self._send(batch)
+        self._send({'error': {'message': f"Unknown path {self.path}"}}, 404)
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts[:2] == ['v1', 'batches'] and len(parts) == 3 and parts[2] in self.batches:
+            return self._send(self._batch(parts[2]))
+        if parts[:2] == ['v1', 'files'] and len(parts) == 4 and parts[3] == 'content' and parts[2] in self.files:
+            return self._send(None, raw=self.files[parts[2]]['data'])
+        self._send({'error': {'message': f"Unknown path {self.path}"}}, 404)
+
+
+def run_mock_server(port=8766, seconds=5.0):
+    MockBatchServer.seconds = seconds
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockBatchServer)
+    logging.info(f"Локальный сервер пакетных заданий: http://127.0.0.1:{port}/v1, задание готово через {seconds} с")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    run_mock_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8766,
+                    float(sys.argv[2]) if len(sys.argv) > 2 else 5.0)
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+from datetime import datetime
+from xml.etree import ElementTree as ET
+from xml_writer import XMLStreamWriter
+from catalog_store import SQLiteCatalog, XMLCatalog, new_offer_fields, open_catalog
+
+# Время одного цикла excel_main на обоих хранилищах каталога (catalog_store.py).
+# `python -m bench.catalog [offers] [changes]`
+
+
+# Синтетический products.xml из offers товаров по pictures картинок
+def _write_bench_catalog(file_xml, offers, pictures):
+    with open(file_xml, 'w', encoding='utf-8') as f:
+        writer = XMLStreamWriter(f)
+        writer.start_document()
+        writer.start("yml_catalog", {'date': datetime.now().strftime("%Y-%m-%dT%H:%M:%S")})
+        writer.start("shop")
+        name = ET.Element("name")
+        name.text = "smart-dostup"
+        writer.element(name)
+        writer.start("offers")
+        for number in range(offers):
+            offer = ET.Element("offer", id=f"{number:06d}")
+            fields, _ = new_offer_fields({
+                'name': f"Товар {number}", 'vendor': "Apple", 'calculated_price': 1000 + number % 5000,
+                'categoryId': str(number % 14 + 1), 'description': f"Описание товара {number} " * 20,
+                'dimensions': "10/10/10", 'weight': "0.5"})
+            for tag, text in fields.items():
+                ET.SubElement(offer, tag).text = text
+                if tag == 'description':
+                    for picture in range(pictures):
+                        ET.SubElement(offer, "picture").text = f"https://example.com/{number}/{picture}.jpg"
+            writer.element(offer)
+        writer.close()
+
+
+# Время одного цикла на 100k offer'ов: открыть каталог, поменять changes цен и архивировать changes / 10 offer'ов,
+# опубликовать. И цикл без изменений. Считается во временной папке, снапшоты и сжатые копии - по настройкам publisher.py
+def bench(offers=100000, changes=100, pictures=5):
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            _write_bench_catalog('products.xml', offers, pictures)
+            print(f"products.xml: {offers} offer'ов, {os.path.getsize('products.xml') / 1024 / 1024:.1f} МБ")
+            started = time.perf_counter()
+            with SQLiteCatalog('products.xml'):
+                pass
+            print(f"sqlite: импорт {time.perf_counter() - started:.2f} с")
+            started = time.perf_counter()
+            with SQLiteCatalog('products.xml') as catalog:
+                catalog.render()
+            print(f"sqlite: первая публикация (все offer'ы сериализуются) {time.perf_counter() - started:.2f} с")
+
+            ids = [f"{number:06d}" for number in range(offers)]
+            # Сначала sqlite: запись файла хранилищем xml заставила бы sqlite импортировать его заново
+            for storage in (SQLiteCatalog.name, XMLCatalog.name):
+                for cycle in ('с изменениями', 'без изменений'):
+                    timings = {}
+                    started = time.perf_counter()
+                    with open_catalog('products.xml', storage) as catalog:
+                        timings['open'] = time.perf_counter() - started
+                        if cycle == 'с изменениями':
+                            step = time.perf_counter()
+                            catalog.set_prices({xmlid: str(random.randint(1000, 9999))
+                                                for xmlid in random.sample(ids, changes)})
+                            catalog.archive(random.sample(ids, changes // 10))
+                            timings['update'] = time.perf_counter() - step
+                        step = time.perf_counter()
+                        catalog.save()
+                        timings['save'] = time.perf_counter() - step
+                    timings['total'] = time.perf_counter() - started
+                    results.append((storage, cycle, timings))
+        finally:
+            os.chdir(cwd)
+
+    for storage, cycle, timings in results:
+        print(f"{storage}, цикл {cycle}: " + ', '.join(f"{key} {value:.3f} с" for key, value in timings.items()))
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+          int(sys.argv[2]) if len(sys.argv) > 2 else 100)
@@ -0,0 +1,35 @@
+import sys
+import logging
+from enrichment import backends, create_backends
+from xml_converter import XMLGenerator, run_sync
+
+# Сравнение бэкендов обогащения (enrichment.py) на первых товарах products.xlsx.
+# `python -m bench.enrichment_compare [товаров]`
+
+
+# Сравнение бэкендов на первых count товарах products.xlsx: каждый товар запрашивается у каждого бэкенда
+# без кэша GPT, по одному, чтобы ожидание в очереди стадии не попало в замер времени ответа. Печатается медиана и p95
+def compare(count=20, products_file='products.xlsx'):
+    generator = XMLGenerator(products_file)
+    descriptions = [str(description) for description in generator.read_products()['description'][:count]]
+
+    async def run():
+        results = []
+        for name in backends:
+            async with generator.pipeline():
+                generator.gpt_backends = create_backends(
+                    generator.openai, generator.gpt_stage, generator.gpt_backends[0].fields, name, None)
+                for description in descriptions:
+                    await generator.get_product_details_from_gpt(f'json: {description}')
+                results.append(generator.gpt_backends[0].stats())
+        return results
+
+    for stats in run_sync(run()):
+        print(f"{stats['backend']}: товаров {stats['products']}, ошибок {stats['failures']}, "
+              f"медиана {stats['p50']} с, p95 {stats['p95']} с")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    compare(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
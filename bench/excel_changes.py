@@ -0,0 +1,71 @@
+import os
+import sys
+import shutil
+import time
+import logging
+import tempfile
+import pandas as pd
+from catalog_store import SQLiteCatalog, XMLCatalog, open_catalog
+from excel_main import CatalogSession, ChangeSet
+from bench.catalog import _write_bench_catalog
+
+# Время применения изменений из Excel (CatalogSession.apply_summary) в зависимости от размера каталога и числа изменений:
+# архивирование, новые цены и активация архивных offer'ов ищут offer'ы по индексу xmlid, а не перебором каталога.
+# `python -m bench.excel_changes [offers через запятую] [изменений через запятую]`
+
+
+# ChangeSet из changes изменений поровну: удаленные строки, новые цены и снова появившиеся (архивные) строки
+def _change_set(ids, reactivated, changes):
+    third = changes // 3
+    removed = ids[:third]
+    updated = ids[third:2 * third]
+    added = reactivated[:changes - 2 * third]
+    return ChangeSet(
+        pd.DataFrame({'xmlid': added, 'description': ['Товар'] * len(added), 'price': [1500.0] * len(added)}),
+        pd.DataFrame({'xmlid': removed, 'description': ['Товар'] * len(removed), 'price': [1000.0] * len(removed)}),
+        pd.DataFrame({'xmlid': updated, 'price_new': [2000.0] * len(updated), 'price_old': [1000.0] * len(updated)}),
+        pd.DataFrame({'xmlid': [], 'description_new': [], 'description_old': []}))
+
+
+# Для каждого размера каталога и каждого числа изменений (не больше половины каталога) - свежая копия products.xml,
+# в которой заранее архивированы offer'ы для активации. Замеряется apply_summary и весь цикл с открытием и записью
+def bench(offers=(1000, 10000, 100000), changes=(10, 100, 1000, 10000), pictures=2):
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for size in offers:
+                _write_bench_catalog('base.xml', size, pictures)
+                ids = [f"{number:06d}" for number in range(size)]
+                for count in changes:
+                    if count > size // 2:
+                        continue
+                    reactivated = ids[-(count - 2 * (count // 3)):]
+                    for storage in (SQLiteCatalog.name, XMLCatalog.name):
+                        shutil.copy('base.xml', 'products.xml')
+                        for name in ('catalog.sqlite3', 'products.xml.rules.json'):
+                            if os.path.exists(name):
+                                os.remove(name)
+                        with open_catalog('products.xml', storage) as catalog:
+                            catalog.archive(reactivated)
+                            catalog.save()
+                        change_set = _change_set(ids, reactivated, count)
+                        started = time.perf_counter()
+                        with CatalogSession('products.xml', storage) as session:
+                            step = time.perf_counter()
+                            session.apply_summary(change_set, 'products.xlsx')
+                            update = time.perf_counter() - step
+                            session.save()
+                        results.append((size, count, storage, update, time.perf_counter() - started))
+        finally:
+            os.chdir(cwd)
+
+    print("offer'ов  изменений  хранилище  apply_summary  цикл целиком")
+    for size, count, storage, update, total in results:
+        print(f"{size:8}  {count:9}  {storage:9}  {update:11.3f} с  {total:10.3f} с")
+
+
+if __name__ == "__main__":
+    bench(*(tuple(int(value) for value in arg.split(',')) for arg in sys.argv[1:3]))
@@ -0,0 +1,119 @@
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from throttle import Stage
+
+# Повторы throttle.Stage против сервера с ограничением нагрузки.
+# `python -m bench.faults fault-server [порт] [запросов в секунду] [задержка]` - локальный сервер, который отвечает 429
+# сверх заданного лимита, `python -m bench.faults bench [URL] [запросов] [потоков]` - полезная пропускная способность
+# через него со старыми повторами и через Stage.call().
+
+
+# Локальный сервер с ограничением нагрузки: не больше rate запросов в секунду (сверх лимита - 429 с Retry-After),
+# каждый ответ через latency секунд. GET /stats - счетчики ответов
+class FaultServer(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rate = 20.0
+    latency = 0.05
+    counters = {'ok': 0, 'throttled': 0}
+    tokens = 0.0
+    updated = time.monotonic()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self._send(200, self.counters)
+        with self.lock:
+            now = time.monotonic()
+            cls = type(self)
+            cls.tokens = min(cls.rate, cls.tokens + (now - cls.updated) * cls.rate)
+            cls.updated = now
+            allowed = cls.tokens >= 1
+            if allowed:
+                cls.tokens -= 1
+            self.counters['ok' if allowed else 'throttled'] += 1
+        time.sleep(self.latency)
+        if not allowed:
+            return self._send(429, {'error': {'message': 'Rate limit exceeded'}}, {'Retry-After': '1'})
+        self._send(200, {'ok': True})
+
+
+def run_fault_server(port=8767, rate=20.0, latency=0.05):
+    FaultServer.rate = rate
+    FaultServer.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', port), FaultServer)
+    logging.info(f"Сервер с лимитом {rate} запросов в секунду: http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+# Сравнение на fault-server: requests запросов в concurrency потоков, старые повторы (до 10 подряд без пауз)
+# и Stage.call(). Полезная пропускная способность - удачные запросы в секунду
+async def bench(url='http://127.0.0.1:8767', requests=300, concurrency=16):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        async def request():
+            response = await client.get('/work')
+            response.raise_for_status()
+
+        async def naive():
+            for attempt in range(10):
+                try:
+                    return await request()
+                except httpx.HTTPStatusError:
+                    pass
+            raise RuntimeError("Все 10 попыток завершились неудачей")
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(mode):
+            async with semaphore:
+                return await (naive() if mode == 'naive' else stage.call(request))
+
+        for mode in ('naive', 'stage'):
+            stage = Stage('bench', concurrency, retries=6, transient=(httpx.TransportError,))
+            before = (await client.get('/stats')).json()
+            started = time.monotonic()
+            results = await asyncio.gather(*(run(mode) for _ in range(requests)), return_exceptions=True)
+            elapsed = time.monotonic() - started
+            after = (await client.get('/stats')).json()
+            ok = sum(1 for result in results if not isinstance(result, BaseException))
+            sent = sum(after.values()) - sum(before.values())
+            print(f"{mode}: удачных {ok} из {requests} за {elapsed:.1f} с, {ok / elapsed:.1f} в секунду, "
+                  f"запросов к серверу {sent}, из них 429: {after['throttled'] - before['throttled']}")
+        print(f"Stage: {stage.stats()}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    args = sys.argv[2:]
+    if len(sys.argv) > 1 and sys.argv[1] == 'fault-server':
+        logging.getLogger().setLevel(logging.INFO)
+        run_fault_server(int(args[0]) if args else 8767,
+                         float(args[1]) if len(args) > 1 else 20.0,
+                         float(args[2]) if len(args) > 2 else 0.05)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        asyncio.run(bench(args[0] if args else 'http://127.0.0.1:8767',
+                          int(args[1]) if len(args) > 1 else 300,
+                          int(args[2]) if len(args) > 2 else 16))
+    else:
+        print("Использование: python -m bench.faults fault-server [порт] [запросов в секунду] [задержка] | "
+              "bench [URL] [запросов] [потоков]")
@@ -0,0 +1,117 @@
+import sys
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+import httpx
+from PIL import Image
+from xml_converter import ImageSearcher
+
+# Подбор картинок (xml_converter.ImageSearcher) против локального сервера с выдачей и картинками: время,
+# скачанные байты и запросы на товар. `python -m bench.images [товаров] [картинок на товар]`
+
+
+# Локальный сервер для bench_images(): страница выдачи как у Bing и картинки за ней, с задержкой на запрос и
+# ограничением скорости отдачи, чтобы проверка картинок упиралась в сеть, как в проде.
+# Поддерживает HEAD и Range, считает запросы и отданные байты
+class _ImageFixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Порядок кандидатов в выдаче: мелкие картинки (меньше 300px), не картинка и подходящие фото
+    pattern = ('small', 'text', 'small', 'photo', 'small', 'photo', 'photo', 'small', 'photo', 'text')
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.serve(head=True)
+
+    def do_GET(self):
+        self.serve()
+
+    def serve(self, head=False):
+        server = self.server
+        time.sleep(server.latency)
+        path = urlsplit(self.path)
+        if path.path == '/search':
+            links = ''.join(f'<a class="iusc" m=\'{{"murl":"http://127.0.0.1:{server.server_port}/img/{path.query}/'
+                            f'{number}/{kind}"}}\'></a>' for number, kind in enumerate(self.pattern * 3))
+            content_type, data = 'text/html', f"<html><body>{links}</body></html>".encode()
+        else:
+            content_type, data = server.files[path.path.rsplit('/', 1)[1]]
+        start, end = 0, len(data) - 1
+        status = 200
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].partition('-')
+            start, end = int(first), min(int(last or end), end)
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        with server.lock:
+            server.requests += 1
+        if head:
+            return
+        chunk_size = 16 * 1024
+        try:
+            for offset in range(start, end + 1, chunk_size):
+                chunk = data[offset:min(offset + chunk_size, end + 1)]
+                self.wfile.write(chunk)
+                with server.lock:
+                    server.bytes_sent += len(chunk)
+                time.sleep(len(chunk) / server.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент прочитал сколько ему нужно и закрыл соединение
+            self.close_connection = True
+
+
+# Подбор картинок для products товаров против локального сервера: время и скачанные байты на товар.
+# Кэши картинок и выдачи не помогают: каждый запуск берет новые URL
+def bench_images(products=10, count=2, latency=0.05, bandwidth=2 * 1024 * 1024):
+    logging.getLogger().setLevel(logging.ERROR)
+    files = {'text': ('text/html', b'<html></html>')}
+    for kind, (width, height) in (('small', (200, 200)), ('photo', (1280, 960))):
+        buffer = BytesIO()
+        Image.effect_noise((width, height), 12).convert('RGB').save(buffer, 'JPEG', quality=85)
+        files[kind] = ('image/jpeg', buffer.getvalue())
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ImageFixtureHandler)
+    server.daemon_threads = True
+    server.files, server.latency, server.bandwidth = files, latency, bandwidth
+    server.lock = threading.Lock()
+    server.requests = server.bytes_sent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    run = hashlib.sha256(str(time.time()).encode()).hexdigest()[:8]
+
+    async def run_products():
+        searcher = ImageSearcher()
+        searcher.base_url = f"http://127.0.0.1:{server.server_port}/search?q="
+        timings = []
+        async with httpx.AsyncClient(timeout=60) as http:
+            searcher.open(http)
+            for number in range(products):
+                started = time.perf_counter()
+                found = await searcher.get_image_urls(f"{run}-{number}", count)
+                timings.append(time.perf_counter() - started)
+                if len(found) < count:
+                    print(f"Товар {number}: найдено {len(found)} картинок из {count}")
+            searcher.close()
+        return timings
+
+    try:
+        timings = asyncio.run(run_products())
+    finally:
+        server.shutdown()
+    print(f"{products} товаров по {count} картинки, задержка {latency * 1000:.0f} мс, {bandwidth / 1024 / 1024:.1f} МБ/с: "
+          f"{sum(timings) / products:.2f} с на товар (максимум {max(timings):.2f} с), "
+          f"{server.bytes_sent / products / 1024:.0f} КБ и {server.requests / products:.1f} запросов на товар")
+
+
+if __name__ == "__main__":
+    bench_images(*(int(value) for value in sys.argv[1:3]))
@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image
+import xml_converter
+from xml_converter import XMLGenerator, gpt_fields
+
+# Конвейер обогащения (XMLGenerator.enrich_products) против локальных поддельных OpenAI и Bing: сколько товаров
+# в секунду он обрабатывает при разных лимитах стадий gpt, bing_search и image_validation.
+# Ответы сервера приходят с фиксированной задержкой, поэтому пропускная способность растет с лимитом,
+# а не с числом ядер. `python -m bench.pipeline [товаров] [лимиты через запятую]`
+
+
+# Поддельный API: POST /v1/chat/completions отвечает JSON с полями товара, GET /search - страница выдачи как у Bing,
+# GET /img/... - картинка 400x400. Каждый ответ через задержку своего типа, счетчики запросов по типам
+class _FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, content_type, data):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Проверка картинок закрывает соединение, когда нужные картинки уже найдены
+            self.close_connection = True
+
+    def _count(self, kind):
+        with self.server.lock:
+            self.server.requests[kind] += 1
+        time.sleep(self.server.latency[kind])
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self._count('gpt')
+        description = body['messages'][-1]['content'].removeprefix('json: ')
+        answer = {field: '' for field in gpt_fields}
+        answer.update(name=f"Товар {description}", description=description, vendor='Bench',
+                      categoryId='1', dimensions='10/10/10', weight='0.5')
+        self._send('application/json', json.dumps({
+            'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': json.dumps(answer, ensure_ascii=False)}}],
+        }).encode())
+
+    def do_GET(self):
+        path = urlsplit(self.path)
+        if path.path == '/search':
+            self._count('search')
+            query = hashlib.sha256(parse_qs(path.query)['q'][0].encode()).hexdigest()[:16]
+            links = ''.join(f'<a class="iusc" m=\'{{"murl":"http://127.0.0.1:{self.server.server_port}/img/{query}/'
+                            f'{number}.jpg"}}\'></a>' for number in range(10))
+            return self._send('text/html', f"<html><body>{links}</body></html>".encode())
+        self._count('image')
+        self._send('image/jpeg', self.server.image)
+
+
+def run_fake_api(latency):
+    buffer = BytesIO()
+    Image.new('RGB', (400, 400), 'white').save(buffer, 'JPEG')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeApiHandler)
+    server.daemon_threads = True
+    server.image = buffer.getvalue()
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.requests = {kind: 0 for kind in latency}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# products товаров через конвейер для каждого лимита из limits (один лимит для всех трех стадий).
+# Кэши GPT, картинок и выдачи не помогают: каждый запуск берет новые описания товаров
+def bench_pipeline(products=64, limits=(1, 2, 4, 8, 16, 32), count=2,
+                   latency={'gpt': 0.3, 'search': 0.1, 'image': 0.02}):
+    logging.getLogger().setLevel(logging.CRITICAL)
+    server = run_fake_api(latency)
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/v1"
+    # Ограничивает только число одновременных запросов: лимиты в секунду сняты, пакетный режим GPT выключен
+    xml_converter.gpt_rate = xml_converter.search_rate = 10000.0
+    xml_converter.gpt_batch_size = 1
+    xml_converter.pipeline_metrics_interval = 0
+    print(f"Ядер: {os.cpu_count()}, товаров: {products}, картинок на товар: {count}, задержка ответа: "
+          f"GPT {latency['gpt'] * 1000:.0f} мс, выдача {latency['search'] * 1000:.0f} мс, "
+          f"картинка {latency['image'] * 1000:.0f} мс")
+    try:
+        for limit in limits:
+            xml_converter.gpt_concurrency = xml_converter.search_concurrency = limit
+            xml_converter.validation_concurrency = limit
+            run = hashlib.sha256(f"{time.time()}-{limit}".encode()).hexdigest()[:8]
+            rows = [{'xmlid': f"bench-{number}", 'description': f"{run} товар {number}", 'price': 1000.0}
+                    for number in range(products)]
+            generator = XMLGenerator('products.xlsx', image_count=count)
+            generator.image_searcher.base_url = f"http://127.0.0.1:{server.server_port}/search?q="
+            before = dict(server.requests)
+            started = time.perf_counter()
+            results = generator.enrich_products(rows)
+            elapsed = time.perf_counter() - started
+            complete = sum(1 for product in results if product is not None and len(product['pictures']) == count)
+            requests = {kind: server.requests[kind] - before[kind] for kind in latency}
+            print(f"Лимит {limit:3}: {elapsed:6.2f} с, {products / elapsed:6.1f} товаров в секунду, "
+                  f"полных товаров {complete} из {products}, запросов {requests}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    bench_pipeline(int(args[0]) if args else 64,
+                   tuple(int(limit) for limit in args[1].split(',')) if len(args) > 1 else (1, 2, 4, 8, 16, 32))
@@ -0,0 +1,48 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pricing import get_tiers, calculate_prices
+
+# Замер calculate_prices на случайных ценах и сверка с построчным расчетом по той же шкале.
+# `python -m bench.prices [строк]`, код выхода 1 - есть расхождения
+
+
+# Построчный расчет по той же шкале, так же как работала старая лестница if/elif.
+
+
+def _calculate_price_by_row(price, tiers):
+    multiplier = tiers[0][1]
+    for start, tier_multiplier in tiers[1:]:
+        if price < start:
+            break
+        multiplier = tier_multiplier
+    return price * multiplier
+
+
+def benchmark(rows=1000000):
+    tiers = get_tiers()
+    rng = np.random.default_rng(0)
+    prices = pd.Series(np.round(rng.uniform(100, 300000, rows), 2))
+    # Границы ступеней и соседние с ними цены, на них чаще всего ошибаются
+    edges = [start + delta for start, _ in tiers for delta in (-0.01, 0, 0.01)]
+    prices[:len(edges)] = edges
+
+    started = time.perf_counter()
+    vectorized = calculate_prices(prices, tiers)
+    vectorized_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    by_row = [_calculate_price_by_row(price, tiers) for price in prices]
+    by_row_time = time.perf_counter() - started
+
+    mismatches = int((vectorized.to_numpy() != np.array(by_row)).sum())
+    print(f"Строк: {rows}")
+    print(f"calculate_prices: {vectorized_time:.3f} с")
+    print(f"Построчно: {by_row_time:.3f} с")
+    print(f"Расхождений: {mismatches}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000) else 0)
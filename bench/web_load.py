@@ -0,0 +1,63 @@
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Нагрузочный тест запущенного Web UI (web.py): запросов в секунду, p50 и p99 по каждому запросу.
+# `python -m bench.web_load [URL] [секунд] [потоков]`
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+# Нагрузочный тест запущенного Web UI. Правила теста пишутся с id "loadtest-..." и удаляются в конце
+def loadtest(url='http://127.0.0.1:5000', duration=10, concurrency=16):
+    import httpx
+
+    etag = httpx.get(f"{url}/get_rules").headers.get('ETag')
+    scenarios = {
+        'get_rules 200': lambda client, n: client.get('/get_rules'),
+        'get_rules 304': lambda client, n: client.get('/get_rules', headers={'If-None-Match': etag}),
+        'get_rules page': lambda client, n: client.get('/get_rules', params={'offset': n % 10 * 100, 'limit': 100}),
+        'bulk_upsert 100': lambda client, n: client.post('/rules/bulk_upsert',
+                                                         json=[{'id': f"loadtest-{n % 10}-{i}", 'price': str(n)} for i in range(100)]),
+        'edit_rule': lambda client, n: client.post('/edit_rule', json={'id': f"loadtest-{n % 10}-0", 'price': str(n)}),
+    }
+
+    for name, scenario in scenarios.items():
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def run(thread_number):
+            with httpx.Client(base_url=url, timeout=30) as client:
+                n = thread_number
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    response = scenario(client, n)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        if response.status_code >= 400:
+                            errors.append(response.status_code)
+                    n += concurrency
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(run, range(concurrency)))
+        elapsed = time.monotonic() - started
+        print(f"{name}: {len(latencies)} запросов, {len(latencies) / elapsed:.0f} в секунду, p50 {
+              _percentile(latencies, 50) * 1000:.1f} мс, p99 {_percentile(latencies, 99) * 1000:.1f} мс, ошибок {len(errors)}")
+
+    httpx.post(f"{url}/rules/bulk_delete",
+               json={'ids': [f"loadtest-{n}-{i}" for n in range(10) for i in range(100)]})
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    loadtest(args[0] if args else 'http://127.0.0.1:5000',
+             int(args[1]) if len(args) > 1 else 10,
+             int(args[2]) if len(args) > 2 else 16)
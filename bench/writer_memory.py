@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import subprocess
+from xml.dom import minidom
+from xml.etree import ElementTree as ET
+from xml_writer import XMLStreamWriter
+
+# Запись products.xml потоковым писателем (xml_writer.py) и прежним путем ET.tostring -> minidom.toprettyxml ->
+# фильтр пустых строк: время и прирост пикового RSS на записи, совпадение файлов байт в байт.
+# Каталог - products_back.xml, размноженный до нужного числа offer'ов. Каждый способ замеряется в отдельном процессе.
+# `python -m bench.writer_memory [offers] [исходный файл]`
+
+
+# Текущий и пиковый RSS процесса в байтах (VmRSS и VmHWM из /proc/self/status)
+def _rss():
+    with open('/proc/self/status') as f:
+        fields = dict(line.split(':', 1) for line in f)
+    return tuple(int(fields[name].split()[0]) * 1024 for name in ('VmRSS', 'VmHWM'))
+
+
+def _write_minidom(root, output):
+    xml_str = ET.tostring(root, encoding='utf-8')
+    parsed_str = minidom.parseString(xml_str).toprettyxml(indent="  ")
+    parsed_str = '\n'.join(
+        [line for line in parsed_str.split('\n') if line.strip()])
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(parsed_str)
+
+
+def _write_stream(root, output):
+    with open(output, "w", encoding="utf-8") as f:
+        writer = XMLStreamWriter(f)
+        writer.start_document()
+        writer.element(root)
+        writer.close()
+
+
+writers = {'stream': _write_stream, 'minidom': _write_minidom}
+
+
+# Один замер в этом процессе: дерево читается до замера, замеряется только запись. Пик RSS после чтения
+# сбрасывается (clear_refs), чтобы в замер не попал пик парсера. Результат - JSON в stdout
+def run(method, source, output):
+    root = ET.parse(source).getroot()
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    before, _ = _rss()
+    started = time.perf_counter()
+    writers[method](root, output)
+    elapsed = time.perf_counter() - started
+    _, peak = _rss()
+    with open(output, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+    print(json.dumps({'seconds': elapsed, 'peak_growth': peak - before, 'sha256': digest}))
+
+
+# Каталог из offers offer'ов: offer'ы исходного файла повторяются по кругу с новыми id
+def _scale_catalog(source, output, offers):
+    tree = ET.parse(source)
+    container = tree.getroot().find('shop/offers')
+    originals = list(container)
+    for offer in originals:
+        container.remove(offer)
+    for number in range(offers):
+        offer = ET.fromstring(ET.tostring(originals[number % len(originals)]))
+        offer.set('id', f"bench-{number}")
+        container.append(offer)
+    _write_stream(tree.getroot(), output)
+
+
+def bench(offers=100000, source='products_back.xml'):
+    with tempfile.TemporaryDirectory() as directory:
+        scaled = os.path.join(directory, 'products.xml')
+        _scale_catalog(source, scaled, offers)
+        print(f"Каталог: {offers} offer'ов, {os.path.getsize(scaled) / 1024 / 1024:.0f} МБ")
+        digests = []
+        for method in writers:
+            output = os.path.join(directory, f"{method}.xml")
+            result = subprocess.run([sys.executable, '-m', 'bench.writer_memory', 'run', method, scaled, output],
+                                    capture_output=True, text=True)
+            # Прежнему пути на большом каталоге может не хватить памяти, процесс убивает OOM killer
+            if result.returncode != 0:
+                print(f"{method}: процесс завершился с кодом {result.returncode}")
+                continue
+            measured = json.loads(result.stdout)
+            digests.append(measured['sha256'])
+            print(f"{method}: {measured['seconds']:.1f} с, прирост пикового RSS "
+                  f"{measured['peak_growth'] / 1024 / 1024:.0f} МБ")
+            os.remove(output)
+        if len(set(digests)) > 1:
+            print("Файлы различаются")
+        elif len(digests) == len(writers):
+            print("Файлы совпадают байт в байт")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'run':
+        run(*sys.argv[2:5])
+    else:
+        bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+              sys.argv[2] if len(sys.argv) > 2 else 'products_back.xml')
@@ -0,0 +1,74 @@
+import os
+import json
+import logging
+
+# Этот модуль - журнал сборки products.xml с нуля (XMLGenerator.generate_xml).
+# Раньше все обогащенные товары держались в памяти до единственной записи файла в конце, и падение на 900-м товаре
+# из 1000 выбрасывало минуты работы GPT и Bing. Теперь:
+# 1. Каждый готовый товар сразу дописывается в журнал одной строкой JSON (append-only, flush + fsync).
+# 2. При перезапуске журнал читается, и обрабатываются только товары, которых в нем еще нет.
+# 3. Итоговый products.xml собирается потоково, чтением журнала строка за строкой.
+# 4. После успешной публикации products.xml журнал удаляется.
+# Последняя строка может быть оборвана, если процесс упал посреди записи, такая строка пропускается.
+
+build_journal_file = os.getenv('BUILD_JOURNAL_FILE', 'products_build.jsonl')
+
+
+# numpy-числа из строк pandas (цена и т.п.) json сам не сериализует
+def _json_default(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class BuildJournal:
+    def __init__(self, path=build_journal_file):
+        self.path = path
+        self._file = None
+
+    # Товары, уже записанные в журнал, в порядке записи
+    def entries(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.endswith('\n'):
+                    logging.warning(
+                        f"Оборванная строка {line_number} в журнале {self.path} пропущена")
+                    break
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(
+                        f"Поврежденная строка {line_number} в журнале {self.path} пропущена")
+
+    def xmlids(self):
+        return {str(entry['xmlid']) for entry in self.entries()}
+
+    def append(self, product_data):
+        if self._file is None:
+            self._truncate_broken_tail()
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(product_data, ensure_ascii=False,
+                         default=_json_default) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    # Обрезать оборванную последнюю строку, иначе новая запись склеится с ней
+    def _truncate_broken_tail(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
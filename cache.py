@@ -0,0 +1,117 @@
+import json
+import time
+import sqlite3
+import threading
+
+# Этот модуль - небольшой персистентный кэш ключ-значение поверх SQLite (файл лежит в папке приложения, в docker volume,
+# поэтому переживает перезапуск контейнера).
+# 1. Значения хранятся в JSON, у каждой записи свой срок жизни (ttl в секундах, None - бессрочно).
+# 2. Размер ограничен max_entries: при переполнении вытесняются записи, к которым дольше всего не обращались (LRU).
+# 3. Считает попадания и промахи, stats() отдает их вместе с hit rate для логов.
+# Кэш используется из нескольких потоков сразу, поэтому одно соединение защищено блокировкой.
+# 4. Попадание не пишет в базу на каждый вызов: accessed_at обновляется, только если он старше touch_interval секунд
+# (для LRU этой точности хватает), а размер таблицы считается на лету, без COUNT(*) на каждую запись.
+# Просроченные записи удаляются и размер пересчитывается раз в purge_interval секунд.
+# 5. synchronous=NORMAL: в режиме WAL коммит не ждет fsync, при сбое питания теряются только последние записи кэша.
+# Из асинхронного кода кэш вызывается через asyncio.to_thread, чтобы запросы к SQLite не останавливали event loop.
+
+
+class PersistentCache:
+    def __init__(self, path, table='cache', ttl=None, max_entries=10000, touch_interval=60 * 60, purge_interval=10 * 60):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.purge_interval = purge_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)")
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+        self._connection.commit()
+        with self._lock:
+            self._purge()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT value, expires_at, accessed_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, expires_at, accessed_at = row
+            if expires_at is not None and expires_at < now:
+                self._size -= self._connection.execute(
+                    f"DELETE FROM {self.table} WHERE key = ?", (key,)).rowcount
+                self._connection.commit()
+                self.misses += 1
+                return None
+            if accessed_at < now - self.touch_interval:
+                self._connection.execute(
+                    f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+                self._connection.commit()
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            exists = self._connection.execute(
+                f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now))
+            if not exists:
+                self._size += 1
+            self._evict()
+            self._connection.commit()
+
+    # Удаление просроченных записей (раз в purge_interval) и самых давно использованных сверх max_entries
+    def _evict(self):
+        if time.monotonic() - self._purged_at > self.purge_interval:
+            self._purge()
+        if self._size > self.max_entries:
+            self._size -= self._connection.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)", (self._size - self.max_entries,)).rowcount
+
+    # Удаление просроченных записей и пересчет размера (в таблицу мог писать и другой процесс)
+    def _purge(self):
+        self._connection.execute(
+            f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+        self._size = self._connection.execute(
+            f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        self._connection.commit()
+        self._purged_at = time.monotonic()
+
+    # Есть ли непросроченная запись. В статистику попаданий не идет
+    def __contains__(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT 1 FROM {self.table} WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, time.time())).fetchone()
+        return row is not None
+
+    # Число записей, включая просроченные, но еще не удаленные
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'size': len(self),
+        }
@@ -0,0 +1,660 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from xml.etree import ElementTree as ET
+from xml_writer import XMLStreamWriter, write_xml, serialize_element
+from publisher import atomic_write, publish, feed_file, file_sha256
+from pricing import format_price
+
+# Этот модуль - хранилище каталога товаров (offer'ов products.xml) для excel_main, apply_formula, find_ids
+# и create_excel_from_xml. Раньше базой был сам products.xml: каждая операция парсила весь файл в дерево,
+# меняла несколько offer'ов и переписывала файл целиком, а изменения жили в памяти до записи файла. Теперь:
+# 1. Хранилище подключаемое (CATALOG_STORAGE): xml - прежнее дерево ElementTree в памяти, sqlite - каталог
+# в базе CATALOG_DB_FILE (по умолчанию). У обоих одинаковые операции: set_prices, archive, activate, add_offers и save.
+# 2. В SQLite offer'ы лежат в таблице offers с индексом по xmlid, картинки - в дочерней таблице pictures.
+# Изменения из Excel и правила - это UPDATE по индексу, каждая операция - своя транзакция, и изменение,
+# записанное в базу, не теряется, если процесс упал до записи products.xml.
+# 3. Каждая транзакция, которая что-то поменяла, увеличивает поколение каталога. products.xml перерисовывается
+# только если поколение отличается от уже опубликованного.
+# 4. У каждого offer'а в базе хранится его готовый XML. Изменение сбрасывает его, и при публикации заново
+# сериализуются только измененные offer'ы, остальные дописываются в файл как есть, потоком из базы.
+# 5. Если содержимое products.xml на диске (sha256) не то, что опубликовано из базы (первый запуск, сборка с нуля,
+# откат через publisher.py), он импортируется в базу заново, с предупреждением в логе. Вручную: `python catalog_store.py import [products.xml]`.
+# Время одного цикла на обоих хранилищах - bench/catalog.py.
+
+catalog_storage = os.getenv('CATALOG_STORAGE', 'sqlite')
+catalog_db_file = os.getenv('CATALOG_DB_FILE', 'catalog.sqlite3')
+
+# Поля offer'а в порядке записи в products.xml (как в XMLGenerator.build_offer) и колонки таблицы offers.
+# Картинки (picture) пишутся сразу после description
+offer_fields = (
+    ('name', 'name'),
+    ('vendor', 'vendor'),
+    ('count', 'count'),
+    ('archived', 'archived'),
+    ('disabled', 'disabled'),
+    ('price', 'price'),
+    ('categoryId', 'category_id'),
+    ('currencyId', 'currency_id'),
+    ('description', 'description'),
+    ('warranty-days', 'warranty_days'),
+    ('service-life-days', 'service_life_days'),
+    ('dimensions', 'dimensions'),
+    ('weight', 'weight'),
+)
+field_columns = dict(offer_fields)
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _placeholders(items):
+    return ','.join('?' * len(items))
+
+
+# Поля нового offer'а из обогащенного товара (см. CatalogSession.apply_summary): {тег: текст} и список картинок
+def new_offer_fields(product_data):
+    fields = {
+        'name': product_data['name'],
+        'vendor': product_data['vendor'],
+        'count': "1",
+        'archived': "false",
+        'disabled': "false",
+        'price': format_price(product_data['calculated_price']),
+        'categoryId': str(product_data['categoryId']) if product_data['categoryId'] else "1",
+        'currencyId': "RUR",
+        'description': product_data['description'],
+        'warranty-days': "P1Y",
+        'service-life-days': "P1Y",
+        'dimensions': product_data['dimensions'],
+        'weight': product_data['weight'],
+    }
+    return fields, list(product_data.get('pictures', []))
+
+
+# Индекс offer'ов по их id, строится за один проход по каталогу, чтобы не делать findall('offer') по всему
+# products.xml на каждую измененную строку. В списке лежат все offer'ы с таким id (дубликаты в файле возможны).
+
+
+def build_offer_index(offers):
+    offer_index = {}
+    for offer in offers.findall('offer'):
+        offer_index.setdefault(offer.get('id'), []).append(offer)
+    return offer_index
+
+
+# Выставить текст элемента, вернуть True если значение действительно поменялось
+
+
+def set_text(element, value):
+    if element.text == value:
+        return False
+    element.text = value
+    return True
+
+
+# Убрать отступы, оставшиеся от разбора файла (текст из одних пробелов и переводов строк): при записи
+# XMLStreamWriter расставляет отступы сам, как write_xml(strip_blank_lines=True)
+def strip_indent(elem):
+    for element in elem.iter():
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    return elem
+
+
+# Размер и mtime файла: по ним видно, что файл переписан кем-то еще
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# Версия правил из отметки рядом с products.xml, если отметка относится к этому же файлу
+def read_rules_marker(file_xml):
+    marker_file = f"{file_xml}.rules.json"
+    try:
+        with open(marker_file, 'r', encoding='utf-8') as f:
+            marker = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Не удалось прочитать {marker_file}: {e}")
+        return None
+    if marker.get('file') != file_signature(file_xml):
+        logging.info(
+            f"{file_xml} изменен после применения правил, правила будут применены целиком")
+        return None
+    return marker.get('version')
+
+
+# Каталог как дерево ElementTree: файл парсится целиком при открытии и пишется целиком в save()
+
+
+class XMLCatalog:
+    name = 'xml'
+
+    def __init__(self, file_xml):
+        self.file_xml = file_xml
+        self.tree = ET.parse(file_xml)
+        self.root = self.tree.getroot()
+        self.offers = self.root.find('shop').find('offers')
+        # Один индекс на весь цикл, общий для архивации, обновления цен, активации и правил
+        self.offer_index = build_offer_index(self.offers)
+        self.changed = False
+        # Версия правил, уже примененных к файлу на диске (отметка рядом с файлом)
+        self.rules_marker_file = f"{file_xml}.rules.json"
+        self.applied_rules_version = read_rules_marker(file_xml)
+
+    # Файл закрыт сразу после разбора, закрывать нечего. Метод есть, чтобы оба хранилища открывались одинаково:
+    # `with open_catalog(...) as catalog`
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read_rules_version(self):
+        return self.applied_rules_version
+
+    # Правила придется применить целиком: цены в файле переписаны не по правилам
+    def forget_rules(self):
+        if os.path.exists(self.rules_marker_file):
+            os.remove(self.rules_marker_file)
+        self.applied_rules_version = None
+
+    def _write_rules_marker(self, version):
+        with atomic_write(self.rules_marker_file) as f:
+            json.dump({'version': version,
+                      'file': file_signature(self.file_xml)}, f)
+        self.applied_rules_version = version
+
+    def offer_ids(self, price=None):
+        if price is None:
+            return set(self.offer_index)
+        return {offer_id for offer_id, offers in self.offer_index.items()
+                if any(offer.findtext('price') == price for offer in offers)}
+
+    def existing(self, xmlids):
+        return {xmlid for xmlid in xmlids if xmlid in self.offer_index}
+
+    # Новые цены {xmlid: цена}. Возвращает {xmlid: прежняя цена} для всех offer'ов с ценой, даже если она не поменялась
+    def set_prices(self, prices):
+        found = {}
+        for xmlid, price in prices.items():
+            for offer in self.offer_index.get(xmlid, []):
+                price_element = offer.find('price')
+                if price_element is not None:
+                    found[xmlid] = price_element.text
+                    self.changed |= set_text(price_element, str(price))
+        return found
+
+    # Архивировать и отключить offer'ы, возвращает xmlid, у которых что-то поменялось
+    def archive(self, xmlids):
+        archived_ids = []
+        for xmlid in xmlids:
+            changed = False
+            for offer in self.offer_index.get(xmlid, []):
+                for tag in ('archived', 'disabled'):
+                    element = offer.find(tag)
+                    if element is None:
+                        element = ET.SubElement(offer, tag)
+                    changed |= set_text(element, 'true')
+            if changed:
+                archived_ids.append(xmlid)
+                self.changed = True
+        return archived_ids
+
+    # Вернуть в продажу архивный и отключенный offer с новой ценой {xmlid: цена}.
+    # Возвращает {xmlid: прежняя цена} для активированных (None, если у offer'а нет цены)
+    def activate(self, prices):
+        activated = {}
+        for xmlid, price in prices.items():
+            for offer in self.offer_index.get(xmlid, []):
+                archived = offer.find('archived')
+                disabled = offer.find('disabled')
+                if archived is not None and disabled is not None and archived.text == 'true' and disabled.text == 'true':
+                    archived.text = 'false'
+                    disabled.text = 'false'
+                    self.changed = True
+                    price_element = offer.find('price')
+                    activated[xmlid] = price_element.text if price_element is not None else None
+                    if price_element is not None:
+                        price_element.text = str(price)
+                    break
+        return activated
+
+    def add_offers(self, products):
+        for product_data in products:
+            fields, pictures = new_offer_fields(product_data)
+            offer = ET.SubElement(
+                self.offers, "offer", id=str(product_data['xmlid']))
+            self.offer_index.setdefault(offer.get('id'), []).append(offer)
+            for tag, text in fields.items():
+                element = ET.SubElement(offer, tag)
+                element.text = text
+                if tag == 'description':
+                    for image_url in pictures:
+                        picture = ET.SubElement(offer, "picture")
+                        picture.text = image_url
+            self.changed = True
+
+    # Неархивные offer'ы: (xmlid, название, цена)
+    def active_offers(self):
+        for offer in self.offers.findall('offer'):
+            archived = offer.find('archived')
+            if archived is not None and archived.text == 'true':
+                continue
+            price = offer.find('price')
+            name = offer.find('name')
+            yield offer.get('id'), name.text if name is not None else '', price.text if price is not None else ''
+
+    # Запись products.xml, только если что-то поменялось. Возвращает True, если файл был записан.
+    # Вместе с файлом обновляется отметка о примененной версии правил
+    def save(self, rules_version=None):
+        if not self.changed:
+            logging.info(
+                f"Изменений в каталоге нет, {self.file_xml} не перезаписывается")
+            if rules_version is not None and rules_version != self.applied_rules_version:
+                self._write_rules_marker(rules_version)
+            return False
+
+        # Обновление даты в верхней строке
+        self.root.set('date', datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z"))
+
+        # Запись XML с отступами сразу в файл
+        write_xml(self.root, self.file_xml)
+        self.changed = False
+        if rules_version is not None:
+            self._write_rules_marker(rules_version)
+        logging.info(f"XML файл успешно обновлен: {self.file_xml}")
+        return True
+
+
+# Каталог в SQLite. products.xml - только публикация содержимого базы
+
+
+class SQLiteCatalog:
+    name = 'sqlite'
+
+    # sync=False - не сверять products.xml с базой при открытии (для команд import и render)
+    def __init__(self, file_xml, path=catalog_db_file, sync=True):
+        self.file_xml = file_xml
+        self.path = path
+        self.changed = False
+        # isolation_level=None: транзакции открываются явно, как в rules_store.py
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        columns = ', '.join(f"{column} TEXT" for _, column in offer_fields)
+        # id - порядок offer'а в products.xml, xml - готовый offer для записи в файл (NULL - нужно сериализовать заново)
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS offers (id INTEGER PRIMARY KEY, xmlid TEXT NOT NULL, {columns}, extra TEXT, xml TEXT)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS offers_xmlid ON offers (xmlid)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS offers_dirty ON offers (id) WHERE xml IS NULL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pictures (offer INTEGER NOT NULL, position INTEGER NOT NULL, url TEXT NOT NULL, "
+            "PRIMARY KEY (offer, position)) WITHOUT ROWID")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._connection.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+        if sync:
+            self._sync_with_file()
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Транзакция на запись. Если в ней изменились строки каталога и bump=True, поколение каталога увеличивается
+    @contextmanager
+    def _transaction(self, bump=True):
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        changes = connection.total_changes
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if bump and connection.total_changes != changes:
+            connection.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            self.changed = True
+        connection.execute("COMMIT")
+
+    def _get(self, key, default=None):
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    @staticmethod
+    def _set(connection, key, value):
+        connection.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value))
+
+    def generation(self):
+        return self._get('generation')
+
+    # Файл на диске не тот, что опубликован из базы или импортирован в нее - импортировать его.
+    # Размер и mtime - только быстрая проверка: если они поменялись, сравнивается sha256 содержимого,
+    # и файл, переписанный тем же содержимым (touch, копия), заново не импортируется
+    def _sync_with_file(self):
+        if not os.path.exists(self.file_xml):
+            return
+        signature = json.dumps(file_signature(self.file_xml))
+        if signature == self._get('file'):
+            return
+        if self._get('file') is None:
+            logging.info(f"Каталог в {self.path} пуст, {self.file_xml} импортируется в него")
+            self.import_file()
+            return
+        if file_sha256(self.file_xml) == self._get('sha256'):
+            with self._transaction(bump=False) as connection:
+                self._set(connection, 'file', signature)
+            return
+        logging.warning(
+            f"{self.file_xml} переписан не из {self.path} (сборка с нуля, откат или правка вручную), каталог "
+            f"импортируется из файла заново: изменения поколения {self.generation()}, которых нет в файле, теряются")
+        self.import_file()
+
+    # Загрузка products.xml в базу с заменой всего каталога. Файл читается потоком (iterparse), в памяти
+    # держится только текущий offer. Готовый XML offer'ов не сохраняется, он сериализуется при первой публикации
+    def import_file(self, file_xml=None):
+        file_xml = file_xml or self.file_xml
+        started = time.perf_counter()
+        root = None
+        header, footer = [], []
+        offers_seen = False
+        count = 0
+        rows, pictures = [], []
+        with self._transaction(bump=False) as connection:
+            connection.execute("DELETE FROM offers")
+            connection.execute("DELETE FROM pictures")
+            path = []
+            offers = None
+            for event, elem in ET.iterparse(file_xml, events=('start', 'end')):
+                if event == 'start':
+                    path.append(elem)
+                    if len(path) == 1:
+                        root = {'tag': elem.tag, 'attrib': dict(elem.attrib)}
+                    elif len(path) == 3 and elem.tag == 'offers':
+                        offers = elem
+                    continue
+                path.pop()
+                if len(path) == 3 and path[-1] is offers and elem.tag == 'offer':
+                    count += 1
+                    rows.append(self._offer_row(count, elem, pictures))
+                    # Разобранные offer'ы больше не нужны, дерево не растет
+                    offers.clear()
+                    if len(rows) >= 1000:
+                        self._insert_rows(connection, rows, pictures)
+                elif len(path) == 2:
+                    if elem is offers:
+                        offers_seen = True
+                    else:
+                        (footer if offers_seen else header).append(
+                            serialize_element(strip_indent(elem), level=2))
+            self._insert_rows(connection, rows, pictures)
+            connection.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            generation = self._get('generation')
+            self._set(connection, 'root', json.dumps(root, ensure_ascii=False))
+            self._set(connection, 'header', json.dumps(header, ensure_ascii=False))
+            self._set(connection, 'footer', json.dumps(footer, ensure_ascii=False))
+            # Файл на диске и есть это поколение каталога, перерисовывать его не нужно
+            self._set(connection, 'rendered_generation', generation)
+            self._set(connection, 'file', json.dumps(file_signature(file_xml)))
+            self._set(connection, 'sha256', file_sha256(file_xml))
+            # Отметка о правилах, примененных к файлу, переносится в базу
+            self._set(connection, 'rules_version', read_rules_marker(file_xml))
+        logging.info(f"{file_xml} импортирован в {self.path}: {count} offer'ов, поколение {
+                     generation}, {time.perf_counter() - started:.2f} с")
+        return count
+
+    # Строка таблицы offers из элемента offer. Теги, которых нет в offer_fields, и атрибуты кроме id
+    # сохраняются в extra как есть и пишутся в конце offer'а
+    @staticmethod
+    def _offer_row(offer_id, elem, pictures):
+        values = {}
+        extra = []
+        position = 0
+        for child in elem:
+            if child.tag == 'picture':
+                pictures.append((offer_id, position, child.text or ''))
+                position += 1
+            elif child.tag in field_columns and child.tag not in values:
+                values[child.tag] = child.text or ''
+            else:
+                extra.append(ET.tostring(strip_indent(child), encoding='unicode'))
+        attrib = {key: value for key, value in elem.attrib.items() if key != 'id'}
+        extra = json.dumps({'attrib': attrib, 'elements': extra}, ensure_ascii=False) \
+            if extra or attrib else None
+        return (offer_id, elem.get('id', ''), *(values.get(tag) for tag, _ in offer_fields), extra)
+
+    @staticmethod
+    def _insert_rows(connection, rows, pictures):
+        columns = ', '.join(column for _, column in offer_fields)
+        connection.executemany(
+            f"INSERT INTO offers (id, xmlid, {columns}, extra) VALUES (?, ?, {_placeholders(offer_fields)}, ?)", rows)
+        connection.executemany(
+            "INSERT INTO pictures (offer, position, url) VALUES (?, ?, ?)", pictures)
+        rows.clear()
+        pictures.clear()
+
+    def read_rules_version(self):
+        return self._get('rules_version')
+
+    def forget_rules(self):
+        with self._transaction(bump=False) as connection:
+            self._set(connection, 'rules_version', None)
+
+    def offer_ids(self, price=None):
+        if price is None:
+            return {row[0] for row in self._connection.execute("SELECT DISTINCT xmlid FROM offers")}
+        return {row[0] for row in self._connection.execute(
+            "SELECT DISTINCT xmlid FROM offers WHERE price = ?", (price,))}
+
+    def existing(self, xmlids):
+        found = set()
+        for chunk in _chunks(xmlids):
+            found.update(row[0] for row in self._connection.execute(
+                f"SELECT DISTINCT xmlid FROM offers WHERE xmlid IN ({_placeholders(chunk)})", chunk))
+        return found
+
+    def set_prices(self, prices):
+        found = {}
+        with self._transaction() as connection:
+            for chunk in _chunks(prices):
+                found.update(connection.execute(
+                    f"SELECT xmlid, price FROM offers WHERE xmlid IN ({_placeholders(chunk)}) AND price IS NOT NULL",
+                    chunk).fetchall())
+            connection.executemany(
+                "UPDATE offers SET price = ?, xml = NULL WHERE xmlid = ? AND price IS NOT NULL AND price != ?",
+                [(str(prices[xmlid]), xmlid, str(prices[xmlid])) for xmlid in found])
+        return found
+
+    def archive(self, xmlids):
+        archived_ids = []
+        with self._transaction() as connection:
+            for xmlid in xmlids:
+                if connection.execute(
+                        "UPDATE offers SET archived = 'true', disabled = 'true', xml = NULL "
+                        "WHERE xmlid = ? AND (archived IS NOT 'true' OR disabled IS NOT 'true')", (xmlid,)).rowcount:
+                    archived_ids.append(xmlid)
+        return archived_ids
+
+    def activate(self, prices):
+        activated = {}
+        with self._transaction() as connection:
+            for xmlid, price in prices.items():
+                row = connection.execute(
+                    "SELECT id, price FROM offers WHERE xmlid = ? AND archived = 'true' AND disabled = 'true' "
+                    "ORDER BY id LIMIT 1", (xmlid,)).fetchone()
+                if row is None:
+                    continue
+                connection.execute(
+                    "UPDATE offers SET archived = 'false', disabled = 'false', "
+                    "price = CASE WHEN price IS NULL THEN NULL ELSE ? END, xml = NULL WHERE id = ?", (str(price), row[0]))
+                activated[xmlid] = row[1]
+        return activated
+
+    def add_offers(self, products):
+        with self._transaction() as connection:
+            offer_id = connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM offers").fetchone()[0]
+            rows, pictures = [], []
+            for product_data in products:
+                offer_id += 1
+                fields, urls = new_offer_fields(product_data)
+                rows.append((offer_id, str(product_data['xmlid']),
+                             *(fields.get(tag) for tag, _ in offer_fields), None))
+                pictures.extend((offer_id, position, url)
+                                for position, url in enumerate(urls))
+            self._insert_rows(connection, rows, pictures)
+
+    def active_offers(self):
+        return self._connection.execute(
+            "SELECT xmlid, COALESCE(name, ''), COALESCE(price, '') FROM offers "
+            "WHERE archived IS NOT 'true' ORDER BY id").fetchall()
+
+    # Элемент offer из строки таблицы и его картинок
+    @staticmethod
+    def _offer_element(row, urls):
+        xmlid, values, extra = row[1], row[2:-1], row[-1]
+        extra = json.loads(extra) if extra else {'attrib': {}, 'elements': []}
+        offer = ET.Element("offer", {'id': xmlid, **extra['attrib']})
+        for (tag, _), text in zip(offer_fields, values):
+            if text is not None:
+                element = ET.SubElement(offer, tag)
+                element.text = text or None
+            if tag == 'description':
+                for url in urls:
+                    picture = ET.SubElement(offer, "picture")
+                    picture.text = url or None
+        for element in extra['elements']:
+            offer.append(ET.fromstring(element))
+        return offer
+
+    # Сериализовать offer'ы, у которых нет готового XML (новые и измененные с прошлой публикации)
+    def _serialize_changed(self):
+        columns = ', '.join(column for _, column in offer_fields)
+        count = 0
+        with self._transaction(bump=False) as connection:
+            changed = [row[0] for row in connection.execute(
+                "SELECT id FROM offers WHERE xml IS NULL")]
+            for chunk in _chunks(changed):
+                urls = {}
+                for offer_id, url in connection.execute(
+                        f"SELECT offer, url FROM pictures WHERE offer IN ({_placeholders(chunk)}) ORDER BY offer, position", chunk):
+                    urls.setdefault(offer_id, []).append(url)
+                rows = connection.execute(
+                    f"SELECT id, xmlid, {columns}, extra FROM offers WHERE id IN ({_placeholders(chunk)})", chunk).fetchall()
+                connection.executemany("UPDATE offers SET xml = ? WHERE id = ?", [
+                    (serialize_element(self._offer_element(row, urls.get(row[0], [])), level=3), row[0]) for row in rows])
+                count += len(rows)
+        return count
+
+    # Публикация products.xml из базы: шапка, готовые offer'ы в порядке id и закрывающие теги
+    def render(self):
+        started = time.perf_counter()
+        serialized = self._serialize_changed()
+        connection = self._connection
+        # Чтение одного снимка базы: поколение и offer'ы не разойдутся
+        connection.execute("BEGIN")
+        try:
+            generation = self._get('generation')
+            root = json.loads(self._get('root') or 'null') or {'tag': 'yml_catalog', 'attrib': {}}
+            header = json.loads(self._get('header') or '[]')
+            footer = json.loads(self._get('footer') or '[]')
+            offers = 0
+            with publish(self.file_xml) as f:
+                writer = XMLStreamWriter(f)
+                writer.start_document()
+                writer.start(root['tag'], {**root['attrib'],
+                             'date': datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z")})
+                writer.start("shop")
+                writer.raw(''.join(header))
+                writer.start("offers")
+                cursor = connection.execute("SELECT xml FROM offers ORDER BY id")
+                while True:
+                    rows = cursor.fetchmany(1000)
+                    if not rows:
+                        break
+                    writer.lines(''.join(row[0] for row in rows))
+                    offers += len(rows)
+                writer.end()
+                writer.raw(''.join(footer))
+                writer.close()
+        finally:
+            connection.execute("COMMIT")
+        with self._transaction(bump=False) as connection:
+            self._set(connection, 'rendered_generation', generation)
+            self._set(connection, 'file', json.dumps(file_signature(self.file_xml)))
+            self._set(connection, 'sha256', file_sha256(self.file_xml))
+        logging.info(f"{self.file_xml} опубликован из {self.path}: поколение {generation}, {offers} offer'ов, "
+                     f"сериализовано заново {serialized}, {time.perf_counter() - started:.2f} с")
+
+    # Публикация products.xml, только если поколение каталога не то, что уже опубликовано
+    def save(self, rules_version=None):
+        if rules_version is not None:
+            with self._transaction(bump=False) as connection:
+                self._set(connection, 'rules_version', rules_version)
+        generation = self.generation()
+        if generation == self._get('rendered_generation') and os.path.exists(self.file_xml):
+            logging.info(
+                f"Каталог не менялся (поколение {generation}), {self.file_xml} не перезаписывается")
+            return False
+        self.render()
+        self.changed = False
+        return True
+
+
+catalogs = {
+    XMLCatalog.name: XMLCatalog,
+    SQLiteCatalog.name: SQLiteCatalog,
+}
+
+
+# Каталог в выбранном хранилище. Открывать через with: соединение с базой SQLite закрывается на выходе
+def open_catalog(file_xml=feed_file, storage=catalog_storage):
+    if storage not in catalogs:
+        raise ValueError(
+            f"Неизвестное хранилище каталога {storage}, доступны: {', '.join(catalogs)}")
+    return catalogs[storage](file_xml)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    file_xml = sys.argv[2] if len(sys.argv) > 2 else feed_file
+    if command == 'import':
+        with SQLiteCatalog(file_xml, sync=False) as catalog:
+            catalog.import_file()
+    elif command == 'render':
+        with SQLiteCatalog(file_xml, sync=False) as catalog:
+            catalog.render()
+    else:
+        logging.error("Использование: python catalog_store.py import [products.xml] | render [products.xml]")
+        sys.exit(1)
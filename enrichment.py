@@ -0,0 +1,180 @@
+import os
+import asyncio
+import logging
+from gpt_bulk import load_prompt
+from throttle import Throttled
+
+# Этот модуль - бэкенды обогащения товаров через OpenAI (размеры, вес, vendor, категория, название, описание).
+# Раньше каждый товар шел через ассистента: threads.create, runs.create, опрос runs.retrieve раз в секунду
+# и messages.list, то есть не меньше секунды ожидания и 4+ запросов на товар (каждый через OPENAI_PROXY_URL). Теперь:
+# 1. XMLGenerator работает с бэкендом через reply(): сообщение товара (или пакета товаров) -> текст JSON-ответа.
+# 2. ChatBackend - один запрос chat completions со structured output (JSON-схема с шестью полями), промпт
+# ассистента из GPT_PROMPT_FILE уходит системным сообщением. Это бэкенд по умолчанию (GPT_BACKEND=chat).
+# 3. AssistantBackend - прежний путь через ассистента ASSISTANT_ID, используется как запасной (GPT_FALLBACK_BACKEND):
+# если основной бэкенд не дал ответа или вернул ошибку запроса, товар запрашивается у запасного.
+# 4. У каждого бэкенда считается время ответа на товар, stats() отдает медиану и p95 для логов и /status.
+# Сравнение бэкендов на первых товарах products.xlsx - в bench/enrichment_compare.py.
+
+gpt_backend = os.getenv('GPT_BACKEND', 'chat')
+# Пустая строка - без запасного бэкенда
+gpt_fallback_backend = os.getenv('GPT_FALLBACK_BACKEND', 'assistant')
+gpt_model = os.getenv('GPT_MODEL', 'gpt-4o-mini')
+gpt_prompt_file = os.getenv('GPT_PROMPT_FILE', 'prompt_for_gpt_assistant.txt')
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+# JSON-схема ответа: объект с полями fields, для пакета - {"items": [...]} с полем xmlid у каждого товара
+def product_schema(fields, batch=False):
+    properties = {field: {'type': 'string'} for field in fields}
+    if not batch:
+        return {'type': 'object', 'properties': properties,
+                'required': list(fields), 'additionalProperties': False}
+    item = product_schema(('xmlid',) + tuple(fields))
+    return {'type': 'object', 'properties': {'items': {'type': 'array', 'items': item}},
+            'required': ['items'], 'additionalProperties': False}
+
+
+class EnrichmentBackend:
+    name = None
+
+    # stage - стадия gpt конвейера (throttle.Stage): слоты, повторы и размыкание цепи общие для всех бэкендов
+    def __init__(self, openai, stage, fields):
+        self.openai = openai
+        self.stage = stage
+        self.fields = fields
+        self.latencies = []
+        self.calls = 0
+        self.failures = 0
+
+    # Текст ответа модели на сообщение content (None - ответа нет). instructions - дополнение к промпту
+    # только для этого запроса, batch - в сообщении пакет товаров и ожидается ответ {"items": [...]}
+    async def reply(self, content, instructions=None, batch=False):
+        raise NotImplementedError
+
+    # Время ответа записывается для каждого товара: товар из пакета ждал ответа столько же, сколько весь пакет
+    def record(self, elapsed, products=1, ok=True):
+        self.calls += 1
+        if not ok:
+            self.failures += 1
+            return
+        self.latencies.extend([elapsed] * products)
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'calls': self.calls,
+            'failures': self.failures,
+            'products': len(self.latencies),
+            'p50': round(_percentile(self.latencies, 50), 3) if self.latencies else None,
+            'p95': round(_percentile(self.latencies, 95), 3) if self.latencies else None,
+        }
+
+
+class ChatBackend(EnrichmentBackend):
+    name = 'chat'
+
+    def __init__(self, openai, stage, fields, model=gpt_model, prompt_file=gpt_prompt_file):
+        super().__init__(openai, stage, fields)
+        self.model = model
+        self.prompt = load_prompt(prompt_file)
+
+    async def reply(self, content, instructions=None, batch=False):
+        prompt = f"{self.prompt}\n\n{instructions}" if instructions else self.prompt
+        response_format = {'type': 'json_schema', 'json_schema': {
+            'name': 'products' if batch else 'product', 'strict': True,
+            'schema': product_schema(self.fields, batch)}}
+        response = await self.stage.call(lambda: self.openai.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": content}
+            ],
+            response_format=response_format
+        ))
+        message = response.choices[0].message
+        if getattr(message, 'refusal', None):
+            logging.error(f"Модель отказалась отвечать: {message.refusal}")
+            return None
+        logging.info(f"Chat response content: {message.content}")
+        return message.content
+
+
+class AssistantBackend(EnrichmentBackend):
+    name = 'assistant'
+
+    def __init__(self, openai, stage, fields, assistant_id=None):
+        super().__init__(openai, stage, fields)
+        self.assistant_id = assistant_id or os.getenv('ASSISTANT_ID')
+
+    # Один запуск ассистента: thread с сообщением content, run, опрос статуса и текст ответа ассистента.
+    # Формат пакетного ответа задает instructions (additional_instructions запуска)
+    async def reply(self, content, instructions=None, batch=False):
+        gpt = self.stage
+        # Создание потока сообщений
+        # Каждый запрос идет в своем thread, чтобы запросы обрабатывались параллельно. Ожидание ответа
+        # (опрос статуса раз в секунду) не занимает поток, а только слот стадии gpt
+        async with gpt.slot():
+            thread = await gpt.request(lambda: self.openai.beta.threads.create(
+                messages=[
+                    {"role": "user", "content": content}
+                ]
+            ))
+            logging.info(f"Thread created: {thread.id}")
+
+            # Создание и выполнение запуска
+            run_params = {'thread_id': thread.id, 'assistant_id': self.assistant_id}
+            if instructions:
+                run_params['additional_instructions'] = instructions
+            run = await gpt.request(lambda: self.openai.beta.threads.runs.create(**run_params))
+            logging.info(f"Run created: {run.id}")
+
+            status = run.status
+
+            while status not in ['completed', 'failed', 'cancelled', 'expired', 'incomplete']:
+                await asyncio.sleep(1)
+                run = await gpt.request(lambda: self.openai.beta.threads.runs.retrieve(
+                    thread_id=thread.id, run_id=run.id))
+                status = run.status
+                logging.info(f"Run status: {status}")
+
+            # Лимит OpenAI внутри run приходит не статусом 429, а неудачным run: для стадии gpt это та же перегрузка
+            if status == 'failed' and run.last_error is not None and run.last_error.code == 'rate_limit_exceeded':
+                raise Throttled(f"Run {run.id}: {run.last_error.message}")
+
+            messages = await gpt.request(lambda: self.openai.beta.threads.messages.list(
+                thread_id=thread.id
+            ))
+        logging.info(f"Messages retrieved: {len(messages.data)}")
+
+        for message in messages.data:
+            logging.info(f"Message role: {message.role}")
+            if message.role == 'assistant':
+                content = ''.join(
+                    [content_block.text.value for content_block in message.content if content_block.type == 'text'])
+                logging.info(f"Assistant response content: {content}")
+                return content
+
+        logging.error(f"Ответ для GPT НЕ получен!! {
+                      messages.data}\n\nОшибка GPT:{messages}")
+        return None
+
+
+backends = {
+    ChatBackend.name: ChatBackend,
+    AssistantBackend.name: AssistantBackend,
+}
+
+
+# Бэкенды в порядке использования: основной и запасной (если задан, отличается от основного и для ассистента есть ASSISTANT_ID)
+def create_backends(openai, stage, fields, primary=gpt_backend, fallback=gpt_fallback_backend):
+    names = [primary]
+    if fallback and fallback != primary and (fallback != AssistantBackend.name or os.getenv('ASSISTANT_ID')):
+        names.append(fallback)
+    for name in names:
+        if name not in backends:
+            raise ValueError(f"Неизвестный бэкенд GPT {name}, доступны: {', '.join(backends)}")
+    return [backends[name](openai, stage, fields) for name in names]
@@ -1,26 +1,27 @@
 import os
 import time
-import pandas as pd
 import logging
 from datetime import datetime
-from xml.etree import ElementTree as ET
-from xml.dom import minidom
-from xml_converter import XMLGenerator, image_count
-import re
-import json
+from xml_converter import XMLGenerator, image_count, gpt_cache
+from pricing import calculate_prices, format_price
+from catalog_store import catalog_storage, open_catalog
+from publisher import feed_file, move_legacy_feed
+from workbook import workbooks
+from build_journal import build_journal_file
+from rules_store import rules_store
 
 # Этот скрипт предназначен для сравнения двух Excel-файлов (products_old.xlsx и products.xlsx),
 # выявления изменений и обновления XML-файла (products.xml) на основе этих изменений.
-# Он также применяет пользовательские правила из файла rules.json к XML-файлу.
+# Он также применяет пользовательские правила из хранилища правил (rules_store.py) к XML-файлу.
 # Скрипт выполняет следующие основные задачи:
 # 1. Сравнивает старый и новый Excel-файлы, чтобы определить добавленные, удаленные и обновленные товары.
 # 2. Обновляет XML-файл на основе выявленных изменений.
 # 3. Применяет пользовательские правила к XML-файлу.
 # 4. Логирует все изменения и действия, выполняемые скриптом.
 
-# текущий существенный минус данной реализации, это то что операции выполняются и хранятся в памяти RAM до тех пор, пока не запишется
-# файл products.xml, это плохо, не только потому что возможны утечки памяти и излишнее потребление ресурсов, но в основном,
-# по тому, что если что-то пойдет не так, и не запишет в файл информацию, придется отрабатывать с начала, изменения потеряются.
+# Раньше операции выполнялись и хранились в памяти RAM до тех пор, пока не запишется файл products.xml, и если что-то
+# шло не так до записи файла, изменения терялись. Теперь каталог по умолчанию хранится в SQLite (CATALOG_STORAGE, см. catalog_store.py):
+# каждое изменение сразу записывается в базу, а products.xml публикуется из базы в конце цикла.
 
 # Настройка логирования
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -31,306 +32,303 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(console_handler)
 
-# Класс, который сравнивает products_old.xlsx и products.xlsx и добавляет в файл products.xml изменения
-
+# Изменения между products_old.xlsx и products.xlsx. Каждый набор - DataFrame с нужными колонками
+# (без перевода в списки словарей), пустой DataFrame значит, что изменений такого типа нет:
+# added / removed - xmlid, description, price
+# updated_price - xmlid, price_new, price_old
+# updated_description - xmlid, description_new, description_old
 
-class ExcelComparator:
 
-    def __init__(self, file_new, file_old):
-        self.file_new = file_new
-        self.file_old = file_old
-        self.df_new = pd.read_excel(file_new, dtype={'xmlid': str})
-        self.df_old = pd.read_excel(file_old, dtype={'xmlid': str})
-
-    # Получение добавленных строк
-    def get_added_rows(self):
-        added_rows = self.df_new[~self.df_new['xmlid'].isin(
-            self.df_old['xmlid'])]
-        return added_rows
-
-    # Получение удаленных строк
-    def get_removed_rows(self):
-        removed_rows = self.df_old[~self.df_old['xmlid'].isin(
-            self.df_new['xmlid'])]
-        return removed_rows
-
-    # Получение обновленных цен
-    def get_updated_price(self):
-        merged = self.df_new.merge(
-            self.df_old, on='xmlid', suffixes=('_new', '_old'))
-        updated_price = merged[merged['price_new'] != merged['price_old']]
-        return updated_price[['xmlid', 'price_new', 'price_old']]
-
-    # Получение обновленных описаний
-    def get_updated_description(self):
-        merged = self.df_new.merge(
-            self.df_old, on='xmlid', suffixes=('_new', '_old'))
-        updated_description = merged[merged['description_new']
-                                     != merged['description_old']]
-        return updated_description[['xmlid', 'description_new', 'description_old']]
-
-    # Генерация сводки изменений
-    def generate_summary(self):
-        added_rows = self.get_added_rows().to_dict(orient='records')
-        removed_rows = self.get_removed_rows().to_dict(orient='records')
-        updated_price = self.get_updated_price().to_dict(orient='records')
-        updated_description = self.get_updated_description().to_dict(orient='records')
-
-        summary = {
-            "added_rows": added_rows if added_rows else "No changes",
-            "removed_rows": removed_rows if removed_rows else "No changes",
-            "updated_price": updated_price if updated_price else "No changes",
-            "updated_description": updated_description if updated_description else "No changes"
-        }
+class ChangeSet:
+    sections = ('added', 'removed', 'updated_price', 'updated_description')
 
-        return summary
-
-# Обновленная формула, которая добавляет к цене из Products.xlsx коэффициент, чтобы продажа на Yandex Market'e
-# была выгодна.
-
-
-def calculate_price(price):
-    if price < 10000:
-        return price * 1.45
-    elif 10000 <= price < 11000:
-        return price * 1.43
-    elif 11000 <= price < 13000:
-        return price * 1.42
-    elif 13000 <= price < 15000:
-        return price * 1.41
-    elif 15000 <= price < 18000:
-        return price * 1.395
-    elif 18000 <= price < 20000:
-        return price * 1.387
-    elif 20000 <= price < 30000:
-        return price * 1.36
-    elif 30000 <= price < 40000:
-        return price * 1.35
-    elif 40000 <= price < 50000:
-        return price * 1.34
-    elif 50000 <= price < 60000:
-        return price * 1.33
-    elif 60000 <= price < 70000:
-        return price * 1.325
-    elif 70000 <= price < 80000:
-        return price * 1.318
-    elif 80000 <= price < 90000:
-        return price * 1.315
-    elif 90000 <= price < 100000:
-        return price * 1.308
-    elif price >= 100000:
-        return price * 1.305
-
-
-def update_xml(file_xml, summary, products_file):
-    xml_generator = XMLGenerator(products_file)
-
-    tree = ET.parse(file_xml)
-    root = tree.getroot()
-    offers = root.find('shop').find('offers')
-
-    # Обновление архивных и отключенных строк
-    for removed in summary['removed_rows']:
-        if isinstance(removed, dict):
-            for offer in offers.findall('offer'):
-                if offer.get('id') == removed['xmlid']:
-                    logging.info(f"Архивирование и отключение offer с ID {
-                                 removed['xmlid']}")
-                    archived = offer.find('archived')
-                    if archived is not None:
-                        archived.text = 'true'
-                    else:
-                        archived = ET.SubElement(offer, "archived")
-                        archived.text = 'true'
-                    disabled = offer.find('disabled')
-                    if disabled is not None:
-                        disabled.text = 'true'
-                    else:
-                        disabled = ET.SubElement(offer, "disabled")
-                        disabled.text = 'true'
-
-    # Обновление цен
-    for updated in summary['updated_price']:
-        if isinstance(updated, dict) and 'price_new' in updated:
-            for offer in offers.findall('offer'):
-                if offer.get('id') == updated['xmlid']:
-                    price_element = offer.find('price')
-                    if price_element is not None:
-                        new_price = calculate_price(
-                            float(updated['price_new']))
-                        logging.info(f"Обновление цены для offer с ID {updated['xmlid']}: {
-                                     price_element.text} -> {new_price}")
-                        price_element.text = str(new_price)
-
-    # Добавление новых строк или активация существующих
-    for added in summary['added_rows']:
-        if isinstance(added, dict):
-            found = False
-            for offer in offers.findall('offer'):
-                if offer.get('id') == added['xmlid']:
-                    archived = offer.find('archived')
-                    disabled = offer.find('disabled')
-                    if archived is not None and disabled is not None and archived.text == 'true' and disabled.text == 'true':
-                        logging.info(f"Активирование offer с ID {
-                                     added['xmlid']}")
-                        archived.text = 'false'
-                        disabled.text = 'false'
-                        price_element = offer.find('price')
-                        if price_element is not None:
-                            new_price = calculate_price(float(added['price']))
-                            logging.info(f"Обновление цены для offer с ID {added['xmlid']}: {
-                                         price_element.text} -> {new_price}")
-                            price_element.text = str(new_price)
-                        found = True
-                        break
-            if not found:
-                logging.info(f"Добавление нового offer с ID {added['xmlid']}")
-                product_data = xml_generator.process_product(added)
-                if product_data:
-                    offer = ET.SubElement(
-                        offers, "offer", id=str(product_data['xmlid']))
-                    name = ET.SubElement(offer, "name")
-                    name.text = product_data['name']
-                    vendor = ET.SubElement(offer, "vendor")
-                    vendor.text = product_data['vendor']
-                    count = ET.SubElement(offer, "count")
-                    count.text = "1"
-                    archived = ET.SubElement(offer, "archived")
-                    archived.text = "false"
-                    disabled = ET.SubElement(offer, "disabled")
-                    disabled.text = "false"
-                    price = ET.SubElement(offer, "price")
-                    price.text = str(product_data['calculated_price'])
-                    categoryId = ET.SubElement(offer, "categoryId")
-                    categoryId.text = product_data['categoryId'] if product_data['categoryId'] else "1"
-                    currencyId = ET.SubElement(offer, "currencyId")
-                    currencyId.text = "RUR"
-                    description = ET.SubElement(offer, "description")
-                    description.text = product_data['description']
-
-                    for image_url in product_data.get('pictures', []):
-                        picture = ET.SubElement(offer, "picture")
-                        picture.text = image_url
-
-                    warranty_days = ET.SubElement(offer, "warranty-days")
-                    warranty_days.text = "P1Y"
-                    service_life_days = ET.SubElement(
-                        offer, "service-life-days")
-                    service_life_days.text = "P1Y"
-                    dimensions = ET.SubElement(offer, "dimensions")
-                    dimensions.text = product_data['dimensions']
-                    weight = ET.SubElement(offer, "weight")
-                    weight.text = product_data['weight']
-
-    # Удаление лишних пробелов и форматирование XML с отступами
-    xml_str = ET.tostring(root, encoding='utf-8')
-    parsed_str = minidom.parseString(xml_str).toprettyxml(indent="  ")
-    parsed_str = '\n'.join(
-        [line for line in parsed_str.split('\n') if line.strip()])
-
-    # Обновление даты в верхней строке
-    current_date = datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z")
-    parsed_str = re.sub(r'<yml_catalog date=".*?">',
-                        f'<yml_catalog date="{current_date}">', parsed_str)
-
-    with open(file_xml, "w", encoding="utf-8") as f:
-        f.write(parsed_str)
-    logging.info(f"XML файл успешно обновлен: {file_xml}")
+    def __init__(self, added, removed, updated_price, updated_description):
+        self.added = added
+        self.removed = removed
+        self.updated_price = updated_price
+        self.updated_description = updated_description
 
-# Функция в которой к файлу productx.xml применяются кастомные правила созданные через WebUI
-#  market-rules.aposazhennikov.ru
+    def __bool__(self):
+        return any(not getattr(self, section).empty for section in self.sections)
 
+    def counts(self):
+        return {section: len(getattr(self, section)) for section in self.sections}
 
-def apply_rules(file_xml, rules_file):
-    if not os.path.exists(rules_file):
-        logging.info(f"Файл {rules_file} не найден.")
-        return
+    # Логирование сводки, по строке на каждое изменение
+    def log(self):
+        titles = {
+            'added': "Added Rows:",
+            'removed': "\nRemoved Rows:",
+            'updated_price': "\nUpdated Price:",
+            'updated_description': "\nUpdated Description:",
+        }
+        for section in self.sections:
+            frame = getattr(self, section)
+            logger.info(titles[section])
+            if frame.empty:
+                logger.info("  No changes")
+                continue
+            columns = list(frame.columns)
+            for values in frame.itertuples(index=False, name=None):
+                logger.info(f"  {dict(zip(columns, values))}")
+        logger.info(f"Итого изменений: {self.counts()}")
 
-    with open(rules_file, 'r') as file:
-        rules = json.load(file)
 
-    tree = ET.parse(file_xml)
-    root = tree.getroot()
-    offers = root.find('shop').find('offers')
+# Класс, который сравнивает products_old.xlsx и products.xlsx и добавляет в файл products.xml изменения
 
-    for offer in offers.findall('offer'):
-        offer_id = offer.get('id')
-        if offer_id in rules:
-            price = offer.find('price')
-            if price is not None and price.text != rules[offer_id]:
-                logging.info(f"Изменение цены для offer с ID {offer_id}: {
-                             price.text} -> {rules[offer_id]}")
-                price.text = rules[offer_id]
 
-    xml_str = ET.tostring(root, encoding='utf-8')
-    parsed_str = minidom.parseString(xml_str).toprettyxml(indent="  ")
-    parsed_str = '\n'.join(
-        [line for line in parsed_str.split('\n') if line.strip()])
+class ExcelComparator:
+    columns = ['xmlid', 'description', 'price']
 
-    with open(file_xml, "w", encoding="utf-8") as f:
-        f.write(parsed_str)
-    logging.info(
-        f"Правила из {rules_file} успешно применены к XML файлу: {file_xml}")
+    def __init__(self, file_new, file_old):
+        self.file_new = file_new
+        self.file_old = file_old
+        # products_old.xlsx - это products.xlsx прошлого цикла, его таблица обычно уже есть в кэше (см. workbook.py)
+        self.df_new = workbooks.load(file_new)
+        self.df_old = workbooks.load(file_old)
+
+    # Все изменения за один outer merge: indicator показывает, в каком из файлов есть строка,
+    # а цены и описания сравниваются только у строк, которые есть в обоих файлах
+    def compare(self):
+        merged = self.df_new[self.columns].merge(
+            self.df_old[self.columns], on='xmlid', how='outer', suffixes=('_new', '_old'), indicator=True)
+        side = merged['_merge']
+
+        added = merged.loc[side == 'left_only', ['xmlid', 'description_new', 'price_new']].rename(
+            columns={'description_new': 'description', 'price_new': 'price'})
+        removed = merged.loc[side == 'right_only', ['xmlid', 'description_old', 'price_old']].rename(
+            columns={'description_old': 'description', 'price_old': 'price'})
+        both = merged[side == 'both']
+        updated_price = both.loc[both['price_new'] != both['price_old'],
+                                 ['xmlid', 'price_new', 'price_old']]
+        updated_description = both.loc[both['description_new'] != both['description_old'],
+                                       ['xmlid', 'description_new', 'description_old']]
+
+        return ChangeSet(*(frame.reset_index(drop=True)
+                           for frame in (added, removed, updated_price, updated_description)))
+
+# Формула, которая добавляет к цене из Products.xlsx коэффициент, чтобы продажа на Yandex Market'e
+# была выгодна, вынесена в pricing.py (шкала наценки настраивается файлом pricing.json).
+
+
+# Сессия работы с каталогом за один цикл: каталог открывается один раз (см. catalog_store.py), к нему применяются
+# изменения из Excel и кастомные правила, а products.xml пишется только если что-то реально поменялось.
+
+
+class CatalogSession:
+
+    def __init__(self, file_xml, storage=catalog_storage):
+        self.file_xml = file_xml
+        self.catalog = open_catalog(file_xml, storage)
+        # xmlid офферов, цены которых в этом цикле пересчитаны по формуле, правила к ним применяются заново
+        self.touched = set()
+        # Версия правил, уже примененных к каталогу, и версия после apply_rules
+        self.applied_rules_version = self.catalog.read_rules_version()
+        self.rules_version = self.applied_rules_version
+
+    def close(self):
+        self.catalog.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Применение изменений из Excel (ChangeSet из ExcelComparator.compare)
+    def apply_summary(self, changes, products_file):
+        xml_generator = XMLGenerator(products_file)
+        catalog = self.catalog
+
+        # Обновление архивных и отключенных строк
+        for xmlid in catalog.archive(changes.removed['xmlid'].tolist()):
+            logging.info(f"Архивирование и отключение offer с ID {xmlid}")
+
+        # Обновление цен, наценка считается сразу для всех измененных строк
+        updated = changes.updated_price
+        new_prices = {xmlid: format_price(price) for xmlid, price in zip(
+            updated['xmlid'].tolist(), calculate_prices(updated['price_new']).tolist())}
+        for xmlid, old_price in catalog.set_prices(new_prices).items():
+            logging.info(f"Обновление цены для offer с ID {xmlid}: {
+                         old_price} -> {new_prices[xmlid]}")
+            self.touched.add(xmlid)
+
+        # Добавление новых строк или активация существующих
+        added = changes.added
+        new_prices = {xmlid: format_price(price) for xmlid, price in zip(
+            added['xmlid'].tolist(), calculate_prices(added['price']).tolist())}
+        activated = catalog.activate(new_prices)
+        for xmlid, old_price in activated.items():
+            logging.info(f"Активирование offer с ID {xmlid}")
+            if old_price is not None:
+                logging.info(f"Обновление цены для offer с ID {xmlid}: {
+                             old_price} -> {new_prices[xmlid]}")
+                self.touched.add(xmlid)
+        # Offer'ы, добавленные прерванным запуском с этим же файлом (база SQLite фиксирует изменения сразу),
+        # повторно не добавляются
+        present = catalog.existing(
+            [xmlid for xmlid in added['xmlid'].tolist() if xmlid not in activated])
+        new_rows = []
+        for xmlid, description, price in zip(added['xmlid'].tolist(), added['description'].tolist(), added['price'].tolist()):
+            if xmlid in present:
+                logging.info(f"Offer с ID {xmlid} уже есть в каталоге")
+            elif xmlid not in activated:
+                logging.info(f"Добавление нового offer с ID {xmlid}")
+                new_rows.append(
+                    {'xmlid': xmlid, 'description': description, 'price': price})
+
+        # Новые товары обогащаются (GPT + картинки) одним запуском конвейера, параллельно
+        products = [product_data for product_data in xml_generator.enrich_products(
+            new_rows) if product_data]
+        catalog.add_offers(products)
+        self.touched.update(str(product_data['xmlid'])
+                            for product_data in products)
+        if new_rows:
+            logging.info(f"Кэш ответов GPT: {gpt_cache.stats()}")
+
+    # К каталогу применяются кастомные правила созданные через WebUI market-rules.aposazhennikov.ru.
+    # Если известно, какая версия правил уже применена к каталогу, берутся только правила, измененные после нее,
+    # и офферы, пересчитанные в этом цикле. Офферу удаленного правила возвращается цена по формуле из products_file
+    def apply_rules(self, store=rules_store, products_file='products.xlsx'):
+        started = time.perf_counter()
+        if self.applied_rules_version is None:
+            version, rules = store.snapshot()
+            candidates = set(rules) | self.touched
+            mode = 'целиком'
+        else:
+            version, rules = store.changes_since(self.applied_rules_version)
+            rules = dict(rules)
+            rules.update(store.get_many(self.touched - set(rules)))
+            candidates = set(rules) | self.touched
+            mode = f"с версии {self.applied_rules_version}"
+
+        rule_prices = {}
+        removed = []
+        for offer_id in candidates:
+            rule_price = rules.get(offer_id)
+            if rule_price is None:
+                if offer_id not in self.touched:
+                    removed.append(offer_id)
+                continue
+            rule_prices[offer_id] = rule_price
+        for offer_id, old_price in self.catalog.set_prices(rule_prices).items():
+            if old_price != rule_prices[offer_id]:
+                logging.info(f"Изменение цены для offer с ID {offer_id}: {
+                             old_price} -> {rule_prices[offer_id]}")
+        removed = sorted(self.catalog.existing(removed))
+        if removed:
+            self._restore_formula_prices(removed, products_file)
+
+        self.rules_version = version
+        logging.info(f"Правила из {store.path} (версия {version}, {mode}) применены к каталогу: {
+                     len(candidates)} ID, {len(removed)} правил удалено, {time.perf_counter() - started:.4f} с")
+
+    # Цена по формуле для офферов, правило которых удалено
+    def _restore_formula_prices(self, offer_ids, products_file):
+        if not os.path.exists(products_file):
+            logging.warning(
+                f"Нет {products_file}, цены по формуле для удаленных правил не восстановлены: {offer_ids}")
+            return
+        products = workbooks.load(products_file)
+        products = products[products['xmlid'].isin(
+            offer_ids)].drop_duplicates('xmlid')
+        prices = {xmlid: format_price(price) for xmlid, price in zip(
+            products['xmlid'].tolist(), calculate_prices(products['price']).tolist())}
+        for offer_id in offer_ids:
+            if offer_id not in prices:
+                logging.warning(
+                    f"Правило для offer с ID {offer_id} удалено, но товара нет в {products_file}, цена не изменена")
+        for offer_id, old_price in self.catalog.set_prices(prices).items():
+            if old_price != prices[offer_id]:
+                logging.info(f"Правило для offer с ID {offer_id} удалено, цена по формуле: {
+                             old_price} -> {prices[offer_id]}")
+
+    # Запись products.xml, только если в цикле что-то поменялось. Возвращает True, если файл был записан.
+    # Вместе с каталогом сохраняется примененная версия правил
+    def save(self):
+        written = self.catalog.save(self.rules_version)
+        if self.rules_version is not None:
+            self.applied_rules_version = self.rules_version
+        return written
+
+
+def update_xml(file_xml, changes, products_file):
+    with CatalogSession(file_xml) as session:
+        session.apply_summary(changes, products_file)
+        return session.save()
 
+# Функция в которой к файлу productx.xml применяются кастомные правила созданные через WebUI
+#  market-rules.aposazhennikov.ru
 
-def excel_main():
-    # Проверяем наличие нужных файлов, если их нет будем с нуля создавать products.xml
-    if os.path.exists('products.xlsx') and os.path.exists('products_old.xlsx') and os.path.exists('products.xml'):
-        file_new = 'products.xlsx'
-        file_old = 'products_old.xlsx'
-        file_xml = 'products.xml'
 
+def apply_rules(file_xml, store=rules_store, products_file='products.xlsx'):
+    with CatalogSession(file_xml) as session:
+        session.apply_rules(store, products_file)
+        written = session.save()
+    if session.applied_rules_version is not None:
+        store.prune_changes(session.applied_rules_version)
+    return written
+
+
+# Цикл только с правилами: файл поставщика не изменился, а правила в Web UI поменялись после прошлого цикла.
+# Если каталог еще не собран (или сборка не закончена), правила применятся в следующем цикле с файлом.
+# Возвращает True, если products.xml был перезаписан
+def rules_main(products_file='products.xlsx'):
+    file_xml = feed_file
+    move_legacy_feed(file_xml)
+    if not os.path.exists(file_xml) or not os.path.exists(products_file) or os.path.exists(build_journal_file):
+        logger.info("Каталог еще не собран, правила будут применены в следующем цикле с файлом")
+        return False
+    written = apply_rules(file_xml, rules_store, products_file)
+    if not written:
+        logger.info("Цикл правил завершен без записи products.xml")
+    return written
+
+
+# Один цикл обработки: file_new сравнивается с file_old (файлом прошлого цикла).
+# Возвращает True, если products.xml был перезаписан, и False, если цикл закончился без записи
+def excel_main(file_new='products.xlsx', file_old='products_old.xlsx'):
+    file_xml = feed_file
+    move_legacy_feed(file_xml)
+    workbooks.reset_stats()
+    # Проверяем наличие нужных файлов, если их нет будем с нуля создавать products.xml.
+    # Если остался журнал незаконченной сборки, products.xml может быть промежуточным, сборка продолжается
+    changes = None
+    if os.path.exists(file_new) and os.path.exists(file_old) and os.path.exists(file_xml) \
+            and not os.path.exists(build_journal_file):
         comparator = ExcelComparator(file_new, file_old)
-        summary = comparator.generate_summary()
+        changes = comparator.compare()
 
         # Логирование сводки
-        logger.info("Added Rows:")
-        if summary['added_rows'] == "No changes":
-            logger.info("No changes")
-        else:
-            for row in summary['added_rows']:
-                logger.info(f"  {row}")
-
-        logger.info("\nRemoved Rows:")
-        if summary['removed_rows'] == "No changes":
-            logger.info("No changes")
-        else:
-            for row in summary['removed_rows']:
-                logger.info(f"  {row}")
-
-        logger.info("\nUpdated Price:")
-        if summary['updated_price'] == "No changes":
-            logger.info("No changes")
-        else:
-            for row in summary['updated_price']:
-                logger.info(f"  {row}")
-
-        logger.info("\nUpdated Description:")
-        if summary['updated_description'] == "No changes":
-            logger.info("  No changes")
-        else:
-            for row in summary['updated_description']:
-                logger.info(f"  {row}")
-
-        if summary['added_rows'] != "No changes" or summary['removed_rows'] != "No changes" or summary['updated_price'] != "No changes" or summary['updated_description'] != "No changes":
-            logger.info("Обнаружены изменения. Обновление XML файла.")
-            update_xml(file_xml, summary, file_new)
-        else:
+        changes.log()
+        if not changes:
             logger.info("Изменения не найдены.")
 
     else:
         logger.info(
             "Необходимые файлы не найдены. Запуск логики генерации XML файла.")
         start_time = time.time()
-        generator = XMLGenerator("products.xlsx", image_count=image_count)
+        generator = XMLGenerator(file_new, image_count=image_count)
         products = generator.read_products()
         generator.generate_xml(products)
         end_time = time.time()
         total_time = end_time - start_time
         logger.info(f"Скрипт выполнен за {total_time:.2f} секунд")
 
-    # Применение правил из rules.json
-    apply_rules(file_xml, 'rules.json')
+    with CatalogSession(file_xml) as session:
+        if changes:
+            logger.info("Обнаружены изменения. Обновление XML файла.")
+            session.apply_summary(changes, file_new)
+        # Применение правил в той же сессии, файл пишется один раз за цикл
+        session.apply_rules(rules_store, file_new)
+        written = session.save()
+    # Изменения правил, уже учтенные в products.xml, из журнала больше не нужны
+    if session.applied_rules_version is not None:
+        rules_store.prune_changes(session.applied_rules_version)
+    logger.info(f"Чтение Excel за цикл: {workbooks.stats()}")
+    if not written:
+        logger.info("Цикл завершен без записи products.xml")
+    return written
 
 
 if __name__ == "__main__":
@@ -1,10 +1,11 @@
-import xml.etree.ElementTree as ET
 import pandas as pd
 import logging
+from catalog_store import catalog_storage, open_catalog
+from publisher import feed_file
 
 # Этот скрипт предназначен для работы с XML и Excel файлами.
 # Он выполняет следующие задачи:
-# 1. Извлекает идентификаторы предложений (offer id) из XML-файла.
+# 1. Извлекает идентификаторы предложений (offer id) из каталога products.xml.
 # 2. Сравнивает эти идентификаторы с идентификаторами из Excel-файла.
 # 3. Удаляет из Excel-файла строки, идентификаторы которых отсутствуют в XML-файле.
 # 4. Логирует все действия и изменения, выполняемые скриптом.
@@ -17,23 +18,16 @@ import logging
 logging.basicConfig(filename='my.log', level=logging.INFO,
                     format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
 
-# Функция для извлечения offer id из XML-файла
+# Функция для извлечения offer id из каталога (см. catalog_store.py, в SQLite это один SELECT по индексу xmlid).
+# offer id - атрибут id у <offer>, элементов <offer_id> в offer'ах, которые собирает XMLGenerator, нет
 
 
-def get_offer_ids(xml_file):
-    logging.info("Загрузка offer id из XML файла")
-    print("Загрузка offer id из XML файла...")
+def get_offer_ids(xml_file, storage=catalog_storage):
+    logging.info("Загрузка offer id из каталога")
+    print("Загрузка offer id из каталога...")
 
-    # Загрузка данных из XML
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    offers = root.find('shop').find('offers')
-
-    # Извлечение offer id
-    offer_ids = {offer.find('offer_id').text for offer in offers if offer.find(
-        'offer_id') is not None}
-
-    return offer_ids
+    with open_catalog(xml_file, storage) as catalog:
+        return catalog.offer_ids()
 
 # Функция для удаления отсутствующих xmlid из Excel-файла
 
@@ -91,7 +85,7 @@ def remove_missing_xmlids(excel_file, offer_ids):
 
 
 if __name__ == "__main__":
-    xml_file = 'products.xml'
+    xml_file = feed_file
     excel_file = 'products.xlsx'
 
     # Извлечение offer id из XML-файла
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from publisher import atomic_write
+
+# Этот модуль - офлайн-обогащение товаров через пакетный API OpenAI (Batch API) для сборки products.xml с нуля.
+# При сборке тысяч товаров задержка ответа на каждый товар не важна, важны стоимость и нагрузка на лимиты.
+# Пакетный API дешевле обычных запросов и не расходует их лимиты, поэтому:
+# 1. Все товары, ответа для которых нет в кэше GPT, пишутся одним файлом заданий JSONL (GPT_BULK_JOB_FILE),
+# один запрос /v1/chat/completions на уникальное описание, custom_id - ключ кэша GPT.
+# 2. Файл загружается (files.create), создается одно пакетное задание (batches.create), его статус опрашивается
+# раз в GPT_BULK_POLL_SECONDS секунд.
+# 3. Ответы из выходного файла задания возвращаются вызывающему (XMLGenerator.bulk_enrich кладет их в кэш GPT),
+# товары без ответа потом обрабатываются обычными запросами.
+# 4. id задания хранится в файле состояния: после перезапуска опрашивается то же задание, а не создается новое.
+# Пакетный API не поддерживает ассистентов, поэтому промпт ассистента (prompt_for_gpt_assistant.txt) уходит
+# системным сообщением chat completions.
+# Проверка без сети - против локального сервера из bench/batch_api.py.
+
+# С какого количества товаров сборка с нуля идет через пакетное задание (0 - выключено)
+gpt_bulk_min_rows = int(os.getenv('GPT_BULK_MIN_ROWS', '0'))
+# Адрес OpenAI-совместимого API для пакетных заданий (по умолчанию тот же, что и для остальных запросов)
+gpt_bulk_base_url = os.getenv('GPT_BULK_BASE_URL') or None
+# Модель и промпт по умолчанию те же, что у бэкенда chat (см. enrichment.py)
+gpt_bulk_model = os.getenv('GPT_BULK_MODEL', os.getenv('GPT_MODEL', 'gpt-4o-mini'))
+gpt_bulk_prompt_file = os.getenv('GPT_BULK_PROMPT_FILE', os.getenv(
+    'GPT_PROMPT_FILE', 'prompt_for_gpt_assistant.txt'))
+gpt_bulk_job_file = os.getenv('GPT_BULK_JOB_FILE', 'gpt_bulk_job.jsonl')
+gpt_bulk_poll_seconds = float(os.getenv('GPT_BULK_POLL_SECONDS', '60'))
+gpt_bulk_max_wait = float(os.getenv('GPT_BULK_MAX_WAIT_HOURS', '24')) * 60 * 60
+
+batch_endpoint = '/v1/chat/completions'
+finished_statuses = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def load_prompt(path=gpt_bulk_prompt_file):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+# Строка файла заданий: один запрос chat completions с ответом в виде JSON-объекта
+def build_request(custom_id, content, prompt, model=gpt_bulk_model):
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': batch_endpoint,
+        'body': {
+            'model': model,
+            'messages': [
+                {'role': 'system', 'content': prompt},
+                {'role': 'user', 'content': content},
+            ],
+            'response_format': {'type': 'json_object'},
+        },
+    }
+
+
+# Разбор выходного файла задания: {custom_id: JSON-ответ модели} и число строк без годного ответа
+def parse_output(text):
+    answers = {}
+    failed = 0
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            response = entry.get('response') or {}
+            if entry.get('error') or response.get('status_code') != 200:
+                raise ValueError(entry.get('error') or response.get('status_code'))
+            content = response['body']['choices'][0]['message']['content']
+            answers[entry['custom_id']] = json.loads(content)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            failed += 1
+            logging.warning(f"Пакетное задание GPT: строка без ответа ({e}): {line[:200]}")
+    return answers, failed
+
+
+class BulkJob:
+    def __init__(self, openai, job_file=gpt_bulk_job_file, poll_seconds=gpt_bulk_poll_seconds,
+                 max_wait=gpt_bulk_max_wait):
+        self.openai = openai
+        self.job_file = job_file
+        self.state_file = f"{job_file}.state.json"
+        self.poll_seconds = poll_seconds
+        self.max_wait = max_wait
+        self.polls = 0
+
+    def load_state(self):
+        if not os.path.exists(self.state_file):
+            return None
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        with atomic_write(self.state_file) as f:
+            json.dump(state, f)
+
+    def clear(self):
+        for path in (self.state_file, self.job_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_job(self, contents, prompt, model=gpt_bulk_model):
+        with atomic_write(self.job_file) as f:
+            for custom_id, content in contents.items():
+                f.write(json.dumps(build_request(custom_id, content,
+                        prompt, model), ensure_ascii=False) + '\n')
+        return self.job_file
+
+    async def submit(self):
+        with open(self.job_file, 'rb') as f:
+            uploaded = await self.openai.files.create(file=f, purpose='batch')
+        batch = await self.openai.batches.create(
+            input_file_id=uploaded.id, endpoint=batch_endpoint, completion_window='24h')
+        self._save_state({'batch_id': batch.id, 'input_file_id': uploaded.id,
+                          'created': time.time()})
+        logging.info(f"Пакетное задание GPT {batch.id} создано, файл {uploaded.id}")
+        return batch.id
+
+    # Ожидание завершения задания. None - задание не завершилось за max_wait и отменено
+    async def wait(self, batch_id):
+        started = time.monotonic()
+        while True:
+            batch = await self.openai.batches.retrieve(batch_id)
+            self.polls += 1
+            counts = batch.request_counts
+            logging.info(f"Пакетное задание GPT {batch_id}: {batch.status}" + (
+                f", готово {counts.completed} из {counts.total}, ошибок {counts.failed}" if counts else ""))
+            if batch.status in finished_statuses:
+                return batch
+            if time.monotonic() - started >= self.max_wait:
+                logging.error(
+                    f"Пакетное задание GPT {batch_id} не завершилось за {self.max_wait:.0f} с, отменяется")
+                await self.openai.batches.cancel(batch_id)
+                return None
+            await asyncio.sleep(self.poll_seconds)
+
+    # Ответы модели {custom_id: JSON-ответ} для contents {custom_id: сообщение пользователя}.
+    # Если от прошлого запуска осталось задание, дожидается его, а не создает новое
+    async def run(self, contents, prompt, model=gpt_bulk_model):
+        state = self.load_state()
+        if state is not None:
+            batch_id = state['batch_id']
+            logging.info(f"Продолжаем ожидание пакетного задания GPT {batch_id} с прошлого запуска")
+        elif contents:
+            self.write_job(contents, prompt, model)
+            batch_id = await self.submit()
+        else:
+            return {}
+
+        batch = await self.wait(batch_id)
+        answers = {}
+        if batch is not None and batch.output_file_id:
+            output = await self.openai.files.content(batch.output_file_id)
+            answers, failed = parse_output(output.text)
+            logging.info(f"Пакетное задание GPT {batch_id}: {batch.status}, ответов {
+                         len(answers)}, строк с ошибкой {failed}, опросов статуса {self.polls}")
+        elif batch is not None:
+            logging.error(f"Пакетное задание GPT {batch_id} завершилось без результата: {
+                          batch.status} {batch.errors}")
+        self.clear()
+        return answers
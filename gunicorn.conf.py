@@ -0,0 +1,14 @@
+import os
+
+# Настройки gunicorn для Web UI (web.py), файл подхватывается автоматически при запуске из папки проекта:
+# gunicorn web:app
+# preload_app не включается: соединение с rules.sqlite3 открывается при импорте web.py
+# и не должно наследоваться воркерами через fork.
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', '4'))
+threads = int(os.getenv('WEB_THREADS', '1'))
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+accesslog = os.getenv('WEB_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = 'info'
@@ -1,21 +1,26 @@
 import asyncio
 import os
+import json
+import time
+import hashlib
 from telethon import TelegramClient, events
 import logging
-from excel_main import excel_main
-from flask import Flask, render_template, request, jsonify
-import json
-import threading
+from worker import ProcessingWorker, status_file
+from publisher import atomic_write
 
 # Настройки логирования
 logging.basicConfig(level=logging.INFO)
 # Этот скрипт является основным входным пунктом для запуска приложения.
 # Он выполняет следующие задачи:
 # 1. Настраивает окружение, из переменных окружения достает необходимые данные(передаются в docker-compose.yml).
-# 2. Инициализирует web-приложение написанное на Flask, оно отвечает за добавление кастомных правил,
-# которые будут применяться поверх основных цен в карточках товаров, нужны, например для акций или быстрых важных фиксов.
+# 2. Пишет состояние обработки в STATUS_FILE, его отдает /status в Web UI. Сам Web UI (web.py) для кастомных правил,
+# которые применяются поверх основных цен в карточках товаров, работает отдельным процессом под gunicorn.
 # 3. Проверяет телеграмм бота поставщика, скачивает файл xlsx где находятся товары..
 # 4. Логирует все действия и изменения, выполняемые скриптом.
+# Процесс-воркер запускается через spawn и импортирует этот модуль заново (как __mp_main__), поэтому при импорте
+# здесь ничего не создается и не открывается: воркер создается в main(), Flask сюда не импортируется,
+# а база правил импортируется только при обработке файла (см. rules_version()).
+# Если файл не изменился, но правила в Web UI поменялись после последнего цикла, воркеру отправляется цикл только с правилами.
 
 # Получение значений из переменных окружения
 api_id = os.getenv('API_ID')
@@ -30,79 +35,168 @@ session_name = 'session_name'
 # Имя пользователя вашего бота
 bot_username = os.getenv('BOT_USERNAME', 'pavilion89bot')
 
-app = Flask(__name__)
-rules_file = 'rules.json'
-
-# Правила кастомные, которые добавляются поверх всего остального записанного в Products.xml добавляются через Web UI интерфейс
-# http://market-rules.aposazhennikov.ru/
-
-
-def load_rules():
-    if not os.path.exists(rules_file):
-        save_rules({})
-    with open(rules_file, 'r') as file:
-        return json.load(file)
-
-
-def save_rules(rules):
-    with open(rules_file, 'w') as file:
-        json.dump(rules, file)
-
-# Часть связанная с FLASK
-
-
-@app.before_request
-def before_request():
-    if request.headers.get('X-Script-Name'):
-        url_prefix = request.headers['X-Script-Name']
-        if request.path.startswith(url_prefix):
-            request.environ['SCRIPT_NAME'] = url_prefix
-            request.environ['PATH_INFO'] = request.path[len(url_prefix):]
-
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-
-@app.route('/get_rules', methods=['GET'])
-def get_rules():
-    rules = load_rules()
-    return jsonify(rules)
-
-
-@app.route('/add_rule', methods=['POST'])
-def add_rule():
-    data = request.get_json()
-    rules = load_rules()
-    for rule in data:
-        rules[rule['id']] = rule['price']
-    save_rules(rules)
-    return jsonify(success=True)
-
-
-@app.route('/delete_all_rules', methods=['POST'])
-def delete_all_rules():
-    save_rules({})
-    return jsonify(success=True)
-
-
-@app.route('/delete_rule/<rule_id>', methods=['POST'])
-def delete_rule(rule_id):
-    rules = load_rules()
-    if rule_id in rules:
-        del rules[rule_id]
-        save_rules(rules)
-    return jsonify(success=True)
-
-
-@app.route('/edit_rule', methods=['POST'])
-def edit_rule():
-    data = request.get_json()
-    rules = load_rules()
-    rules[data['id']] = data['price']
-    save_rules(rules)
-    return jsonify(success=True)
+# Бот поставщика каждые 30 секунд присылает Excel, и почти всегда это тот же самый файл.
+# Одинаковый файл (тот же документ Telegram того же размера или те же байты) не переименовывается и не обрабатывается,
+# счетчики показывают, сколько циклов пропущено и сколько файлов обработано.
+# Сравнение идет с последним файлом, отправленным в обработку: именно он станет products.xlsx.
+# Трекер не потокобезопасный: его меняет только event loop (результаты воркера передаются туда же, см. main())
+class DownloadTracker:
+    def __init__(self):
+        self.document = None
+        self.sha256 = None
+        # Версия правил на момент отправки последнего цикла в воркер
+        self.rules_version = None
+        self.skipped = 0
+        self.submitted = 0
+        self.rules_cycles = 0
+        self.processed = 0
+        self.failed = 0
+        self.skipped_time = 0.0
+        self.processed_time = 0.0
+
+    def is_same_document(self, document):
+        return self.document == (document.id, document.size)
+
+    def is_same_content(self, checksum):
+        return self.sha256 == checksum
+
+    def mark_skipped(self, document, elapsed):
+        self.document = (document.id, document.size)
+        self.skipped += 1
+        self.skipped_time += elapsed
+
+    def rules_changed(self, version):
+        return self.rules_version != version
+
+    def mark_submitted(self, document, checksum, rules_version):
+        self.document = (document.id, document.size)
+        self.sha256 = checksum
+        self.rules_version = rules_version
+        self.submitted += 1
+
+    def mark_rules_submitted(self, rules_version):
+        self.rules_version = rules_version
+        self.rules_cycles += 1
+
+    def mark_processed(self, elapsed):
+        self.processed += 1
+        self.processed_time += elapsed
+
+    # Упавший файл забывается, иначе он не обработается, когда бот пришлет его снова.
+    # Версия правил тоже: упавший цикл мог их не применить
+    def mark_failed(self, checksum):
+        self.failed += 1
+        self.rules_version = None
+        self.forget(checksum)
+
+    # Файл не будет обработан (упал или вытеснен более новым из очереди)
+    def forget(self, checksum):
+        if self.sha256 == checksum:
+            self.document = None
+            self.sha256 = None
+
+    def stats(self):
+        return {
+            'skipped': self.skipped,
+            'submitted': self.submitted,
+            'rules_cycles': self.rules_cycles,
+            'processed': self.processed,
+            'failed': self.failed,
+            'skipped_time': round(self.skipped_time, 3),
+            'processed_time': round(self.processed_time, 3),
+        }
+
+
+downloads = DownloadTracker()
+# Процесс-воркер, создается в main()
+worker = None
+
+
+# Результат обработки файла в процессе-воркере. Выполняется в event loop, куда его передает поток результатов воркера
+def on_worker_result(result):
+    if result['error'] is None:
+        downloads.mark_processed(result['duration'])
+        logging.info(f"Файл {result['checksum'][:12]} обработан за {
+                     result['duration']:.2f} с. {worker.stats()}")
+    else:
+        downloads.mark_failed(result['checksum'])
+        logging.error(f"Файл {result['checksum'][:12]} не обработан: {
+                      result['error']}. {worker.stats()}")
+    write_status()
+
+
+# Состояние очереди воркера и скачиваний для /status в Web UI (другой процесс), пишется после каждого события
+def write_status():
+    try:
+        with atomic_write(status_file) as f:
+            json.dump({'worker': worker.stats(), 'downloads': downloads.stats(),
+                       'updated': time.time()}, f)
+    except OSError as e:
+        logging.error(f"Не удалось записать состояние в {status_file}: {e}")
+
+
+# Текущая версия правил. rules_store открывает базу при импорте, поэтому импортируется здесь, а не в начале модуля
+def rules_version():
+    from rules_store import rules_store
+    return rules_store.version()
+
+
+# Отправить задание воркеру. submit() может ждать очередь, поэтому вызывается в пуле потоков
+async def submit(job):
+    dropped = await asyncio.get_running_loop().run_in_executor(None, worker.submit, job)
+    if dropped is None:
+        return
+    if dropped['data'] is None:
+        logging.info(f"Цикл правил {dropped['checksum']} не нужен: правила применятся с файлом из очереди")
+        return
+    downloads.forget(dropped['checksum'])
+    logging.info(
+        f"Файл {dropped['checksum'][:12]} заменен в очереди более новым")
+
+
+# Файл не изменился, но правила могли поменяться после последнего цикла: тогда в воркер уходит цикл только с правилами
+async def submit_rules_if_changed():
+    version = rules_version()
+    if not downloads.rules_changed(version):
+        return
+    downloads.mark_rules_submitted(version)
+    await submit({'data': None, 'checksum': f"rules-{version}", 'document': None})
+    logging.info(f"Правила изменились (версия {
+                 version}), цикл правил поставлен в очередь. {worker.stats()}")
+
+
+# Обработка присланного ботом Excel-файла
+async def handle_document(event):
+    started = time.monotonic()
+    document = event.document
+    # Тот же документ Telegram не нужно даже скачивать
+    if downloads.is_same_document(document):
+        downloads.mark_skipped(document, time.monotonic() - started)
+        logging.info(f"Файл не изменился (документ {
+                     document.id}), цикл пропущен. {downloads.stats()}")
+        await submit_rules_if_changed()
+        write_status()
+        return
+
+    # Скачать документ в память и сравнить с последним обработанным файлом
+    data = await event.download_media(file=bytes)
+    checksum = hashlib.sha256(data).hexdigest()
+    if downloads.is_same_content(checksum):
+        downloads.mark_skipped(document, time.monotonic() - started)
+        logging.info(f"Файл не изменился (sha256 {
+                     checksum[:12]}), цикл пропущен. {downloads.stats()}")
+        await submit_rules_if_changed()
+        write_status()
+        return
+
+    # Переименование, сохранение и excel_main() выполняются в процессе-воркере, event loop Telethon не блокируется.
+    # Если воркер занят, файл ждет в очереди, а ждавший там более старый файл уже не нужен.
+    # Цикл с файлом применяет и правила, поэтому запоминается версия правил на момент отправки
+    downloads.mark_submitted(document, checksum, rules_version())
+    await submit({'data': data, 'checksum': checksum, 'document': (document.id, document.size)})
+    logging.info(f"Файл {checksum[:12]} поставлен в очередь на обработку. {
+                 worker.stats()}")
+    write_status()
 
 
 # Асинхронная функция, нужна для создания telegram client, а асинхронная для ускорения работы, чтобы распаралеллить процессы.
@@ -113,17 +207,7 @@ async def telegram_client():
     @client.on(events.NewMessage(from_users=bot_username))
     async def handler(event):
         if event.document:
-            # Если файл уже существует, переименовать его
-            if os.path.exists('products.xlsx'):
-                if os.path.exists('products_old.xlsx'):
-                    os.remove('products_old.xlsx')
-                os.rename('products.xlsx', 'products_old.xlsx')
-
-            # Скачать документ и сохранить его в файл
-            file_path = await event.download_media(file='products.xlsx')
-            logging.info(f"Файл скачан и сохранен по пути: {file_path}")
-            # Запуск скрипта сравнения и обновления XML
-            excel_main()
+            await handle_document(event)
     # Луп, делаем каждые 30 секунд отправку боту сообщения, чтобы он нам прислал табличку excel и мы ее скачали.
     while True:
         logging.info("Отправка сообщения боту для получения Excel файла")
@@ -131,16 +215,18 @@ async def telegram_client():
         logging.info("Сплю на 30 секунд")
         await asyncio.sleep(delay_time)
 
-# на 5000 порут стартуем наш WEB UI
 
+def main():
+    global worker
+    loop = asyncio.get_event_loop()
+    # on_result вызывается в потоке результатов воркера, а downloads и файл состояния меняются только в event loop
+    worker = ProcessingWorker(on_result=lambda result: loop.call_soon_threadsafe(on_worker_result, result))
+    worker.start()
+    write_status()
 
-def start_flask_app():
-    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+    loop.run_until_complete(telegram_client())
 
 
+# WEB UI на порту 5000 запускается отдельно: gunicorn web:app (см. start.sh)
 if __name__ == '__main__':
-    flask_thread = threading.Thread(target=start_flask_app)
-    flask_thread.start()
-
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(telegram_client())
+    main()
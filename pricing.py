@@ -0,0 +1,102 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+# Этот модуль - единая формула наценки для products.xml.
+# Раньше одна и та же лестница if/elif была скопирована в excel_main.py, apply_formula.py и XMLGenerator,
+# и цена считалась по одной строке за раз. Теперь:
+# 1. Шкала наценки хранится как данные: с какой цены начинается ступень и на сколько умножается цена.
+# 2. Шкалу можно переопределить файлом pricing.json без правки кода (см. PRICING_FILE), файл перечитывается,
+# когда меняется.
+# 3. calculate_prices() считает цены сразу для целой колонки pandas через numpy.searchsorted,
+# calculate_price() - та же формула для одной цены.
+# Замер на случайных ценах и сверка с построчным расчетом - в bench/prices.py.
+
+# Файл с переопределением шкалы наценки, формат:
+# {"tiers": [{"from": 0, "multiplier": 1.45}, {"from": 10000, "multiplier": 1.43}, ...]}
+pricing_file = os.getenv('PRICING_FILE', 'pricing.json')
+
+# Ступени по умолчанию: (цена от, множитель). Первая ступень действует для всех цен ниже второй
+default_tiers = [
+    (0, 1.45),
+    (10000, 1.43),
+    (11000, 1.42),
+    (13000, 1.41),
+    (15000, 1.395),
+    (18000, 1.387),
+    (20000, 1.36),
+    (30000, 1.35),
+    (40000, 1.34),
+    (50000, 1.33),
+    (60000, 1.325),
+    (70000, 1.318),
+    (80000, 1.315),
+    (90000, 1.308),
+    (100000, 1.305),
+]
+
+# Загруженная шкала и mtime файла, из которого она прочитана (None - шкала по умолчанию)
+_loaded = {'mtime': None, 'tiers': None}
+
+
+def load_tiers(path=pricing_file):
+    if not os.path.exists(path):
+        return list(default_tiers)
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    tiers = [(float(tier['from']), float(tier['multiplier']))
+             for tier in config['tiers']]
+    if not tiers:
+        raise ValueError(f"В файле {path} нет ни одной ступени наценки")
+    if any(tiers[i][0] >= tiers[i + 1][0] for i in range(len(tiers) - 1)):
+        raise ValueError(
+            f"Ступени наценки в файле {path} должны идти по возрастанию цены")
+    return tiers
+
+# Текущая шкала, перечитывается при изменении pricing.json. Если файл испорчен, остается прежняя шкала
+
+
+def get_tiers():
+    mtime = os.path.getmtime(pricing_file) if os.path.exists(
+        pricing_file) else None
+    if _loaded['tiers'] is None or mtime != _loaded['mtime']:
+        try:
+            _loaded['tiers'] = load_tiers(pricing_file)
+            if mtime is not None:
+                logging.info(f"Шкала наценки загружена из {pricing_file}")
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"Ошибка чтения шкалы наценки {pricing_file}: {e}")
+            if _loaded['tiers'] is None:
+                _loaded['tiers'] = list(default_tiers)
+        _loaded['mtime'] = mtime
+    return _loaded['tiers']
+
+
+def calculate_prices(prices, tiers=None):
+    tiers = get_tiers() if tiers is None else tiers
+    # Границы со второй ступени: searchsorted(side='right') дает номер ступени, в которую попадает цена
+    breakpoints = np.array([start for start, _ in tiers[1:]], dtype=float)
+    multipliers = np.array([multiplier for _, multiplier in tiers], dtype=float)
+    values = np.asarray(prices, dtype=float)
+    result = values * multipliers[np.searchsorted(breakpoints, values, side='right')]
+    if isinstance(prices, pd.Series):
+        return pd.Series(result, index=prices.index, name=prices.name)
+    return result
+
+
+def calculate_price(price, tiers=None):
+    return float(calculate_prices(np.array([price]), tiers)[0])
+
+
+# Цена с наценкой как текст <price> в products.xml: до копеек. Одна запись для новых offer'ов при сборке с нуля,
+# в цикле excel_main и для цен по формуле, чтобы одна и та же цена не попадала в каталог в разном виде
+def format_price(price):
+    return str(round(float(price), 2))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    for start, multiplier in get_tiers():
+        logging.info(f"от {start}: x{multiplier}")
@@ -0,0 +1,275 @@
+import os
+import re
+import sys
+import gzip
+import shutil
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+# Этот модуль отвечает за безопасную публикацию products.xml.
+# nginx отдает этот файл Яндекс Маркету напрямую из папки приложения, поэтому писать его "на месте" через open("w") нельзя:
+# Яндекс может забрать наполовину записанный фид, а падение скрипта посреди записи уничтожает каталог.
+# Поэтому:
+# 1. Файл пишется во временный файл в той же папке, делается fsync и rename поверх старого (атомарно для читателя).
+# 2. После каждой публикации сохраняется снапшот с sha256 в имени, хранятся последние SNAPSHOT_COUNT версий.
+# 3. Откат на предыдущую версию - один вызов rollback() или `python publisher.py rollback [шагов]`.
+# 4. Если новое содержимое совпадает с опубликованным (кроме атрибута date у yml_catalog, он новый при каждой
+# записи), файл не заменяется: mtime остается прежним, и nginx на повторные запросы Яндекса
+# с If-None-Match / If-Modified-Since отвечает 304.
+# 5. Рядом с файлом пишутся сжатые копии products.xml.gz (и products.xml.br, если установлен модуль brotli)
+# для gzip_static / brotli_static в nginx и products.xml.sha256 с хэшем содержимого. Копии пишутся до замены
+# основного файла, а их mtime выставляется равным mtime основного файла.
+# 6. Фид публикуется в папку PUBLIC_DIR (feed_file), ее целиком монтирует контейнер nginx: bind mount одного файла
+# держал бы старый inode и после rename отдавал бы устаревший фид до перезапуска контейнера.
+
+# Папка, из которой nginx отдает фид (пустая строка - папка приложения), и путь к products.xml в ней
+public_dir = os.getenv('PUBLIC_DIR', '')
+feed_file = os.path.join(public_dir, 'products.xml')
+# Папка со снапшотами и сколько последних версий хранить
+snapshot_dir = os.getenv('SNAPSHOT_DIR', 'snapshots')
+snapshot_count = int(os.getenv('SNAPSHOT_COUNT', '5'))
+# Сжатые копии для nginx: PUBLISH_GZIP=0 / PUBLISH_BROTLI=0 выключают их (старые копии при этом удаляются)
+publish_gzip = os.getenv('PUBLISH_GZIP', '1') == '1'
+publish_brotli = os.getenv('PUBLISH_BROTLI', '1') == '1'
+gzip_level = int(os.getenv('GZIP_LEVEL', '9'))
+brotli_quality = int(os.getenv('BROTLI_QUALITY', '9'))
+
+# Атрибут date корневого тега фида: его значение (группа 1) не учитывается при сравнении с опубликованным файлом
+feed_date = re.compile(rb'<yml_catalog\b[^>]*?( date="[^"]*")')
+# В какой части начала файла искать атрибут, который не учитывается
+_ignore_head = 4096
+
+# brotli необязателен: без него публикуется только .gz
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Запись через временный файл: читатель видит либо старую версию целиком, либо новую целиком
+
+
+# skip_identical=True - если новое содержимое совпадает со старым, старый файл остается на месте (с прежним mtime).
+# ignore - регулярное выражение: совпадение его группы 1 в начале файла при этом сравнении не учитывается.
+# before_replace(tmp_path) вызывается, когда временный файл готов, но еще не переименован
+
+
+@contextmanager
+def atomic_write(path, mode='w', encoding='utf-8', skip_identical=False, before_replace=None, ignore=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=None if 'b' in mode else encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if skip_identical and os.path.exists(path) and _same_content(tmp_path, path, ignore):
+            os.remove(tmp_path)
+            logging.info(f"{path} не изменился, файл не заменяется")
+            return
+        if before_replace is not None:
+            before_replace(tmp_path)
+        # mkstemp создает файл с правами 0600, а nginx должен иметь возможность его читать
+        file_mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644
+        os.chmod(tmp_path, file_mode)
+        os.replace(tmp_path, path)
+        _fsync_dir(directory)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Начало файла до части, которая не учитывается при сравнении, и смещение, с которого файл сравнивается дальше
+def _content_start(f, ignore):
+    head = f.read(_ignore_head)
+    match = ignore.search(head) if ignore is not None else None
+    if match is None:
+        return head, len(head)
+    return head[:match.start(1)], match.end(1)
+
+
+def _same_content(first, second, ignore=None):
+    if ignore is None and os.path.getsize(first) != os.path.getsize(second):
+        return False
+    with open(first, 'rb') as a, open(second, 'rb') as b:
+        head_a, offset_a = _content_start(a, ignore)
+        head_b, offset_b = _content_start(b, ignore)
+        if head_a != head_b or os.path.getsize(first) - offset_a != os.path.getsize(second) - offset_b:
+            return False
+        a.seek(offset_a)
+        b.seek(offset_b)
+        for chunk in iter(lambda: a.read(1024 * 1024), b''):
+            if chunk != b.read(len(chunk)):
+                return False
+    return True
+
+
+def _compressed_copies(path):
+    copies = {f"{path}.gz": (lambda data: gzip.compress(data, compresslevel=gzip_level, mtime=0))
+              if publish_gzip else None}
+    copies[f"{path}.br"] = (lambda data: brotli.compress(data, quality=brotli_quality)) \
+        if publish_brotli and brotli is not None else None
+    return copies
+
+
+# Сжатые копии и хэш содержимого для файла source, который будет опубликован как path
+def write_compressed(source, path):
+    with open(source, 'rb') as f:
+        data = f.read()
+    for copy_path, compress in _compressed_copies(path).items():
+        if compress is None:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+            continue
+        with atomic_write(copy_path, mode='wb') as f:
+            f.write(compress(data))
+    with atomic_write(f"{path}.sha256") as f:
+        f.write(hashlib.sha256(data).hexdigest() + '\n')
+
+
+# Выставить сжатым копиям mtime основного файла, чтобы Last-Modified у всех вариантов совпадал
+def _sync_compressed_mtime(path):
+    stat = os.stat(path)
+    for copy_path in list(_compressed_copies(path)) + [f"{path}.sha256"]:
+        if os.path.exists(copy_path):
+            os.utime(copy_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def _snapshot_prefix(path):
+    name, _ = os.path.splitext(os.path.basename(path))
+    return f"{name}."
+
+# Снапшоты вида products.20241018T154400123456.<sha256>.xml, новые первыми
+
+
+def list_snapshots(path=feed_file):
+    if not os.path.isdir(snapshot_dir):
+        return []
+    prefix = _snapshot_prefix(path)
+    snapshots = []
+    for file_name in os.listdir(snapshot_dir):
+        parts = file_name[len(prefix):].split('.')
+        if not file_name.startswith(prefix) or len(parts) != 3:
+            continue
+        snapshots.append({
+            'path': os.path.join(snapshot_dir, file_name),
+            'created': parts[0],
+            'sha256': parts[1],
+        })
+    snapshots.sort(key=lambda snapshot: snapshot['created'], reverse=True)
+    return snapshots
+
+
+def snapshot(path=feed_file):
+    checksum = file_sha256(path)
+    snapshots = list_snapshots(path)
+    if snapshots and snapshots[0]['sha256'] == checksum:
+        return snapshots[0]['path']
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    _, extension = os.path.splitext(path)
+    created = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    snapshot_path = os.path.join(
+        snapshot_dir, f"{_snapshot_prefix(path)}{created}.{checksum}{extension}")
+    # Опубликованный файл никогда не меняется на месте (только rename поверх), поэтому хватает жесткой ссылки
+    try:
+        os.link(path, snapshot_path)
+    except OSError:
+        shutil.copy2(path, snapshot_path)
+    logging.info(f"Сохранен снапшот {snapshot_path}")
+
+    for old in list_snapshots(path)[snapshot_count:]:
+        os.remove(old['path'])
+        logging.info(f"Удален старый снапшот {old['path']}")
+    return snapshot_path
+
+# Публикация файла: атомарная запись со сжатыми копиями + снапшот новой версии (take_snapshot=False - без снапшота,
+# для промежуточных версий). Если содержимое не изменилось, не меняется ничего
+
+
+@contextmanager
+def publish(path, mode='w', encoding='utf-8', take_snapshot=True):
+    replaced = []
+
+    def before_replace(tmp_path):
+        write_compressed(tmp_path, path)
+        replaced.append(tmp_path)
+
+    with atomic_write(path, mode=mode, encoding=encoding, skip_identical=True, before_replace=before_replace,
+                      ignore=feed_date) as f:
+        yield f
+    if not replaced:
+        return
+    _sync_compressed_mtime(path)
+    if take_snapshot and snapshot_count > 0:
+        snapshot(path)
+
+# Перенос фида, опубликованного раньше в папку приложения, в PUBLIC_DIR вместе со сжатыми копиями и отметкой правил.
+# Без этого первый цикл после включения PUBLIC_DIR не нашел бы products.xml и собирал бы каталог с нуля
+
+
+def move_legacy_feed(path=feed_file):
+    legacy = os.path.basename(path)
+    if os.path.abspath(legacy) == os.path.abspath(path) or os.path.exists(path) or not os.path.exists(legacy):
+        return False
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for suffix in ('.gz', '.br', '.sha256', '.rules.json', ''):
+        if os.path.exists(legacy + suffix):
+            # mtime сохраняется, поэтому каталог в SQLite (см. catalog_store.py) не импортирует файл заново
+            os.replace(legacy + suffix, path + suffix)
+    logging.info(f"{legacy} перенесен в {path}")
+    return True
+
+# Откат на steps версий назад от текущей. Контрольная сумма снапшота проверяется перед публикацией
+
+
+def rollback(path=feed_file, steps=1):
+    snapshots = list_snapshots(path)
+    current = file_sha256(path) if os.path.exists(path) else None
+    position = next((i for i, s in enumerate(snapshots)
+                    if s['sha256'] == current), -1)
+    candidates = snapshots[position + steps:] if position >= 0 else snapshots[steps - 1:]
+
+    for candidate in candidates:
+        if file_sha256(candidate['path']) != candidate['sha256']:
+            logging.error(
+                f"Снапшот {candidate['path']} поврежден, контрольная сумма не совпадает")
+            continue
+        with open(candidate['path'], 'rb') as src, publish(path, mode='wb', take_snapshot=False) as dst:
+            shutil.copyfileobj(src, dst)
+        logging.info(f"{path} откатан на версию {candidate['path']}")
+        return candidate['path']
+
+    logging.error(f"Нет подходящего снапшота для отката {path}")
+    return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) > 1 and sys.argv[1] == 'rollback':
+        rollback(feed_file, int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    else:
+        for item in list_snapshots(feed_file):
+            logging.info(f"{item['created']} {item['sha256']} {item['path']}")
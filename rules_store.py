@@ -0,0 +1,203 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from types import MappingProxyType
+
+# Этот модуль - хранилище кастомных правил цен (ID товара -> цена), которые задаются через Web UI.
+# Раньше правила лежали в rules.json: каждый запрос Flask читал и целиком перезаписывал файл, а excel_main
+# читал тот же файл из другого потока без всякой блокировки, так что одновременные правки терялись. Теперь:
+# 1. Правила хранятся в SQLite (индекс по id), каждое изменение - отдельная транзакция на одну или несколько строк.
+# 2. У хранилища есть версия, она увеличивается при каждом изменении (монотонно, общая для всех процессов).
+# 3. all() держит правила в памяти и перечитывает их из базы, только если версия поменялась.
+# 4. При первом запуске правила переносятся из rules.json (сам файл не удаляется).
+# 5. Журнал rule_changes хранит, какие id менялись в какой версии, changes_since() отдает id, измененные
+# после заданной версии, чтобы применять к каталогу только изменившиеся правила (см. CatalogSession.apply_rules).
+
+rules_db_file = os.getenv('RULES_DB_FILE', 'rules.sqlite3')
+legacy_rules_file = 'rules.json'
+
+
+class RulesStore:
+    def __init__(self, path=rules_db_file, legacy_file=legacy_rules_file):
+        self.path = path
+        self._lock = threading.Lock()
+        # isolation_level=None: транзакции открываются явно через BEGIN IMMEDIATE, чтобы версия
+        # увеличивалась атомарно и в нескольких процессах сразу
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS rules (id TEXT PRIMARY KEY, price TEXT NOT NULL, version INTEGER NOT NULL)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS rule_changes (version INTEGER NOT NULL, id TEXT NOT NULL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS rule_changes_version ON rule_changes (version)")
+        self._connection.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+        # (версия, правила): одна пара, чтобы потоки не увидели правила одной версии с номером другой
+        self._cached = (None, {})
+        self._migrate(legacy_file)
+
+    # Перенос правил из rules.json, выполняется один раз (отметка в meta)
+    def _migrate(self, legacy_file):
+        if not legacy_file or not os.path.exists(legacy_file):
+            return
+        with self._transaction() as connection:
+            if connection.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone():
+                return
+            with open(legacy_file, 'r') as file:
+                rules = json.load(file)
+            version = self._bump_version(connection)
+            connection.executemany(
+                "INSERT OR IGNORE INTO rules (id, price, version) VALUES (?, ?, ?)",
+                [(str(rule_id), str(price), version) for rule_id, price in rules.items()])
+            self._log_changes(connection, version, rules.keys())
+            connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated_from_json', 1)")
+        logging.info(
+            f"Правила из {legacy_file} перенесены в {self.path}: {len(rules)} шт.")
+
+    # Транзакция на запись: BEGIN IMMEDIATE сразу берет блокировку записи, параллельные писатели ждут
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    # Транзакция на чтение: версия и данные читаются из одного снимка базы
+    @contextmanager
+    def _read(self):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                yield self._connection
+            finally:
+                self._connection.execute("COMMIT")
+
+    @staticmethod
+    def _bump_version(connection):
+        connection.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    @staticmethod
+    def _log_changes(connection, version, rule_ids):
+        connection.executemany("INSERT INTO rule_changes (version, id) VALUES (?, ?)",
+                               [(version, str(rule_id)) for rule_id in rule_ids])
+
+    def version(self):
+        with self._lock:
+            return self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    # Версия и все правила этой версии. Кэш в памяти перечитывается только при смене версии, правила только для чтения
+    def snapshot(self):
+        version = self.version()
+        if version != self._cached[0]:
+            # Версия и правила читаются в одной транзакции чтения, чтобы не получить правила другой версии
+            with self._read() as connection:
+                version = connection.execute(
+                    "SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+                rows = connection.execute(
+                    "SELECT id, price FROM rules").fetchall()
+            self._cached = (version, dict(rows))
+        version, rules = self._cached
+        return version, MappingProxyType(rules)
+
+    def all(self):
+        return self.snapshot()[1]
+
+    # Правила, которые добавлены, изменены или удалены после версии version: текущая версия и {id: цена},
+    # у удаленных правил цена None. Читается одной транзакцией, без загрузки всех правил
+    def changes_since(self, version):
+        with self._read() as connection:
+            current = connection.execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            rows = connection.execute(
+                "SELECT changed.id, rules.price FROM (SELECT DISTINCT id FROM rule_changes WHERE version > ?) AS changed "
+                "LEFT JOIN rules ON rules.id = changed.id", (version,)).fetchall()
+        return current, dict(rows)
+
+    # Страница правил в порядке id: версия, общее число правил и список (id, цена)
+    def page(self, offset=0, limit=100):
+        with self._read() as connection:
+            version = connection.execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            total = connection.execute(
+                "SELECT COUNT(*) FROM rules").fetchone()[0]
+            rows = connection.execute(
+                "SELECT id, price FROM rules ORDER BY id LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        return version, total, rows
+
+    # Цены правил для нескольких id, {id: цена} только для существующих правил
+    def get_many(self, rule_ids):
+        rule_ids = [str(rule_id) for rule_id in rule_ids]
+        result = {}
+        with self._lock:
+            # Пачками, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(rule_ids), 500):
+                chunk = rule_ids[start:start + 500]
+                result.update(self._connection.execute(
+                    f"SELECT id, price FROM rules WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return result
+
+    # Удалить из журнала изменения до версии version включительно, когда они уже применены к каталогу
+    def prune_changes(self, version):
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM rule_changes WHERE version <= ?", (version,))
+
+    def get(self, rule_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT price FROM rules WHERE id = ?", (str(rule_id),)).fetchone()
+        return row[0] if row else None
+
+    def upsert(self, rule_id, price):
+        return self.upsert_many({rule_id: price})
+
+    # Добавить или изменить несколько правил одной транзакцией. Возвращает новую версию
+    def upsert_many(self, rules):
+        with self._transaction() as connection:
+            version = self._bump_version(connection)
+            connection.executemany(
+                "INSERT INTO rules (id, price, version) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET price = excluded.price, version = excluded.version",
+                [(str(rule_id), str(price), version) for rule_id, price in rules.items()])
+            self._log_changes(connection, version, rules.keys())
+        return version
+
+    def delete(self, rule_id):
+        return self.delete_many([rule_id])
+
+    def delete_many(self, rule_ids):
+        with self._transaction() as connection:
+            version = self._bump_version(connection)
+            connection.executemany(
+                "DELETE FROM rules WHERE id = ?", [(str(rule_id),) for rule_id in rule_ids])
+            self._log_changes(connection, version, rule_ids)
+        return version
+
+    def clear(self):
+        with self._transaction() as connection:
+            version = self._bump_version(connection)
+            connection.execute(
+                "INSERT INTO rule_changes (version, id) SELECT ?, id FROM rules", (version,))
+            connection.execute("DELETE FROM rules")
+        return version
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM rules").fetchone()[0]
+
+
+rules_store = RulesStore()
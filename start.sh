@@ -1,4 +1,6 @@
 #!/bin/bash
-touch /var/log/screen.log
+touch /var/log/screen.log /var/log/web.log
 screen -dmS yandex_market_bot bash -c "source /opt/venv/bin/activate && python main.py > /var/log/screen.log 2>&1"
-tail -f /var/log/screen.log
+# Web UI правил отдельным процессом, настройки в gunicorn.conf.py
+screen -dmS yandex_market_web bash -c "source /opt/venv/bin/activate && gunicorn web:app > /var/log/web.log 2>&1"
+tail -f /var/log/screen.log /var/log/web.log
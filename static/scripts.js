@@ -12,6 +12,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const editDeleteMessage = document.getElementById('edit-delete-message');
     const confirmEditDeleteYesBtn = document.getElementById('confirm-edit-delete-yes-btn');
     const confirmEditDeleteNoBtn = document.getElementById('confirm-edit-delete-no-btn');
+    const deleteSelectedBtn = document.getElementById('delete-selected-btn');
 
     let editDeleteAction = null;
     let currentRule = null;
@@ -38,7 +39,8 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
         if (rules.length > 0) {
-            fetch(`${urlPrefix}/add_rule`, {
+            // Все правила формы одним запросом, одной транзакцией
+            fetch(`${urlPrefix}/rules/bulk_upsert`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(rules)
@@ -63,6 +65,7 @@ document.addEventListener('DOMContentLoaded', function() {
     viewRulesBtn.addEventListener('click', () => {
         if (rulesVisible) {
             rulesList.classList.add('hidden');
+            deleteSelectedBtn.classList.add('hidden');
             rulesVisible = false;
         } else {
             fetch(`${urlPrefix}/get_rules`)
@@ -78,6 +81,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         const ruleItem = document.createElement('div');
                         ruleItem.className = 'rule-item';
                         ruleItem.innerHTML = `
+                            <input type="checkbox" class="select-rule" data-id="${id}">
                             <input type="text" value="${id}" class="id-input" disabled>
                             <input type="text" value="${rules[id]}" class="price-input">
                             <button class="edit-rule-btn">Edit</button>
@@ -105,16 +109,31 @@ document.addEventListener('DOMContentLoaded', function() {
                         });
                     }
                     rulesList.classList.remove('hidden');
+                    deleteSelectedBtn.classList.remove('hidden');
                     rulesVisible = true;
                 })
                 .catch(error => console.error('Error:', error));
         }
     });
 
+    // Удаление отмеченных правил одним запросом
+    deleteSelectedBtn.addEventListener('click', () => {
+        const ids = Array.from(rulesList.querySelectorAll('.select-rule:checked')).map(input => input.dataset.id);
+        if (ids.length === 0) {
+            return;
+        }
+        currentRule = { ids };
+        editDeleteAction = 'delete-selected';
+        editDeleteMessage.textContent = `Вы уверены что хотите удалить выбранные правила (${ids.length} шт.)?`;
+        editDeleteConfirmation.classList.remove('hidden');
+        rulesList.appendChild(editDeleteConfirmation);
+    });
+
     deleteAllBtn.addEventListener('click', () => {
         confirmation.classList.remove('hidden');
         viewRulesBtn.classList.add('hidden');
         deleteAllBtn.classList.add('hidden');
+        deleteSelectedBtn.classList.add('hidden');
         rulesList.classList.add('hidden');
         rulesVisible = false;
     });
@@ -162,6 +181,24 @@ document.addEventListener('DOMContentLoaded', function() {
                     }
                 })
                 .catch(error => console.error('Error:', error));
+        } else if (editDeleteAction === 'delete-selected') {
+            fetch(`${urlPrefix}/rules/bulk_delete`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ids: currentRule.ids })
+            }).then(response => {
+                if (!response.ok) {
+                    throw new Error('Network response was not ok');
+                }
+                return response.json();
+            }).then(data => {
+                if (data.success) {
+                    editDeleteConfirmation.classList.add('hidden');
+                    rulesVisible = false;
+                    viewRulesBtn.click();
+                    console.log(`Удалено правил: ${data.count}`);
+                }
+            }).catch(error => console.error('Error:', error));
         } else if (editDeleteAction === 'edit') {
             fetch(`${urlPrefix}/edit_rule`, {
                 method: 'POST',
@@ -0,0 +1,13 @@
+import os
+import tempfile
+
+# Модули проекта при импорте открывают свои базы (rules.sqlite3, кэши GPT и картинок) по относительным путям,
+# поэтому тесты работают во временной папке, а не в корне проекта. Публикация без снапшотов и сжатых копий
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('SNAPSHOT_COUNT', '0')
+os.environ.setdefault('PUBLISH_GZIP', '0')
+os.environ.setdefault('PUBLISH_BROTLI', '0')
+
+
+def pytest_configure(config):
+    os.chdir(tempfile.mkdtemp(prefix='tests-'))
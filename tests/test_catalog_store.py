@@ -0,0 +1,70 @@
+import sqlite3
+import pytest
+from catalog_store import open_catalog
+
+catalog_xml = """<?xml version="1.0" ?>
+<yml_catalog date="2024-01-01T00:00:00">
+  <shop>
+    <name>smart-dostup</name>
+    <offers>
+      <offer id="1">
+        <name>Товар 1</name>
+        <price>1450.0</price>
+      </offer>
+      <offer id="2">
+        <name>Товар 2</name>
+        <price>2900.0</price>
+      </offer>
+    </offers>
+  </shop>
+</yml_catalog>"""
+
+
+@pytest.fixture
+def feed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('products.xml', 'w', encoding='utf-8') as f:
+        f.write(catalog_xml)
+    return 'products.xml'
+
+
+# Каталог открывается через with, соединение с базой закрывается на выходе
+def test_open_catalog_closes_connection(feed):
+    with open_catalog(feed, 'sqlite') as catalog:
+        assert catalog.offer_ids() == {'1', '2'}
+    with pytest.raises(sqlite3.ProgrammingError):
+        catalog.offer_ids()
+
+
+def test_xml_catalog_is_context_manager(feed):
+    with open_catalog(feed, 'xml') as catalog:
+        assert catalog.offer_ids(price='2900.0') == {'2'}
+
+
+# touch и копия того же файла не заставляют импортировать каталог заново: изменения из базы не теряются
+def test_same_content_is_not_reimported(feed, caplog):
+    with open_catalog(feed, 'sqlite') as catalog:
+        catalog.set_prices({'1': '1500.0'})
+        catalog.save()
+        generation = catalog.generation()
+    with open(feed, 'r', encoding='utf-8') as f:
+        published = f.read()
+    with open(feed, 'w', encoding='utf-8') as f:
+        f.write(published)
+
+    with caplog.at_level('WARNING'), open_catalog(feed, 'sqlite') as catalog:
+        assert catalog.offer_ids(price='1500.0') == {'1'}
+        assert catalog.generation() == generation
+    assert not [record for record in caplog.records if record.levelname == 'WARNING']
+
+
+# Файл, переписанный не из базы, импортируется заново, и это видно в логе
+def test_rewritten_file_is_reimported_with_warning(feed, caplog):
+    with open_catalog(feed, 'sqlite') as catalog:
+        catalog.save()
+    with open(feed, 'w', encoding='utf-8') as f:
+        f.write(catalog_xml.replace('<price>2900.0</price>', '<price>3000.0</price>'))
+
+    with caplog.at_level('WARNING'), open_catalog(feed, 'sqlite') as catalog:
+        assert catalog.offer_ids(price='3000.0') == {'2'}
+    assert any('импортируется из файла заново' in record.getMessage() for record in caplog.records)
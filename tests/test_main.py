@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+import main
+import rules_store
+from main import DownloadTracker
+from rules_store import RulesStore
+
+
+class FakeDocument:
+    def __init__(self, id, size):
+        self.id = id
+        self.size = size
+
+
+# Сообщение бота с документом: id документа Telegram и байты файла
+class FakeEvent:
+    def __init__(self, document_id, data):
+        self.data = data
+        self.document = FakeDocument(document_id, len(data))
+        self.downloads = 0
+
+    async def download_media(self, file=bytes):
+        self.downloads += 1
+        return self.data
+
+
+# Воркер, который только запоминает задания
+class FakeWorker:
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, job):
+        self.jobs.append(job)
+        return None
+
+    def stats(self):
+        return {'submitted': len(self.jobs)}
+
+
+@pytest.fixture
+def bot(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'downloads', DownloadTracker())
+    monkeypatch.setattr(main, 'worker', FakeWorker())
+    monkeypatch.setattr(main, 'status_file', str(tmp_path / 'status.json'))
+    store = RulesStore(str(tmp_path / 'rules.sqlite3'), legacy_file=None)
+    monkeypatch.setattr(rules_store, 'rules_store', store)
+    return store
+
+
+def _replay(events):
+    async def replay():
+        for event in events:
+            await main.handle_document(event)
+    asyncio.run(replay())
+
+
+# Записанная последовательность файлов бота: в обработку уходят только файлы с новым содержимым
+def test_identical_files_are_skipped(bot):
+    first = b'xlsx-1'
+    second = b'xlsx-2'
+    same_document = FakeEvent(1, first)
+    _replay([FakeEvent(1, first), same_document, FakeEvent(2, first), FakeEvent(3, second), FakeEvent(3, second)])
+
+    assert [job['data'] for job in main.worker.jobs] == [first, second]
+    # Тот же документ Telegram даже не скачивается
+    assert same_document.downloads == 0
+    stats = main.downloads.stats()
+    assert stats['skipped'] == 3
+    assert stats['submitted'] == 2
+    assert stats['rules_cycles'] == 0
+
+
+# Файл тот же, но правила поменялись: уходит один цикл только с правилами, без файла
+def test_rules_change_submits_rules_cycle_on_skip(bot):
+    data = b'xlsx-1'
+    _replay([FakeEvent(1, data), FakeEvent(1, data)])
+    assert len(main.worker.jobs) == 1
+
+    version = bot.upsert('offer-1', '100')
+    _replay([FakeEvent(1, data), FakeEvent(2, data)])
+    assert main.worker.jobs[1] == {'data': None, 'checksum': f"rules-{version}", 'document': None}
+    assert len(main.worker.jobs) == 2
+
+    # Упавший цикл правил повторяется на следующем пропущенном цикле
+    main.on_worker_result({'checksum': f"rules-{version}", 'duration': 0.1, 'error': 'failed'})
+    _replay([FakeEvent(1, data)])
+    assert len(main.worker.jobs) == 3
+    assert main.worker.jobs[2]['data'] is None
+    assert main.downloads.stats()['rules_cycles'] == 2
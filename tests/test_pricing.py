@@ -0,0 +1,18 @@
+from catalog_store import new_offer_fields
+from pricing import calculate_price, format_price
+from xml_converter import XMLGenerator
+
+
+def test_format_price_rounds_to_kopecks():
+    assert format_price(1234.5678) == '1234.57'
+    assert format_price(1450) == '1450.0'
+    assert format_price(calculate_price(9999.99)) == format_price(round(9999.99 * 1.45, 2))
+
+
+# Новый offer из цикла excel_main и offer сборки с нуля получают одну и ту же запись цены
+def test_new_offer_price_matches_full_build():
+    product_data = {'xmlid': '1', 'name': "Товар", 'vendor': "Apple", 'calculated_price': calculate_price(1234.56),
+                    'categoryId': 3, 'description': "Описание", 'dimensions': "10/10/10", 'weight': "0.5"}
+    fields, _ = new_offer_fields(product_data)
+    offer = XMLGenerator('products.xlsx').build_offer(product_data)
+    assert fields['price'] == offer.findtext('price') == format_price(product_data['calculated_price'])
@@ -0,0 +1,83 @@
+import os
+import threading
+import publisher
+
+feed = """<?xml version="1.0" ?>
+<yml_catalog date="{date}">
+  <shop>
+    <offers>
+      <offer id="1">
+        <price>{price}</price>
+      </offer>
+    </offers>
+  </shop>
+</yml_catalog>"""
+
+
+def _publish(path, date, price):
+    with publisher.publish(path) as f:
+        f.write(feed.format(date=date, price=price))
+
+
+# Каталог, отрисованный заново без изменений, отличается только датой: файл не заменяется и mtime не меняется
+def test_publish_skips_catalog_that_differs_only_by_date(tmp_path):
+    path = str(tmp_path / 'products.xml')
+    _publish(path, '2024-01-01T10:00:00', '1450.0')
+    os.utime(path, ns=(0, 0))
+
+    _publish(path, '2024-01-02T11:30:00+0300', '1450.0')
+    assert os.stat(path).st_mtime_ns == 0
+    with open(path, 'r', encoding='utf-8') as f:
+        assert 'date="2024-01-01T10:00:00"' in f.read()
+
+    _publish(path, '2024-01-02T11:30:00+0300', '1500.0')
+    assert os.stat(path).st_mtime_ns != 0
+    with open(path, 'r', encoding='utf-8') as f:
+        assert '<price>1500.0</price>' in f.read()
+
+
+def test_atomic_write_compares_date_without_ignore(tmp_path):
+    path = str(tmp_path / 'products.xml')
+    for date in ('2024-01-01T10:00:00', '2024-01-01T10:00:01'):
+        with publisher.atomic_write(path, skip_identical=True) as f:
+            f.write(feed.format(date=date, price='1450.0'))
+    with open(path, 'r', encoding='utf-8') as f:
+        assert '2024-01-01T10:00:01' in f.read()
+
+
+# Читатели, которые забирают фид во время публикаций, всегда видят одну из версий целиком
+def test_readers_never_see_partial_feed(tmp_path):
+    path = str(tmp_path / 'products.xml')
+    versions = [feed.format(date='2024-01-01T10:00:00', price=str(price)).replace(
+        '    </offers>', '      <offer id="2"><name>' + 'x' * 200000 + '</name></offer>\n    </offers>')
+        for price in range(3)]
+    _publish(path, '2024-01-01T10:00:00', '0')
+    expected = set(versions) | {feed.format(date='2024-01-01T10:00:00', price='0')}
+    stop = threading.Event()
+    seen = []
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            if content not in expected:
+                errors.append(len(content))
+            seen.append(len(content))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for number in range(200):
+            with publisher.publish(path) as f:
+                content = versions[number % len(versions)]
+                # Запись по частям: незаконченный файл читатели успели бы увидеть, если бы он был на месте фида
+                for start in range(0, len(content), 4096):
+                    f.write(content[start:start + 4096])
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    assert not errors
+    assert len(seen) > 200
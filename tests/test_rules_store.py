@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+import multiprocessing
+from rules_store import RulesStore
+
+writers = 4
+writes = 50
+
+
+# Записи одного писателя: правки по два правила и удаление каждого пятого. Возвращает версии своих записей
+def _write(store, writer):
+    versions = []
+    for number in range(writes):
+        if number % 5 == 4:
+            versions.append(store.delete(f"{writer}-{number - 1}"))
+        else:
+            versions.append(store.upsert_many({f"{writer}-{number}": str(number), f"{writer}-shared": str(number)}))
+    return versions
+
+
+# Писатель в отдельном процессе, как воркер gunicorn: свое соединение с той же базой
+def _write_process(path, writer, results):
+    results.put((writer, _write(RulesStore(path, legacy_file=None), writer)))
+
+
+def _check(path, versions):
+    with sqlite3.connect(path) as connection:
+        current = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        logged = connection.execute("SELECT version, id FROM rule_changes").fetchall()
+    every = [version for writer_versions in versions.values() for version in writer_versions]
+    # Каждая запись получила свою версию, у каждого писателя версии растут, пропусков нет
+    assert sorted(every) == list(range(1, writers * writes + 1))
+    assert current == writers * writes
+    for writer_versions in versions.values():
+        assert writer_versions == sorted(writer_versions)
+    # Ни одна строка журнала не потерялась: upsert пишет два id, delete - один
+    expected = set()
+    for writer, writer_versions in versions.items():
+        for number, version in enumerate(writer_versions):
+            if number % 5 == 4:
+                expected.add((version, f"{writer}-{number - 1}"))
+            else:
+                expected.update({(version, f"{writer}-{number}"), (version, f"{writer}-shared")})
+    assert len(logged) == len(expected)
+    assert set(logged) == expected
+
+
+def test_parallel_writer_processes(tmp_path):
+    path = str(tmp_path / 'rules.sqlite3')
+    RulesStore(path, legacy_file=None)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_write_process, args=(path, writer, results)) for writer in range(writers)]
+    for process in processes:
+        process.start()
+    versions = dict(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    _check(path, versions)
+
+
+# Потоки Flask в одном процессе делят одно соединение
+def test_parallel_writer_threads(tmp_path):
+    path = str(tmp_path / 'rules.sqlite3')
+    store = RulesStore(path, legacy_file=None)
+    versions = {}
+
+    def write(writer):
+        versions[writer] = _write(store, writer)
+
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    _check(path, versions)
+    current, changed = store.changes_since(0)
+    assert current == writers * writes
+    assert len(changed) == len(store) + writers * (writes // 5)
@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from throttle import Stage, CircuitOpen
+
+
+async def _fail():
+    raise ConnectionError("нет ответа")
+
+
+# Отмененный пробный запрос не оставляет цепь в half_open: следующий запрос снова пробный и замыкает цепь
+def test_cancelled_probe_releases_half_open():
+    async def scenario():
+        stage = Stage('test', 4, retries=0, failure_threshold=1, reset_timeout=0.0)
+        with pytest.raises(ConnectionError):
+            await stage.request(_fail)
+        assert stage.breaker.state == 'open'
+
+        probe = asyncio.create_task(stage.request(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        assert stage.breaker.state == 'half_open'
+        with pytest.raises(CircuitOpen):
+            await stage.request(lambda: asyncio.sleep(0))
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        await stage.request(lambda: asyncio.sleep(0))
+        assert stage.breaker.state == 'closed'
+
+    asyncio.run(scenario())
@@ -0,0 +1,91 @@
+import time
+import asyncio
+import main
+from main import DownloadTracker
+from worker import ProcessingWorker
+
+processing_time = 0.5
+
+
+# Медленная обработка вместо excel_main(): записывает, какой файл обработан. Функция модуля, чтобы ее передал spawn
+def _slow_process(data):
+    time.sleep(processing_time)
+    with open('processed.log', 'a') as f:
+        f.write(data.decode() + '\n')
+
+
+class FakeDocument:
+    def __init__(self, id, size):
+        self.id = id
+        self.size = size
+
+
+class FakeEvent:
+    def __init__(self, data):
+        self.data = data
+        self.document = FakeDocument(int(data), len(data))
+
+    async def download_media(self, file=bytes):
+        return self.data
+
+
+async def _wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.01)
+
+
+# Пока воркер занят, бот присылает еще три файла: event loop не блокируется, а следующим обрабатывается самый новый
+def test_slow_processor_keeps_loop_responsive_and_newest_file_wins(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'downloads', DownloadTracker())
+    monkeypatch.setattr(main, 'status_file', str(tmp_path / 'status.json'))
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        worker = ProcessingWorker(process=_slow_process,
+                                  on_result=lambda result: loop.call_soon_threadsafe(main.on_worker_result, result))
+        monkeypatch.setattr(main, 'worker', worker)
+        worker.start()
+
+        lag = 0.0
+
+        async def ticker():
+            nonlocal lag
+            while True:
+                before = time.monotonic()
+                await asyncio.sleep(0.01)
+                lag = max(lag, time.monotonic() - before - 0.01)
+
+        ticking = asyncio.create_task(ticker())
+        try:
+            await main.handle_document(FakeEvent(b'1'))
+            await _wait_for(lambda: worker.stats()['running'] == 1)
+            for data in (b'2', b'3', b'4'):
+                await main.handle_document(FakeEvent(data))
+            await _wait_for(lambda: main.downloads.processed == 2)
+        finally:
+            ticking.cancel()
+            worker.stop()
+        return worker.stats(), lag
+
+    stats, lag = asyncio.run(scenario())
+    assert (tmp_path / 'processed.log').read_text().split() == ['1', '4']
+    assert stats['coalesced'] == 2
+    assert stats['runs'] == 2
+    assert main.downloads.stats()['submitted'] == 4
+    assert lag < 0.2
+
+
+# Цикл только с правилами не вытесняет ждущий в очереди файл, а новый файл вытесняет старый
+def test_rules_job_does_not_replace_queued_file():
+    worker = ProcessingWorker(process=_slow_process)
+    first = {'data': b'1', 'checksum': '1', 'document': (1, 1)}
+    rules = {'data': None, 'checksum': 'rules-1', 'document': None}
+    second = {'data': b'2', 'checksum': '2', 'document': (2, 1)}
+
+    assert worker.submit(first) is None
+    assert worker.submit(rules) is rules
+    assert worker.submit(second) == first
+    assert worker.stats()['coalesced'] == 2
@@ -0,0 +1,46 @@
+import re
+import pandas as pd
+from pricing import calculate_price
+from xml_converter import XMLGenerator, PartialCatalog
+
+
+def _product(number, price):
+    return {'xmlid': f"{number:04d}", 'name': f"Товар {number}", 'vendor': "Apple", 'price': price,
+            'calculated_price': calculate_price(price), 'categoryId': 3,
+            'description': f"Строка {number}\n\n  \nЕще строка", 'pictures': [f"https://example.com/{number}.jpg"],
+            'dimensions': "10/10/10", 'weight': "0.5"}
+
+
+class _Journal:
+    def __init__(self, products):
+        self.products = products
+
+    def entries(self):
+        return [dict(product) for product in self.products]
+
+
+def _without_date(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return re.sub(r' date="[^"]*"', '', f.read())
+
+
+# Промежуточная публикация при сборке с нуля и итоговый products.xml записаны одинаково:
+# без пустых строк и без перевода строки в конце
+def test_partial_publish_matches_final_catalog(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    products = [_product(number, 1000 + number * 7.3) for number in range(5)]
+    generator = XMLGenerator('products.xlsx')
+
+    partial = PartialCatalog(generator, 'partial.xml')
+    for product_data in products:
+        partial.add(product_data)
+    partial.publish()
+    partial.close()
+
+    table = pd.DataFrame({'xmlid': [p['xmlid'] for p in products], 'price': [p['price'] for p in products]})
+    assert generator.write_catalog(table, _Journal(products), 'final.xml') == len(products)
+
+    final = _without_date('final.xml')
+    assert _without_date('partial.xml') == final
+    assert not final.endswith('\n')
+    assert '\n\n' not in final
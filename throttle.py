@@ -0,0 +1,334 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+# Этот модуль - ограничители нагрузки для асинхронного конвейера обогащения товаров (xml_converter.py).
+# Раньше параллельность задавалась количеством потоков (os.cpu_count() * 2..4), которые почти все время спали
+# в time.sleep(1), и никак не зависела от лимитов внешних API. Теперь у каждой стадии (GPT, поиск в Bing,
+# проверка картинок) свой лимит одновременных запросов и, при необходимости, свой лимит запросов в секунду.
+# Примитивы asyncio привязываются к event loop, поэтому объекты создаются на каждый запуск конвейера.
+# Повторы запросов к OpenAI и Bing тоже собраны здесь (раньше у каждого вызова был свой цикл повторов без пауз,
+# и при 429 все задачи разом долбили API). Stage.request() для каждого запроса к внешнему API:
+# 1. Повторяет запрос при 429, 5xx и сетевых ошибках с экспоненциальной паузой со случайным разбросом,
+# при 429 с Retry-After вся стадия ждет указанное время.
+# 2. Подстраивает лимит одновременных слотов стадии (AIMD): +1 за каждые limit удачных запросов, вдвое меньше
+# при 429 или при ответе дольше latency_target.
+# 3. Размыкает цепь (CircuitBreaker) после failure_threshold запросов подряд, которым не помогли повторы:
+# следующие reset_timeout секунд запросы не отправляются, а сразу получают CircuitOpen, и вызывающий
+# подставляет значения по умолчанию.
+# 4. stats() отдает состояние стадии (лимит, 429, повторы, отброшенные запросы, состояние цепи), конвейер
+# пишет его в файл PIPELINE_METRICS_FILE, его показывает /status в Web UI.
+# Сервер с ограничением нагрузки и сравнение со старыми повторами - в bench/faults.py.
+
+# Файл с метриками стадий конвейера, пишется во время сборки (см. XMLGenerator.pipeline)
+pipeline_metrics_file = os.getenv('PIPELINE_METRICS_FILE', 'pipeline_metrics.json')
+
+
+# Отказ без запроса: цепь стадии разомкнута после серии ошибок внешнего API
+class CircuitOpen(Exception):
+    pass
+
+
+# Внешний API сообщил о превышении лимита не HTTP-статусом, а в теле ответа (например, неудачный run ассистента)
+class Throttled(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _status_code(exc):
+    status = getattr(exc, 'status_code', None)
+    response = getattr(exc, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return status
+
+
+# 429 или 503: внешний API перегружен, нужно снизить нагрузку
+def is_throttled(exc):
+    return isinstance(exc, Throttled) or _status_code(exc) in (429, 503)
+
+
+# Пауза из заголовка Retry-After (только число секунд), None - заголовка нет
+def retry_after(exc):
+    if isinstance(exc, Throttled):
+        return exc.retry_after
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+
+# Token bucket: в среднем не больше rate запросов в секунду, допускается всплеск до burst запросов
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Лимит одновременных запросов, который меняется по AIMD: медленно растет, пока запросы проходят, и быстро
+# падает при перегрузке. Без вызовов success()/throttled() работает как обычный семафор на max_limit
+class AdaptiveConcurrency:
+    def __init__(self, max_limit, min_limit=1, latency_target=None, decrease=0.5, cooldown=1.0):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(max_limit)
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.active = 0
+        self.decreases = 0
+        self._decreased_at = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    async def release(self):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def success(self, latency):
+        if self.latency_target and latency > self.latency_target:
+            self.throttled()
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def throttled(self):
+        now = time.monotonic()
+        # Пачка одновременных запросов получает 429 почти разом, это одна перегрузка, а не limit перегрузок
+        if now - self._decreased_at < self.cooldown:
+            return
+        self._decreased_at = now
+        limit = max(self.min_limit, self.limit * self.decrease)
+        if int(limit) < int(self.limit):
+            self.decreases += 1
+        self.limit = limit
+
+
+# Автомат closed -> open -> half_open: после failure_threshold неудачных запросов подряд цепь размыкается
+# на reset_timeout секунд, затем пропускает один пробный запрос. Удачный пробный запрос замыкает цепь, неудачный снова размыкает
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        if self.state == 'open':
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = 'half_open'
+            self._probing = False
+        if self.state == 'half_open':
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def success(self):
+        if self.state != 'closed':
+            logging.warning(f"Стадия {self.name}: внешний API снова отвечает, цепь замкнута")
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    # Пробный запрос отменен: ответа не было, цепь остается half_open, и следующий запрос снова пробный
+    def cancel_probe(self):
+        if self.state == 'half_open':
+            self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+            self.state = 'open'
+            self.opens += 1
+            self._opened_at = time.monotonic()
+            self._probing = False
+            logging.warning(f"Стадия {self.name}: {self.failures} неудачных запросов подряд, запросы не отправляются {
+                            self.reset_timeout:.0f} с, вместо ответов значения по умолчанию")
+
+
+# Стадия конвейера: не больше concurrency задач одновременно внутри slot() и не больше rate запросов в секунду.
+# request() добавляет повторы, AIMD и размыкание цепи для запросов к одному внешнему API.
+# transient - типы исключений, которые считаются временной ошибкой (сетевые ошибки клиента этого API)
+class Stage:
+    def __init__(self, name, concurrency, rate=None, retries=4, latency_target=None,
+                 failure_threshold=5, reset_timeout=30.0, transient=(), backoff_base=1.0, backoff_cap=30.0):
+        self.name = name
+        self.concurrency = AdaptiveConcurrency(concurrency, latency_target=latency_target)
+        self.limiter = RateLimiter(rate) if rate else None
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.retries = retries
+        self.transient = transient
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.paused_until = 0.0
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+        self.requests = 0
+        self.busy_time = 0.0
+        self.succeeded = 0
+        self.failed = 0
+        self.throttled = 0
+        self.errors = 0
+        self.retried = 0
+        self.shed = 0
+        self.started = time.monotonic()
+
+    # Дождаться разрешения на очередной запрос к внешнему API (пауза после 429 и лимит в секунду)
+    async def limit(self):
+        self.requests += 1
+        while time.monotonic() < self.paused_until:
+            await asyncio.sleep(self.paused_until - time.monotonic())
+        if self.limiter is not None:
+            await self.limiter.acquire()
+
+    # Одновременно выполняемая единица работы (запрос или несколько запросов подряд, например запуск ассистента).
+    # Каждый запрос внутри слота идет через request() или после limit()
+    @asynccontextmanager
+    async def slot(self):
+        await self.concurrency.acquire()
+        try:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self.active -= 1
+                self.calls += 1
+                self.busy_time += time.monotonic() - started
+        finally:
+            await self.concurrency.release()
+
+    # Учесть перегрузку внешнего API: снизить лимит и, если API указал Retry-After, приостановить всю стадию.
+    # Возвращает паузу из Retry-After (None - не указана)
+    def throttle(self, exc):
+        self.throttled += 1
+        self.concurrency.throttled()
+        pause = retry_after(exc)
+        if pause:
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        return pause
+
+    def is_transient(self, exc):
+        status = _status_code(exc)
+        return (is_throttled(exc) or (status is not None and status >= 500)
+                or isinstance(exc, (asyncio.TimeoutError, ConnectionError) + tuple(self.transient)))
+
+    # Пауза перед повтором attempt (с нуля): экспонента с полным случайным разбросом, чтобы задачи,
+    # получившие 429 одновременно, не повторяли запрос одновременно
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    # Один запрос к внешнему API: func() - корутина с этим запросом. Временные ошибки повторяются с паузой.
+    # Бросает CircuitOpen, если цепь разомкнута, и последнюю ошибку, если повторы не помогли.
+    # Слот стадии не берет: его держит вызывающий на всю единицу работы (см. call())
+    async def request(self, func):
+        probe = False
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt == 0:
+                    allowed = self.breaker.allow()
+                    probe = allowed and self.breaker.state == 'half_open'
+                else:
+                    # Повторы уже начатого запроса идут и в half_open, но прекращаются, если цепь разомкнулась
+                    allowed = self.breaker.state != 'open'
+                if not allowed:
+                    self.shed += 1
+                    raise CircuitOpen(f"Стадия {self.name}: цепь разомкнута")
+                await self.limit()
+                started = time.monotonic()
+                try:
+                    result = await func()
+                except Exception as e:
+                    if not self.is_transient(e):
+                        # Внешний API ответил, ошибка в самом запросе: повтор не поможет, но API жив
+                        self.breaker.success()
+                        self.failed += 1
+                        raise
+                    pause = None
+                    if is_throttled(e):
+                        pause = self.throttle(e)
+                    else:
+                        self.errors += 1
+                    if attempt == self.retries:
+                        self.failed += 1
+                        self.breaker.failure()
+                        raise
+                    self.retried += 1
+                    delay = max(self.backoff(attempt), pause or 0)
+                    logging.info(f"Стадия {self.name}: {type(e).__name__} {e}, повтор {attempt + 1} из {
+                                 self.retries} через {delay:.1f} с")
+                    await asyncio.sleep(delay)
+                else:
+                    self.breaker.success()
+                    self.concurrency.success(time.monotonic() - started)
+                    self.succeeded += 1
+                    return result
+        except asyncio.CancelledError:
+            # Отмененный пробный запрос (отмена задачи, таймаут стадии) не должен оставить цепь в half_open навсегда
+            if probe:
+                self.breaker.cancel_probe()
+            raise
+
+    # Единица работы из одного запроса: слот стадии и request()
+    async def call(self, func):
+        async with self.slot():
+            return await self.request(func)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'stage': self.name,
+            'concurrency': self.concurrency.max_limit,
+            'limit': round(self.concurrency.limit, 2),
+            'limit_decreases': self.concurrency.decreases,
+            'calls': self.calls,
+            'requests': self.requests,
+            'max_active': self.max_active,
+            'avg_time': round(self.busy_time / self.calls, 3) if self.calls else 0.0,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'throttled': self.throttled,
+            'errors': self.errors,
+            'retried': self.retried,
+            'shed': self.shed,
+            'circuit': self.breaker.state,
+            'circuit_opens': self.breaker.opens,
+            'goodput': round(self.succeeded / elapsed, 2) if elapsed else 0.0,
+        }
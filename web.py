@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import logging
+from flask import Flask, render_template, request, jsonify
+from rules_store import rules_store
+from throttle import pipeline_metrics_file
+from worker import status_file
+
+# Этот модуль - Web UI для кастомных правил цен (market-rules.aposazhennikov.ru).
+# Раньше Flask запускался dev-сервером с debug=True в потоке процесса бота, а массовые правки из Web UI
+# уходили сотнями последовательных POST по одному правилу. Теперь:
+# 1. Приложение работает отдельным процессом под gunicorn с несколькими воркерами (настройки в gunicorn.conf.py),
+# каждый воркер открывает свое соединение с rules.sqlite3.
+# 2. /rules/bulk_upsert и /rules/bulk_delete меняют любое число правил одной транзакцией.
+# 3. /get_rules отдает ETag по версии правил и 304, если правила не менялись, а с параметрами offset/limit - страницу.
+# 4. /status читает состояние обработки Excel из файла STATUS_FILE, который пишет процесс бота (main.py),
+# и метрики стадий конвейера из PIPELINE_METRICS_FILE (лимиты, 429, повторы, состояние цепи по OpenAI и Bing).
+# Нагрузочный тест - в bench/web_load.py.
+
+# Наибольший размер страницы /get_rules
+rules_page_limit = int(os.getenv('RULES_PAGE_LIMIT', '1000'))
+
+app = Flask(__name__)
+
+
+@app.before_request
+def before_request():
+    if request.headers.get('X-Script-Name'):
+        url_prefix = request.headers['X-Script-Name']
+        if request.path.startswith(url_prefix):
+            request.environ['SCRIPT_NAME'] = url_prefix
+            request.environ['PATH_INFO'] = request.path[len(url_prefix):]
+
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+# Состояние обработки Excel: очередь воркера, длительность запусков, пропущенные одинаковые файлы,
+# и метрики последнего запуска конвейера обогащения, если он был
+@app.route('/status', methods=['GET'])
+def status():
+    try:
+        with open(status_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return jsonify(error=f"Нет файла состояния {status_file}, процесс бота еще не запускался"), 503
+    except ValueError as e:
+        return jsonify(error=f"Не удалось прочитать {status_file}: {e}"), 500
+    state['age'] = round(time.time() - state.get('updated', 0), 1)
+    try:
+        with open(pipeline_metrics_file, 'r', encoding='utf-8') as f:
+            state['pipeline'] = json.load(f)
+        state['pipeline']['age'] = round(
+            time.time() - state['pipeline'].get('updated', 0), 1)
+    except (FileNotFoundError, ValueError):
+        pass
+    return jsonify(state)
+
+
+def _rules_etag(version):
+    return f"rules-{version}"
+
+
+# Все правила {id: цена}, или страница правил в порядке id, если передан offset или limit.
+# Клиент присылает If-None-Match, и если версия правил не поменялась, ответ 304 без чтения правил
+@app.route('/get_rules', methods=['GET'])
+def get_rules():
+    if request.if_none_match.contains(_rules_etag(rules_store.version())):
+        response = app.response_class(status=304)
+    else:
+        if 'offset' in request.args or 'limit' in request.args:
+            try:
+                offset = int(request.args.get('offset', 0))
+                limit = int(request.args.get('limit', 100))
+            except ValueError:
+                return jsonify(success=False, error="offset и limit должны быть числами"), 400
+            if offset < 0 or not 0 < limit <= rules_page_limit:
+                return jsonify(success=False, error=f"offset >= 0, limit от 1 до {rules_page_limit}"), 400
+            version, total, rows = rules_store.page(offset, limit)
+            response = jsonify(rules=dict(rows), version=version,
+                               total=total, offset=offset, limit=limit)
+        else:
+            version, rules = rules_store.snapshot()
+            response = jsonify(dict(rules))
+        response.set_etag(_rules_etag(version))
+    # Браузер хранит ответ, но каждый раз сверяет версию с сервером
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# Правила из тела запроса: список [{"id": ..., "price": ...}] или словарь {id: цена}
+def _parse_rules(data):
+    if isinstance(data, dict):
+        data = [{'id': rule_id, 'price': price}
+                for rule_id, price in data.items()]
+    if not isinstance(data, list):
+        raise ValueError("Ожидается список правил или словарь {id: цена}")
+    rules = {}
+    for rule in data:
+        if not isinstance(rule, dict):
+            raise ValueError(f"Правило должно быть объектом: {rule}")
+        rule_id = str(rule.get('id', '')).strip()
+        price = str(rule.get('price', '')).strip()
+        if not rule_id or not price:
+            raise ValueError(f"У правила нет id или price: {rule}")
+        rules[rule_id] = price
+    return rules
+
+
+# id из тела запроса: список id или {"ids": [...]}
+def _parse_ids(data):
+    if isinstance(data, dict):
+        data = data.get('ids')
+    if not isinstance(data, list):
+        raise ValueError("Ожидается список id или {\"ids\": [...]}")
+    ids = [str(rule_id).strip() for rule_id in data]
+    if not all(ids):
+        raise ValueError("Пустой id в списке")
+    return ids
+
+
+@app.route('/rules/bulk_upsert', methods=['POST'])
+def bulk_upsert():
+    try:
+        rules = _parse_rules(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    version = rules_store.upsert_many(rules) if rules else rules_store.version()
+    return jsonify(success=True, version=version, count=len(rules))
+
+
+@app.route('/rules/bulk_delete', methods=['POST'])
+def bulk_delete():
+    try:
+        ids = _parse_ids(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    version = rules_store.delete_many(ids) if ids else rules_store.version()
+    return jsonify(success=True, version=version, count=len(ids))
+
+
+@app.route('/add_rule', methods=['POST'])
+def add_rule():
+    return bulk_upsert()
+
+
+@app.route('/delete_all_rules', methods=['POST'])
+def delete_all_rules():
+    rules_store.clear()
+    return jsonify(success=True)
+
+
+@app.route('/delete_rule/<rule_id>', methods=['POST'])
+def delete_rule(rule_id):
+    rules_store.delete(rule_id)
+    return jsonify(success=True)
+
+
+@app.route('/edit_rule', methods=['POST'])
+def edit_rule():
+    data = request.get_json()
+    rules_store.upsert(data['id'], data['price'])
+    return jsonify(success=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # Локальный запуск без gunicorn, для разработки
+    app.run(host='0.0.0.0', port=5000)
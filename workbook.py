@@ -0,0 +1,147 @@
+import os
+import time
+import pickle
+import logging
+from collections import OrderedDict
+import pandas as pd
+from openpyxl import load_workbook
+from publisher import atomic_write, file_sha256
+
+# Этот модуль - чтение products.xlsx и products_old.xlsx для сравнения и генерации каталога.
+# pd.read_excel разбирает всю книгу целиком (все колонки, стили, размеры), и раньше это делалось каждые 30 секунд
+# для обоих файлов, хотя products_old.xlsx - это просто products.xlsx прошлого цикла. Поэтому:
+# 1. Книга читается openpyxl в режиме read_only построчно, берутся только колонки xmlid, description, price.
+# 2. Разобранная таблица кэшируется по sha256 файла: в памяти (последние WORKBOOK_MEMORY_COUNT книг)
+# и в pickle-файле рядом (папка WORKBOOK_CACHE_DIR), так что переименованный в products_old.xlsx файл
+# и тот же файл после перезапуска бота заново не разбираются.
+# 3. Сколько времени ушло на чтение и откуда взята таблица, видно в stats().
+
+# Колонки, которые нужны из Excel, и где хранить разобранные таблицы
+product_columns = ['xmlid', 'description', 'price']
+workbook_cache_dir = os.getenv('WORKBOOK_CACHE_DIR', 'workbook_cache')
+workbook_cache_count = int(os.getenv('WORKBOOK_CACHE_COUNT', '4'))
+workbook_memory_count = int(os.getenv('WORKBOOK_MEMORY_COUNT', '2'))
+
+
+# xmlid приводится к строке так же, как pd.read_excel(dtype={'xmlid': str}): целое число без ".0"
+def _xmlid_to_str(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+# Построчное чтение первого листа книги, только нужные колонки
+def read_products_xlsx(path, columns=product_columns):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # В read_only режиме размеры листа берутся из файла и могут быть неверными, читаем до последней строки
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError(f"В файле {path} нет колонок: {missing}")
+        positions = [header.index(column) for column in columns]
+
+        data = {column: [] for column in columns}
+        for row in rows:
+            values = [row[position] if position < len(row) else None for position in positions]
+            if all(value is None for value in values):
+                continue
+            for column, value in zip(columns, values):
+                data[column].append(value)
+    finally:
+        workbook.close()
+
+    if 'xmlid' in data:
+        data['xmlid'] = [_xmlid_to_str(value) for value in data['xmlid']]
+    return pd.DataFrame(data, columns=columns)
+
+
+class WorkbookCache:
+    def __init__(self, cache_dir=workbook_cache_dir, cache_count=workbook_cache_count, memory_count=workbook_memory_count):
+        self.cache_dir = cache_dir
+        self.cache_count = cache_count
+        self.memory_count = memory_count
+        self._frames = OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.parsed = 0
+        self.memory_hits = 0
+        self.sidecar_hits = 0
+        self.parse_time = 0.0
+
+    def _sidecar_path(self, checksum):
+        return os.path.join(self.cache_dir, f"{checksum}.pkl")
+
+    def _remember(self, checksum, frame):
+        self._frames[checksum] = frame
+        self._frames.move_to_end(checksum)
+        while len(self._frames) > self.memory_count:
+            self._frames.popitem(last=False)
+
+    def _read_sidecar(self, checksum):
+        sidecar = self._sidecar_path(checksum)
+        if not os.path.exists(sidecar):
+            return None
+        try:
+            with open(sidecar, 'rb') as f:
+                frame = pickle.load(f)
+            # Обновляем mtime, чтобы при чистке удалялись давно не использованные таблицы
+            os.utime(sidecar)
+            return frame
+        except Exception as e:
+            logging.error(f"Не удалось прочитать кэш таблицы {sidecar}: {e}")
+            return None
+
+    def _write_sidecar(self, checksum, frame):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_write(self._sidecar_path(checksum), mode='wb') as f:
+                pickle.dump(frame, f, protocol=pickle.HIGHEST_PROTOCOL)
+            sidecars = sorted((os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                               if name.endswith('.pkl')), key=os.path.getmtime, reverse=True)
+            for old in sidecars[self.cache_count:]:
+                os.remove(old)
+        except OSError as e:
+            logging.error(f"Не удалось сохранить кэш таблицы {checksum}: {e}")
+
+    # Таблица xmlid/description/price из книги. Возвращается копия, кэш можно не бояться испортить
+    def load(self, path):
+        started = time.monotonic()
+        checksum = file_sha256(path)
+        frame = self._frames.get(checksum)
+        if frame is not None:
+            self.memory_hits += 1
+            source = 'память'
+        else:
+            frame = self._read_sidecar(checksum)
+            if frame is not None:
+                self.sidecar_hits += 1
+                source = 'кэш на диске'
+            else:
+                frame = read_products_xlsx(path)
+                self.parsed += 1
+                source = 'xlsx'
+                self._write_sidecar(checksum, frame)
+        self._remember(checksum, frame)
+        elapsed = time.monotonic() - started
+        self.parse_time += elapsed
+        logging.info(f"Таблица {path} ({len(frame)} строк) прочитана за {
+                     elapsed:.3f} с, источник: {source}")
+        return frame.copy()
+
+    def stats(self):
+        return {
+            'parsed': self.parsed,
+            'memory_hits': self.memory_hits,
+            'sidecar_hits': self.sidecar_hits,
+            'parse_time': round(self.parse_time, 3),
+        }
+
+
+workbooks = WorkbookCache()
@@ -0,0 +1,243 @@
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing as mp
+
+# Этот модуль - отдельный процесс для обработки Excel-файлов от бота поставщика.
+# Раньше excel_main() вызывался прямо в обработчике Telethon, и пока шла генерация каталога с нуля (минуты),
+# event loop стоял: не уходили сообщения боту и не обрабатывались обновления Telegram. Теперь:
+# 1. Обработчик только кладет скачанный файл в очередь и сразу возвращается.
+# 2. Очередь на один файл, побеждает последний: файлы, пришедшие во время обработки, схлопываются
+# в один следующий запуск с самым свежим файлом (сравнение при этом идет с последним обработанным файлом).
+# 3. Запись нового файла и excel_main() выполняются в процессе-воркере. Новый файл пишется в products_incoming.xlsx
+# и сравнивается с products.xlsx, а переименования products.xlsx -> products_old.xlsx и
+# products_incoming.xlsx -> products.xlsx делаются только после успешного цикла: если цикл упал,
+# повторный запуск снова сравнивает с тем же products.xlsx, и изменения не теряются.
+# 4. stats() отдает глубину очереди и длительность запусков.
+# 5. Задание без файла (data None) - цикл только с правилами, когда файл не изменился, а правила поменялись.
+# Оно не вытесняет из очереди задание с файлом: цикл с файлом и так применяет правила.
+# 6. Если процесс-воркер умер (OOM, segfault), это пишется в лог, задание, которое он обрабатывал, считается упавшим,
+# процесс запускается заново, а ожидавшее в очереди задание передается новому процессу. Результаты читает и
+# перезапуск делает только поток результатов, очередь результатов одна на все время работы: события умершего
+# процесса не теряются и учитываются до того, как его задание будет признано упавшим.
+# Процесс запускается через spawn: в родительском процессе уже открыты соединения SQLite и потоки Flask,
+# их нельзя наследовать через fork.
+
+
+incoming_file = 'products_incoming.xlsx'
+# Файл, в который процесс бота пишет состояние воркера и скачиваний, его читает /status в Web UI
+status_file = os.getenv('STATUS_FILE', 'status.json')
+
+
+# Обработка одного файла в процессе-воркере. data - байты xlsx, None - применить только правила
+def process_excel_file(data):
+    from excel_main import excel_main, rules_main
+    from publisher import atomic_write
+
+    if data is None:
+        rules_main(products_file='products.xlsx')
+        return
+
+    # Сохранить документ в файл
+    with atomic_write(incoming_file, mode='wb') as f:
+        f.write(data)
+    logging.info(f"Файл скачан и сохранен по пути: {incoming_file}")
+    # Запуск скрипта сравнения и обновления XML, сравнение с файлом прошлого успешного цикла
+    excel_main(file_new=incoming_file, file_old='products.xlsx')
+
+    # Цикл прошел, новый файл становится products.xlsx
+    if os.path.exists('products.xlsx'):
+        os.replace('products.xlsx', 'products_old.xlsx')
+    os.replace(incoming_file, 'products.xlsx')
+
+
+# Цикл процесса-воркера. Логирование настраивается при импорте excel_main, как и в основном процессе
+def _worker_main(jobs, results, process):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        results.put({'event': 'started', 'checksum': job['checksum'], 'document': job['document']})
+        started = time.monotonic()
+        error = None
+        try:
+            process(job['data'])
+        except Exception as e:
+            logging.exception(f"Ошибка обработки файла {job['checksum'][:12]}")
+            error = str(e)
+        results.put({'event': 'finished', 'checksum': job['checksum'], 'document': job['document'],
+                     'duration': time.monotonic() - started, 'error': error})
+
+
+class ProcessingWorker:
+    def __init__(self, process=process_excel_file, on_result=None):
+        self._context = mp.get_context('spawn')
+        self._target = process
+        self.on_result = on_result
+        # Воркер только пишет в очередь результатов, ее блокировку чтения он не держит, поэтому она не пересоздается
+        self._results = self._context.Queue()
+        self._spawn()
+        self._collector = threading.Thread(
+            target=self._collect, name='excel_worker_results', daemon=True)
+        self._lock = threading.Lock()
+        # Сигнал submit(), который ждет перезапуска умершего процесса
+        self._respawned = threading.Condition(self._lock)
+        self._stopping = False
+        # Задание, положенное в очередь, но еще не взятое воркером, и (checksum, document, начало) задания в работе
+        self._pending = None
+        self._current = None
+        self.restarts = 0
+        self.submitted = 0
+        self.coalesced = 0
+        self.started = 0
+        self.finished = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    # Новая очередь заданий и процесс. Очередь тоже новая: умерший процесс мог умереть, ожидая задание,
+    # и держать ее блокировку чтения
+    def _spawn(self):
+        self._jobs = self._context.Queue(maxsize=1)
+        self._process = self._context.Process(target=_worker_main, args=(self._jobs, self._results, self._target),
+                                              name='excel_worker', daemon=True)
+
+    def start(self):
+        self._process.start()
+        self._collector.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+        self._jobs.put(None)
+        self._process.join()
+
+    # Поставить файл в очередь. Если там уже лежит необработанный файл, он заменяется новым.
+    # Возвращает вытесненное задание (или None), чтобы вызывающий мог забыть о нем.
+    # Может ждать до 0.1 с (и до перезапуска умершего процесса), из асинхронного кода вызывается через run_in_executor
+    def submit(self, job):
+        dropped = None
+        with self._respawned:
+            self.submitted += 1
+            while True:
+                # Очередь умершего процесса может быть заблокирована, задание кладется уже в очередь нового
+                while not self._stopping and self._process.exitcode is not None:
+                    self._respawned.wait(timeout=1)
+                try:
+                    self._jobs.put_nowait(job)
+                    self._pending = job
+                    break
+                except queue.Full:
+                    try:
+                        # Таймаут, а не get_nowait: положенное задание доходит до канала не мгновенно
+                        dropped = self._jobs.get(timeout=0.1)
+                        self.coalesced += 1
+                        # Цикл только с правилами не вытесняет файл: в очередь возвращается файл
+                        if job['data'] is None and dropped['data'] is not None:
+                            job, dropped = dropped, job
+                    except queue.Empty:
+                        # Воркер успел забрать задание, очередь освободилась, или воркер умер
+                        pass
+        return dropped
+
+    def _collect(self):
+        while True:
+            try:
+                result = self._results.get(timeout=1)
+            except queue.Empty:
+                with self._lock:
+                    finished = self._respawn_if_dead()
+                for result in finished:
+                    self._report(result)
+                continue
+            with self._lock:
+                result = self._handle(result)
+            self._report(result)
+
+    # Учесть событие процесса-воркера. Возвращает результат задания, если оно закончилось. Вызывается под self._lock
+    def _handle(self, result):
+        if result['event'] == 'started':
+            self.started += 1
+            self._current = (result['checksum'], result['document'], time.monotonic())
+            if self._pending is not None and self._pending['checksum'] == result['checksum']:
+                self._pending = None
+            return None
+        self._current = None
+        self._count_finished(result)
+        return result
+
+    def _count_finished(self, result):
+        self.finished += 1
+        self.last_duration = result['duration']
+        self.max_duration = max(self.max_duration, result['duration'])
+        self.total_duration += result['duration']
+        if result['error'] is not None:
+            self.failures += 1
+
+    # Если процесс-воркер умер, задание в работе завершается с ошибкой, процесс запускается заново,
+    # и ему передается ожидавшее задание. Вызывается под self._lock из потока результатов.
+    # Возвращает результаты заданий, законченных умершим процессом, и результат упавшего задания
+    def _respawn_if_dead(self):
+        if self._stopping or self._process.exitcode is None:
+            return []
+        exitcode = self._process.exitcode
+        # События, которые процесс успел отправить перед смертью, учитываются первыми: задание, о котором
+        # успело прийти 'finished', не считается упавшим
+        finished = []
+        while True:
+            try:
+                result = self._handle(self._results.get_nowait())
+            except queue.Empty:
+                break
+            if result is not None:
+                finished.append(result)
+        lost = None
+        if self._current is not None:
+            checksum, document, started = self._current
+            lost = {'event': 'finished', 'checksum': checksum, 'document': document,
+                    'duration': time.monotonic() - started,
+                    'error': f"процесс воркера завершился с кодом {exitcode}"}
+            self._count_finished(lost)
+            self._current = None
+        logging.error(f"Процесс воркера завершился с кодом {exitcode}, запускается заново. Упавший файл: {
+                      lost['checksum'][:12] if lost else 'нет'}, ожидающий: {
+                      self._pending['checksum'][:12] if self._pending else 'нет'}")
+        # Задание в старой очереди уже никто не заберет, поток отправки не должен ждать его при выходе
+        self._jobs.cancel_join_thread()
+        self._jobs.close()
+        self.restarts += 1
+        self._spawn()
+        self._process.start()
+        if self._pending is not None:
+            self._jobs.put(self._pending)
+        self._respawned.notify_all()
+        if lost is not None:
+            finished.append(lost)
+        return finished
+
+    def _report(self, result):
+        if result is None or self.on_result is None:
+            return
+        try:
+            self.on_result(result)
+        except Exception:
+            logging.exception("Ошибка обработки результата воркера")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self.submitted - self.coalesced - self.started,
+                'running': self.started - self.finished,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'runs': self.finished,
+                'failures': self.failures,
+                'last_duration': round(self.last_duration, 3),
+                'max_duration': round(self.max_duration, 3),
+                'avg_duration': round(self.total_duration / self.finished, 3) if self.finished else 0.0,
+                'alive': self._process.is_alive(),
+                'restarts': self.restarts,
+            }
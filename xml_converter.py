@@ -1,21 +1,29 @@
 import re
-import backoff
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
-import pandas as pd
-import requests
 from bs4 import BeautifulSoup
 from datetime import datetime
 import logging
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import os
 import html
 import json
-from openai import OpenAI, RateLimitError
+import hashlib
+from openai import AsyncOpenAI, APIConnectionError, DEFAULT_MAX_RETRIES
 from PIL import Image
 from io import BytesIO
 import httpx
+from xml_writer import XMLStreamWriter, serialize_element
+from publisher import publish, atomic_write, feed_file
+from build_journal import BuildJournal, build_journal_file
+from pricing import calculate_price, format_price
+from workbook import workbooks
+from cache import PersistentCache
+from throttle import Stage, CircuitOpen, Throttled, pipeline_metrics_file
+from gpt_bulk import BulkJob, gpt_bulk_min_rows, gpt_bulk_base_url, load_prompt
+from enrichment import create_backends
 
 # Этот скрипт предназначен для генерации XML-файла из данных, содержащихся в Excel-файле.
 # Он выполняет следующие задачи:
@@ -35,10 +43,128 @@ image_count = int(os.getenv('IMAGE_COUNT', '15'))
 # API ключ ChatGPT
 api_key = os.getenv('OPENAI_API_KEY')
 
-# Создание клиента OpenAI
-# client = OpenAI(api_key=api_key)
-client = OpenAI(api_key=api_key, http_client=httpx.Client(
-    proxies=proxy_url)) if proxy_url else OpenAI(api_key=api_key)
+# Лимиты стадий асинхронного конвейера обогащения товаров (см. throttle.py).
+# Параллельность задается лимитами внешних API, а не количеством ядер сервера.
+gpt_concurrency = int(os.getenv('GPT_CONCURRENCY', '8'))
+gpt_rate = float(os.getenv('GPT_RATE', '5'))
+search_concurrency = int(os.getenv('SEARCH_CONCURRENCY', '4'))
+search_rate = float(os.getenv('SEARCH_RATE', '2'))
+validation_concurrency = int(os.getenv('VALIDATION_CONCURRENCY', '16'))
+# Повторы временных ошибок OpenAI и Bing (429, 5xx, сеть) и ответ дольше LATENCY_TARGET секунд, после которого
+# лимит одновременных запросов снижается. После CIRCUIT_FAILURES неудачных запросов подряд запросы к этому API
+# не отправляются CIRCUIT_RESET_SECONDS секунд, товары получают значения по умолчанию (см. throttle.py)
+gpt_retries = int(os.getenv('GPT_RETRIES', '4'))
+gpt_latency_target = float(os.getenv('GPT_LATENCY_TARGET', '10'))
+search_retries = int(os.getenv('SEARCH_RETRIES', '4'))
+search_latency_target = float(os.getenv('SEARCH_LATENCY_TARGET', '5'))
+circuit_failures = int(os.getenv('CIRCUIT_FAILURES', '5'))
+circuit_reset_seconds = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+# Как часто во время сборки обновлять файл с метриками стадий (0 - только в начале и в конце)
+pipeline_metrics_interval = float(os.getenv('PIPELINE_METRICS_INTERVAL', '5'))
+# Сколько картинок одного запроса проверяется одновременно и сколько первых байт картинки скачивается ради ее размеров
+validation_per_query = int(os.getenv('VALIDATION_PER_QUERY', '8'))
+image_header_bytes = int(os.getenv('IMAGE_HEADER_BYTES', '131072'))
+# Промежуточная публикация products.xml при сборке с нуля: каждые N готовых товаров или раз в T секунд (0 - выключено)
+partial_publish_offers = int(os.getenv('PARTIAL_PUBLISH_OFFERS', '50'))
+partial_publish_seconds = float(os.getenv('PARTIAL_PUBLISH_SECONDS', '60'))
+# Пакетный режим GPT: до GPT_BATCH_SIZE товаров в одном запуске ассистента (1 - каждый товар отдельным запуском).
+# Пакет уходит, когда набралось GPT_BATCH_SIZE товаров или прошло GPT_BATCH_WAIT секунд с первого товара в нем
+gpt_batch_size = int(os.getenv('GPT_BATCH_SIZE', '10'))
+gpt_batch_wait = float(os.getenv('GPT_BATCH_WAIT', '0.5'))
+
+# Создание асинхронного клиента OpenAI, на каждый запуск конвейера свой (клиент привязан к event loop).
+# base_url - другой OpenAI-совместимый адрес (None - адрес по умолчанию), max_retries - повторы внутри клиента
+# (конвейер выключает их, повторами там управляет стадия gpt)
+
+
+def create_openai_client(base_url=None, max_retries=DEFAULT_MAX_RETRIES):
+    if proxy_url:
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries,
+                           http_client=httpx.AsyncClient(proxy=proxy_url))
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+
+# Запуск корутины из синхронного кода. excel_main() вызывается в том числе из обработчика Telethon,
+# то есть внутри уже работающего event loop, тогда конвейер запускается в отдельном потоке со своим loop.
+
+
+def run_sync(coro):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+# Кэш ответов GPT на диске (SQLite в папке приложения). Ключ - хэш нормализованного описания товара,
+# так что повторно добавленный из архива товар или тот же товар под новым xmlid не ходит в OpenAI второй раз.
+gpt_cache_file = os.getenv('GPT_CACHE_FILE', 'gpt_cache.sqlite3')
+gpt_cache_ttl = int(os.getenv('GPT_CACHE_TTL_DAYS', '30')) * 24 * 60 * 60
+gpt_cache_max_entries = int(os.getenv('GPT_CACHE_MAX_ENTRIES', '20000'))
+gpt_cache = PersistentCache(gpt_cache_file, table='gpt_results',
+                            ttl=gpt_cache_ttl, max_entries=gpt_cache_max_entries)
+
+# Кэш проверенных картинок и выдачи Bing (SQLite в папке приложения). Одни и те же картинки приходят для вариантов
+# одного товара (цвет, память), поэтому вердикт по URL (подходит или нет, размеры, тип) хранится между запусками.
+# Невалидные картинки хранятся меньше: сайт мог заменить картинку или временно отдавать ошибку
+image_cache_file = os.getenv('IMAGE_CACHE_FILE', 'image_cache.sqlite3')
+image_cache_ttl = int(os.getenv('IMAGE_CACHE_TTL_DAYS', '14')) * 24 * 60 * 60
+image_cache_negative_ttl = int(
+    os.getenv('IMAGE_CACHE_NEGATIVE_TTL_HOURS', '24')) * 60 * 60
+image_cache_max_entries = int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', '200000'))
+image_cache = PersistentCache(image_cache_file, table='image_verdicts',
+                              ttl=image_cache_ttl, max_entries=image_cache_max_entries)
+search_cache_ttl = int(os.getenv('SEARCH_CACHE_TTL_HOURS', '72')) * 60 * 60
+search_cache_max_entries = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '20000'))
+search_cache = PersistentCache(image_cache_file, table='search_results',
+                               ttl=search_cache_ttl, max_entries=search_cache_max_entries)
+# Поля ответа GPT в том порядке, в котором их возвращает get_product_details_from_gpt
+gpt_fields = ('dimensions', 'weight', 'vendor',
+              'categoryId', 'name', 'description')
+
+
+# Дополнение к промпту для пакетного запроса: формат одного товара описан в самом промпте.
+# Бэкенд chat задает схему ответа {"items": [...]}, parse_gpt_batch понимает оба варианта
+gpt_batch_instructions = (
+    "В сообщении после 'json-batch:' JSON-массив товаров вида {\"xmlid\": ..., \"description\": ...}. "
+    "Обработай каждый товар по тем же правилам, что и одиночный товар, и верни только JSON-массив "
+    "(без пояснений и без markdown, или в поле items, если так требует схема ответа) с объектом для каждого "
+    "товара: все поля из формата ответа (dimensions, weight, vendor, categoryId, name, description) плюс поле "
+    "xmlid без изменений."
+)
+
+
+# Разбор ответа на пакетный запрос. Возвращает {xmlid: ответ в порядке gpt_fields} для элементов, в которых
+# есть все поля, и число отброшенных элементов. Товары без годного элемента запрашиваются по одному
+def parse_gpt_batch(content, expected_ids):
+    text = content.strip()
+    # Ассистент иногда заворачивает JSON в блок ```json ... ```
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = next((value for value in data.values()
+                    if isinstance(value, list)), [])
+    results = {}
+    rejected = 0
+    for item in data if isinstance(data, list) else []:
+        xmlid = str(item.get('xmlid')) if isinstance(item, dict) else None
+        if xmlid not in expected_ids or xmlid in results:
+            rejected += 1
+            logging.warning(f"Элемент пакетного ответа GPT без известного xmlid отброшен: {item}")
+            continue
+        missing = [field for field in gpt_fields if item.get(field) in (None, '')]
+        if missing:
+            rejected += 1
+            logging.warning(f"В пакетном ответе GPT для товара {xmlid} нет полей {missing}")
+            continue
+        results[xmlid] = tuple(str(item[field]) for field in gpt_fields)
+    return results, rejected
+
+
+def description_cache_key(description):
+    normalized = ' '.join(html.unescape(str(description)).lower().split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
 
 # Настройка логирования
@@ -57,130 +183,469 @@ logger.addHandler(console_handler)
 # Согласно стандартам Яндекс Маркета
 
 class ImageSearcher:
+    # Проверка соответствия URL стандарту RFC-1738
+    rfc_1738_regex = re.compile(
+        r'^(?:http|https)://'
+        r'(?:\S+(?::\S*)?@)?'
+        r'(?:[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*|'
+        r'\[[0-9a-fA-F:.]+\])'
+        r'(?::\d{2,5})?'
+        r'(?:/[^\s]*)?$'
+    )
+
     def __init__(self):
         self.base_url = "https://www.bing.com/images/search?q="
+        # HTTP клиент с пулом соединений и стадии конвейера, выставляются на время запуска (XMLGenerator.pipeline)
+        self.http = None
+        self.search_stage = None
+        self.validation_stage = None
+        self.bytes_downloaded = 0
+
+    def open(self, http):
+        self.http = http
+        self.search_stage = Stage(
+            'bing_search', search_concurrency, search_rate, retries=search_retries,
+            latency_target=search_latency_target, failure_threshold=circuit_failures,
+            reset_timeout=circuit_reset_seconds, transient=(httpx.TransportError,))
+        self.validation_stage = Stage(
+            'image_validation', validation_concurrency)
+        self.bytes_downloaded = 0
+
+    def stats(self):
+        validation_stats = self.validation_stage.stats()
+        validation_stats['bytes_downloaded'] = self.bytes_downloaded
+        return [self.search_stage.stats(), validation_stats]
+
+    def close(self):
+        stats = self.stats()
+        self.http = None
+        self.search_stage = None
+        self.validation_stage = None
+        return stats
+
+    # Размеры картинки по началу файла: Image.open читает только заголовок, сами пиксели не декодируются
+    @staticmethod
+    def read_image_size(data):
+        try:
+            with Image.open(BytesIO(data)) as img:
+                return img.size
+        except Exception:
+            return None
+
+    # Проверка картинки по сети. Возвращает вердикт для кэша: подходит ли картинка, ее размеры и тип.
+    # Сетевые ошибки пробрасываются наружу, чтобы случайный таймаут не попал в кэш как невалидная картинка
+    async def check_image(self, url, stats):
+        verdict = {'valid': False, 'width': None,
+                   'height': None, 'content_type': None}
+        async with self.validation_stage.slot():
+            await self.validation_stage.limit()
+            stats['validated'] = stats.get('validated', 0) + 1
+            # Один GET с Range вместо HEAD + полного скачивания: заголовки ответа дают тип и размер файла,
+            # а для ширины и высоты достаточно первых байт картинки
+            headers = {'Range': f"bytes=0-{image_header_bytes - 1}"}
+            async with self.http.stream('GET', url, headers=headers, follow_redirects=True) as response:
+                if response.status_code == 404 or response.status_code == 410:
+                    return verdict
+                response.raise_for_status()
+                # Проверка заголовков
+                content_type = response.headers.get('Content-Type')
+                verdict['content_type'] = content_type
+                if content_type not in ['image/jpeg', 'image/png', 'image/webp']:
+                    return verdict
+
+                # При ответе 206 полный размер файла указан в Content-Range: bytes 0-N/<размер>
+                content_range = response.headers.get('Content-Range', '')
+                if response.status_code == 206 and '/' in content_range and not content_range.endswith('*'):
+                    content_length = int(content_range.rsplit('/', 1)[1])
+                else:
+                    content_length = int(
+                        response.headers.get('Content-Length', 0))
+                if content_length > 10 * 1024 * 1024:  # Проверка размера
+                    return verdict
+
+                # Проверка размеров изображения
+                data = b''
+                size = None
+                async for chunk in response.aiter_bytes():
+                    data += chunk
+                    self.bytes_downloaded += len(chunk)
+                    stats['bytes'] = stats.get('bytes', 0) + len(chunk)
+                    size = self.read_image_size(data)
+                    if size is not None or len(data) >= image_header_bytes:
+                        break
+
+        if size is None:
+            return verdict
+        verdict['width'], verdict['height'] = size
+        verdict['valid'] = size[0] >= 300 and size[1] >= 300
+        return verdict
 
-    def is_valid_image(self, url):
+    # stats - счетчики товара (сколько картинок проверено и сколько байт скачано), см. process_product_async
+    async def is_valid_image(self, url, stats=None):
+        stats = stats if stats is not None else {}
         try:
             # Проверка длины URL
             if len(url) > 512:
                 logging.warning(f"URL слишком длинный: {url}")
                 return False
 
-            # Проверка соответствия URL стандарту RFC-1738
-            rfc_1738_regex = re.compile(
-                r'^(?:http|https)://'
-                r'(?:\S+(?::\S*)?@)?'
-                r'(?:[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*|'
-                r'\[[0-9a-fA-F:.]+\])'
-                r'(?::\d{2,5})?'
-                r'(?:/[^\s]*)?$'
-            )
-
-            if not rfc_1738_regex.match(url):
+            if not self.rfc_1738_regex.match(url):
                 logging.warning(
                     f"URL не соответствует стандарту RFC-1738: {url}")
                 return False
 
-            # Проверка заголовков
-            response = requests.head(url, timeout=10)
-            content_type = response.headers.get('Content-Type')
-            if content_type not in ['image/jpeg', 'image/png', 'image/webp']:
-                return False
-
-            content_length = int(response.headers.get('Content-Length', 0))
-            if content_length > 10 * 1024 * 1024:  # Проверка размера
-                return False
-
-            # Проверка размеров изображения
-            response = requests.get(url, timeout=10)
-            img = Image.open(BytesIO(response.content))
-            if img.width < 300 or img.height < 300:
-                return False
-
-            return True
+            # Кэш вердиктов - SQLite, запросы к нему идут в отдельном потоке, чтобы не останавливать event loop
+            verdict = await asyncio.to_thread(image_cache.get, url)
+            if verdict is None:
+                verdict = await self.check_image(url, stats)
+                await asyncio.to_thread(image_cache.set, url, verdict, ttl=image_cache_ttl if verdict['valid']
+                                        else image_cache_negative_ttl)
+            return verdict['valid']
         except Exception as e:
             logging.error(f"Ошибка при проверке изображения: {e}")
             return False
 
-    def get_image_urls(self, query, image_count=image_count, retries=10):
+    # Параллельная проверка кандидатов (не больше validation_per_query и не больше, чем нужно картинок, одновременно).
+    # Порядок выдачи Bing сохраняется, проверка останавливается, как только найдено image_count валидных картинок
+    async def validate_images(self, urls, image_count, stats=None):
+        window = asyncio.Semaphore(max(1, min(validation_per_query, image_count)))
+        results = {}
+
+        async def check(index, url):
+            async with window:
+                return index, await self.is_valid_image(url, stats)
+
+        tasks = [asyncio.ensure_future(check(index, url))
+                 for index, url in enumerate(urls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, is_valid = await next_done
+                results[index] = is_valid
+                if is_valid:
+                    logging.info(
+                        f"Изображение найдено и валидно: {urls[index]}")
+                else:
+                    logging.warning(f"Изображение не валидно: {urls[index]}")
+                # Ответ готов, когда среди проверенных подряд с начала списка набралось image_count валидных
+                valid = []
+                for position in range(len(urls)):
+                    if position not in results:
+                        break
+                    if results[position]:
+                        valid.append(urls[position])
+                    if len(valid) >= image_count:
+                        return valid
+            return [url for index, url in enumerate(urls) if results.get(index)]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Ссылки на картинки со страницы выдачи Bing, в порядке выдачи.
+    # Первая попытка берет выдачу из кэша, повторные всегда идут в Bing за свежей страницей
+    async def search_image_urls(self, query, use_cache=True, stats=None):
         url = f"{self.base_url}{query.replace(' ', '+')}"
+        cache_key = f"{self.base_url}{' '.join(query.lower().split())}"
+        if use_cache:
+            cached = await asyncio.to_thread(search_cache.get, cache_key)
+            if cached is not None:
+                return cached
+
+        if stats is not None:
+            stats['queries'] = stats.get('queries', 0) + 1
+
+        async def fetch():
+            response = await self.http.get(url, follow_redirects=True)
+            response.raise_for_status()
+            return response
+
+        response = await self.search_stage.call(fetch)
+        soup = BeautifulSoup(response.text, 'html.parser')
+        img_tags = soup.find_all('a', {'class': 'iusc'})
+        img_urls = []
+        for img_tag in img_tags:
+            m = img_tag.get('m') or ''
+            if '"murl":"' not in m:
+                continue
+            img_urls.append(m.split('"murl":"')[1].split('"')[0])
+        if img_urls:
+            await asyncio.to_thread(search_cache.set, cache_key, img_urls)
+        return img_urls
+
+    # Подбор картинок сразу по нескольким запросам (например название от GPT и исходное описание).
+    # Запросы к Bing идут параллельно, кандидаты объединяются в порядке запросов без повторов,
+    # каждый URL проверяется один раз, поиск останавливается на image_count картинках.
+    # Ошибки Bing повторяет стадия bing_search, здесь повтор - только свежая выдача, пока в ней есть новые картинки
+    async def find_images(self, queries, image_count=image_count, retries=10, stats=None):
+        unique_queries = []
+        for query in queries:
+            if query and query not in unique_queries:
+                unique_queries.append(query)
         all_images = []
+        checked = set()
         for attempt in range(retries):
-            try:
-                logging.info(f"Поиск изображений для: {
-                             query}, попытка {attempt + 1}")
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()
-                soup = BeautifulSoup(response.text, 'html.parser')
-                img_tags = soup.find_all('a', {'class': 'iusc'})
-                if img_tags:
-                    for img_tag in img_tags:
-                        m = img_tag.get('m')
-                        img_url = m.split('"murl":"')[1].split('"')[0]
-                        if self.is_valid_image(img_url):
-                            logging.info(
-                                f"Изображение найдено и валидно: {img_url}")
-                            all_images.append(img_url)
-                            if len(all_images) >= image_count:
-                                return all_images
-                        else:
-                            logging.warning(
-                                f"Изображение не валидно: {img_url}")
-                logging.warning(f"Изображения не найдены для: {
-                                query}, попытка {attempt + 1}")
-            except (requests.RequestException, IndexError) as e:
-                logging.error(f"Ошибка при поиске изображений для: {
-                              query}, попытка {attempt + 1}: {e}")
-                time.sleep(1)
+            logging.info(f"Поиск изображений для: {
+                         unique_queries}, попытка {attempt + 1}")
+            results = await asyncio.gather(
+                *(self.search_image_urls(query, use_cache=attempt == 0, stats=stats) for query in unique_queries),
+                return_exceptions=True)
+            # Картинки, уже проверенные на прошлой попытке или найденные по другому запросу, повторно не проверяем
+            candidates = []
+            failed = False
+            for query, img_urls in zip(unique_queries, results):
+                if isinstance(img_urls, CircuitOpen):
+                    logging.warning(f"Bing недоступен, товар остается с найденными картинками: {
+                                    len(all_images)}")
+                    return all_images
+                if isinstance(img_urls, (httpx.HTTPError, IndexError)):
+                    logging.error(f"Ошибка при поиске изображений для: {
+                                  query}, попытка {attempt + 1}: {img_urls}")
+                    failed = True
+                    continue
+                if isinstance(img_urls, BaseException):
+                    raise img_urls
+                for img_url in img_urls:
+                    if img_url not in checked:
+                        checked.add(img_url)
+                        candidates.append(img_url)
+            if candidates:
+                all_images += await self.validate_images(
+                    candidates, image_count - len(all_images), stats)
+                if len(all_images) >= image_count:
+                    return all_images
+            logging.warning(f"Изображения не найдены для: {
+                            unique_queries}, попытка {attempt + 1}")
+            # Свежая выдача не дала новых картинок, следующая попытка даст то же самое
+            if attempt > 0 and not candidates and not failed:
+                break
         logging.warning(f"Изображения не найдены для: {
-                        query} после {retries} попыток")
+                        unique_queries} после {retries} попыток")
         return all_images
 
+    async def get_image_urls(self, query, image_count=image_count, retries=10, stats=None):
+        return await self.find_images([query], image_count, retries, stats)
+
+# Промежуточные публикации products.xml во время сборки с нуля: каждые partial_publish_offers готовых товаров
+# или раз в partial_publish_seconds секунд публикуется валидный фид с уже готовыми offer'ами.
+# Каждый offer сериализуется один раз и дописывается во временный файл с фрагментами, публикация - это
+# шапка каталога + копия фрагментов + закрывающие теги, дерево каталога заново не строится и не сериализуется.
+# Промежуточные версии не попадают в снапшоты (publisher.snapshot), снапшот делается только для итогового файла,
+# но сжатые копии для nginx обновляются при каждой публикации, иначе gzip_static отдавал бы старый каталог.
+
+
+class PartialCatalog:
+    def __init__(self, generator, output_file, every=None, interval=None):
+        self.generator = generator
+        self.output_file = output_file
+        self.every = partial_publish_offers if every is None else every
+        self.interval = partial_publish_seconds if interval is None else interval
+        self.fragments_path = f"{build_journal_file}.offers.part"
+        self._fragments = open(self.fragments_path, 'w+', encoding='utf-8')
+        self.offers = 0
+        self.published_offers = 0
+        self.publishes = 0
+        self.started = time.monotonic()
+        self.last_publish = self.started
+        self.first_offer_time = None
+
+    def add(self, product_data):
+        self._fragments.write(serialize_element(
+            self.generator.build_offer(product_data), level=3))
+        self.offers += 1
+
+    # Публикация, если набралось every новых товаров или прошло interval секунд. Первый товар публикуется сразу,
+    # чтобы каталог с товаром, который можно купить, появился как можно раньше
+    def maybe_publish(self):
+        new_offers = self.offers - self.published_offers
+        if new_offers == 0:
+            return False
+        if self.published_offers == 0 or (self.every and new_offers >= self.every) or \
+                (self.interval and time.monotonic() - self.last_publish >= self.interval):
+            self.publish()
+            return True
+        return False
+
+    def publish(self):
+        started = time.monotonic()
+        self._fragments.flush()
+        with publish(self.output_file, take_snapshot=False) as f:
+            # Те же пустые строки и перевод строки в конце, что и у итогового products.xml (write_catalog)
+            writer = XMLStreamWriter(f)
+            self.generator.start_catalog(writer)
+            self._fragments.seek(0)
+            while True:
+                lines = self._fragments.readlines(1024 * 1024)
+                if not lines:
+                    break
+                writer.lines(''.join(lines))
+            self._fragments.seek(0, os.SEEK_END)
+            writer.close()
+        self.published_offers = self.offers
+        self.publishes += 1
+        self.last_publish = time.monotonic()
+        if self.first_offer_time is None:
+            self.first_offer_time = self.last_publish - self.started
+            logging.info(f"Первый товар опубликован в {self.output_file} через {
+                         self.first_offer_time:.2f} с после начала сборки")
+        logging.info(f"Промежуточная публикация {self.output_file}: {self.offers} товаров, запись за {
+                     self.last_publish - started:.3f} с")
+
+    def close(self):
+        self._fragments.close()
+        if os.path.exists(self.fragments_path):
+            os.remove(self.fragments_path)
+
+    def stats(self):
+        return {
+            'offers': self.offers,
+            'publishes': self.publishes,
+            'first_offer_time': round(self.first_offer_time, 3) if self.first_offer_time is not None else None,
+        }
+
+
 # Основной класс который создает с нуля Products.xml если его нет, или если нет products.xlsx
 
 
+# Микро-батчер запросов к GPT на время одного запуска конвейера: товары копятся в пакет до batch_size штук
+# (или wait секунд), пакет уходит одним запуском ассистента, ответ раздается товарам по xmlid.
+# Товары, для которых в ответе нет годного элемента, запрашиваются по одному, как раньше.
+
+
+class GPTBatcher:
+    def __init__(self, generator, batch_size=gpt_batch_size, wait=gpt_batch_wait):
+        self.generator = generator
+        self.batch_size = batch_size
+        self.wait = wait
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.batches = 0
+        self.batched_items = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    # Ответ GPT для одного товара в порядке gpt_fields
+    async def details(self, xmlid, description):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((str(xmlid), description, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending, []
+        if items:
+            task = asyncio.ensure_future(self._run(items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items):
+        results = {}
+        if len(items) > 1:
+            self.batches += 1
+            self.batched_items += len(items)
+            results, rejected = await self.generator.get_products_details_batch(
+                [(xmlid, description) for xmlid, description, _ in items])
+            self.rejected += rejected
+        missing = [item for item in items if item[0] not in results]
+        self.fallbacks += len(missing) if len(items) > 1 else 0
+        fallback = await asyncio.gather(*(self.generator.get_product_details_from_gpt(f'json: {description}')
+                                          for _, description, _ in missing), return_exceptions=True)
+        for xmlid, _, future in items:
+            if xmlid in results and not future.done():
+                future.set_result(results[xmlid])
+        for (_, _, future), result in zip(missing, fallback):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'batch_size': self.batch_size,
+            'batches': self.batches,
+            'batched_items': self.batched_items,
+            'rejected': self.rejected,
+            'fallbacks': self.fallbacks,
+        }
+
+
 class XMLGenerator:
     def __init__(self, products_file, image_count=image_count):
         self.products_file = products_file
         self.image_searcher = ImageSearcher()
         self.image_count = image_count
+        self.openai = None
+        self.gpt_stage = None
+        self.gpt_backends = None
+        self.gpt_batcher = None
+
+    # Клиенты и стадии конвейера на время одного запуска: OpenAI, поиск в Bing и проверка картинок
+    # ограничены каждый своим лимитом, а не общим пулом потоков
+    @asynccontextmanager
+    async def pipeline(self):
+        async with httpx.AsyncClient(timeout=10) as http:
+            self.openai = create_openai_client(max_retries=0)
+            self.gpt_stage = Stage('gpt', gpt_concurrency, gpt_rate, retries=gpt_retries,
+                                   latency_target=gpt_latency_target, failure_threshold=circuit_failures,
+                                   reset_timeout=circuit_reset_seconds, transient=(APIConnectionError,))
+            self.gpt_backends = create_backends(
+                self.openai, self.gpt_stage, gpt_fields)
+            self.gpt_batcher = GPTBatcher(
+                self) if gpt_batch_size > 1 else None
+            self.image_searcher.open(http)
+            self.write_metrics()
+            reporter = asyncio.ensure_future(
+                self._report_metrics()) if pipeline_metrics_interval > 0 else None
+            try:
+                yield
+            finally:
+                if reporter is not None:
+                    reporter.cancel()
+                self.write_metrics()
+                await self.openai.close()
+                for stats in [self.gpt_stage.stats()] + self.image_searcher.close():
+                    logging.info(f"Статистика стадии конвейера: {stats}")
+                for backend in self.gpt_backends:
+                    logging.info(f"Бэкенд GPT: {backend.stats()}")
+                if self.gpt_batcher is not None:
+                    logging.info(f"Пакетные запросы GPT: {self.gpt_batcher.stats()}")
+                logging.info(f"Кэш проверенных картинок: {image_cache.stats()}")
+                logging.info(f"Кэш выдачи Bing: {search_cache.stats()}")
+                self.openai = None
+                self.gpt_stage = None
+                self.gpt_backends = None
+                self.gpt_batcher = None
+
+    # Метрики стадий конвейера (лимиты, 429, повторы, состояние цепи) в файл pipeline_metrics_file для /status
+    def write_metrics(self):
+        metrics = {'updated': time.time(),
+                   'stages': [self.gpt_stage.stats()] + self.image_searcher.stats(),
+                   'gpt_backends': [backend.stats() for backend in self.gpt_backends]}
+        if self.gpt_batcher is not None:
+            metrics['gpt_batches'] = self.gpt_batcher.stats()
+        try:
+            with atomic_write(pipeline_metrics_file) as f:
+                json.dump(metrics, f, ensure_ascii=False)
+        except OSError as e:
+            logging.error(f"Не удалось записать метрики конвейера: {e}")
+
+    async def _report_metrics(self):
+        while True:
+            await asyncio.sleep(pipeline_metrics_interval)
+            self.write_metrics()
 
     def read_products(self):
         logging.info(f"Чтение данных из файла: {self.products_file}")
-        return pd.read_excel(self.products_file, usecols=['xmlid', 'description', 'price'], dtype={'xmlid': str})
-
-    def calculate_price(self, price):
-        if price < 10000:
-            return price * 1.45
-        elif 10000 <= price < 11000:
-            return price * 1.43
-        elif 11000 <= price < 13000:
-            return price * 1.42
-        elif 13000 <= price < 15000:
-            return price * 1.41
-        elif 15000 <= price < 18000:
-            return price * 1.395
-        elif 18000 <= price < 20000:
-            return price * 1.387
-        elif 20000 <= price < 30000:
-            return price * 1.36
-        elif 30000 <= price < 40000:
-            return price * 1.35
-        elif 40000 <= price < 50000:
-            return price * 1.34
-        elif 50000 <= price < 60000:
-            return price * 1.33
-        elif 60000 <= price < 70000:
-            return price * 1.325
-        elif 70000 <= price < 80000:
-            return price * 1.318
-        elif 80000 <= price < 90000:
-            return price * 1.315
-        elif 90000 <= price < 100000:
-            return price * 1.308
-        elif price >= 100000:
-            return price * 1.305
+        return workbooks.load(self.products_file)
 
     # Функция используется в том случае, если запрос к GPT не прошел и вендора не удалось извлечь из GPT.
     def extract_vendor(self, description):
@@ -190,81 +655,151 @@ class XMLGenerator:
                 return word
         return "NULL"
 
-    @staticmethod
-    def get_product_details_from_gpt(product_description, max_retries=10):
-        assistant_id = os.getenv('ASSISTANT_ID')
-        attempt = 0
+    # Ответ модели от основного бэкенда (см. enrichment.py), при ошибке запроса или пустом ответе - от запасного.
+    # CircuitOpen и временные ошибки, которым не помогли повторы, бэкенд не переключают: OpenAI у них общий.
+    # products - сколько товаров в сообщении, для статистики времени ответа на товар
+    async def gpt_reply(self, content, instructions=None, batch=False, products=1):
+        for index, backend in enumerate(self.gpt_backends):
+            last = index == len(self.gpt_backends) - 1
+            started = time.monotonic()
+            try:
+                reply = await backend.reply(content, instructions, batch)
+            except Exception as e:
+                backend.record(time.monotonic() - started, products, ok=False)
+                if last or isinstance(e, CircuitOpen) or self.gpt_stage.is_transient(e):
+                    raise
+                logging.warning(f"Бэкенд GPT {backend.name} вернул ошибку ({e}), запрос уходит в {
+                                self.gpt_backends[index + 1].name}")
+                continue
+            backend.record(time.monotonic() - started,
+                           products, ok=reply is not None)
+            if reply is not None or last:
+                return reply
+            logging.warning(f"Бэкенд GPT {backend.name} не дал ответа, запрос уходит в {
+                            self.gpt_backends[index + 1].name}")
+        return None
 
-        while attempt < max_retries:
-            attempt += 1
+    # Ответ GPT для одного товара. Временные ошибки API (429, 5xx, сеть) повторяет стадия gpt, здесь повторяется
+    # только неудачный запуск ассистента. Если GPT недоступен, все поля None и товар получает значения по умолчанию
+    async def get_product_details_from_gpt(self, product_description, max_retries=3):
+        for attempt in range(1, max_retries + 1):
             try:
-                # Создание потока сообщений
-                # Это нужно чтобы в многопоточном режиме запускать обработку позиций из EXCEL таблички, иначе
-                # в случае если мы создаем с нуля Products.xml слишком долго отрабатывает скрипт. Сейчас при 1000 позиций в Excel
-                # скрипт на сервере с 2 ядрами отрабатывает за 700 секунд, создавая с нуля файл products.xml
-                thread = client.beta.threads.create(
-                    messages=[
-                        {"role": "user", "content": product_description}
-                    ]
-                )
-                logging.info(f"Thread created: {thread.id}")
-
-                # Создание и выполнение запуска
-                run = client.beta.threads.runs.create(
-                    thread_id=thread.id,
-                    assistant_id=assistant_id,
-                )
-                logging.info(f"Run created: {run.id}")
-
-                status = run.status
-
-                while status not in ['completed', 'failed', 'cancelled']:
-                    time.sleep(1)
-                    run = client.beta.threads.runs.retrieve(
-                        thread_id=thread.id, run_id=run.id)
-                    status = run.status
-                    logging.info(f"Run status: {status}")
-
-                messages = client.beta.threads.messages.list(
-                    thread_id=thread.id
-                )
-                logging.info(f"Messages retrieved: {len(messages.data)}")
-
-                for message in messages.data:
-                    logging.info(f"Message role: {message.role}")
-                    if message.role == 'assistant':
-                        content = ''.join(
-                            [content_block.text.value for content_block in message.content if content_block.type == 'text'])
-                        logging.info(f"Assistant response content: {content}")
-                        response_data = json.loads(content)
-                        dimensions = response_data.get("dimensions", "")
-                        weight = response_data.get("weight", "")
-                        vendor = response_data.get("vendor", "")
-                        categoryId = response_data.get("categoryId", "")
-                        name = response_data.get("name", "")
-                        description = response_data.get("description", "")
-
-                        logging.info(f"Ответ GPT получен: {
-                                     dimensions, weight, vendor, categoryId, name, description}\n")
-                        return dimensions, weight, vendor, categoryId, name, description
-
-                logging.error(f"Ответ для GPT НЕ получен!! {
-                              messages.data}\n\nОшибка GPT:{messages}")
+                content = await self.gpt_reply(product_description)
+                if content is not None:
+                    response_data = json.loads(content)
+                    dimensions = response_data.get("dimensions", "")
+                    weight = response_data.get("weight", "")
+                    vendor = response_data.get("vendor", "")
+                    categoryId = response_data.get("categoryId", "")
+                    name = response_data.get("name", "")
+                    description = response_data.get("description", "")
 
+                    logging.info(f"Ответ GPT получен: {
+                                 dimensions, weight, vendor, categoryId, name, description}\n")
+                    return dimensions, weight, vendor, categoryId, name, description
+
+            except CircuitOpen as e:
+                logging.warning(f"{e}, ответ GPT не запрашивается")
+                break
+            except Throttled as e:
+                logging.error(f"Ошибка при попытке {attempt}: {str(e)}")
+                await asyncio.sleep(max(self.gpt_stage.backoff(attempt), self.gpt_stage.throttle(e) or 0))
             except Exception as e:
                 logging.error(f"Ошибка при попытке {attempt}: {str(e)}")
-
-        logging.error(f"Все {max_retries} попытки завершились неудачей")
+                # Повторы временной ошибки стадия gpt уже исчерпала
+                if self.gpt_stage.is_transient(e):
+                    break
+        else:
+            logging.error(f"Все {max_retries} попытки завершились неудачей")
         return None, None, None, None, None, None
 
-    @backoff.on_exception(backoff.expo, RateLimitError)
-    def process_product(self, row):
+    # Пакетный запрос: items - список (xmlid, описание), все товары уходят одним запросом к модели.
+    # Возвращает ({xmlid: ответ в порядке gpt_fields}, число отброшенных элементов ответа)
+    async def get_products_details_batch(self, items, max_retries=3):
+        content = 'json-batch: ' + json.dumps([{'xmlid': xmlid, 'description': description}
+                                               for xmlid, description in items], ensure_ascii=False)
+        expected_ids = {xmlid for xmlid, _ in items}
+        for attempt in range(1, max_retries + 1):
+            try:
+                reply = await self.gpt_reply(content, gpt_batch_instructions, batch=True, products=len(items))
+                if reply is not None:
+                    try:
+                        results, rejected = parse_gpt_batch(reply, expected_ids)
+                    except ValueError as e:
+                        # Ответ не JSON: повтор вряд ли поможет, товары запрашиваются по одному
+                        logging.error(f"Пакетный ответ GPT не разобран: {e}")
+                        return {}, len(items)
+                    logging.info(f"Пакетный ответ GPT: {len(results)} из {
+                                 len(items)} товаров, отброшено элементов: {rejected}")
+                    return results, rejected
+            except CircuitOpen as e:
+                logging.warning(f"{e}, пакетный запрос GPT ({len(items)} товаров) не отправляется")
+                break
+            except Throttled as e:
+                logging.error(f"Ошибка пакетного запроса GPT ({
+                              len(items)} товаров) при попытке {attempt}: {str(e)}")
+                await asyncio.sleep(max(self.gpt_stage.backoff(attempt), self.gpt_stage.throttle(e) or 0))
+            except Exception as e:
+                logging.error(f"Ошибка пакетного запроса GPT ({
+                              len(items)} товаров) при попытке {attempt}: {str(e)}")
+                if self.gpt_stage.is_transient(e):
+                    break
+        return {}, 0
+
+    # Офлайн-обогащение перед сборкой с нуля: товары, ответа для которых нет в кэше GPT, уходят одним заданием
+    # Batch API (см. gpt_bulk.py), годные ответы кладутся в кэш GPT. Остальные товары конвейер запросит как обычно
+    async def bulk_enrich(self, products):
+        contents = {}
+        for description in products['description']:
+            if "обменка" in str(description).lower():
+                continue
+            contents[description_cache_key(description)] = f'json: {description}'
+        # Проверка кэша - запросы к SQLite, они идут в отдельном потоке
+        cached = await asyncio.to_thread(lambda: {cache_key for cache_key in contents if cache_key in gpt_cache})
+        contents = {cache_key: content for cache_key, content in contents.items() if cache_key not in cached}
+        openai = create_openai_client(gpt_bulk_base_url)
+        job = BulkJob(openai)
+        try:
+            if not contents and job.load_state() is None:
+                return
+            logging.info(f"Офлайн-обогащение GPT: {len(contents)} описаний без ответа в кэше")
+            answers = await job.run(contents, load_prompt())
+        finally:
+            await openai.close()
+        merged = 0
+        for cache_key, data in answers.items():
+            missing = [field for field in gpt_fields if not isinstance(
+                data, dict) or data.get(field) in (None, '')]
+            if missing:
+                logging.warning(f"В ответе пакетного задания GPT для {cache_key[:12]} нет полей {missing}")
+                continue
+            await asyncio.to_thread(gpt_cache.set, cache_key, {field: str(data[field]) for field in gpt_fields})
+            merged += 1
+        logging.info(f"Офлайн-обогащение GPT: в кэш добавлено {merged} ответов, без ответа {
+                     len(contents) - merged} описаний (запросятся по одному)")
+
+    # Ответ GPT для строки Excel: через пакетный режим, если он включен, иначе отдельным запуском ассистента
+    async def gpt_details(self, row):
+        if self.gpt_batcher is not None:
+            return await self.gpt_batcher.details(row['xmlid'], row['description'])
+        return await self.get_product_details_from_gpt(f'json: {row["description"]}')
+
+    async def process_product_async(self, row):
         if "обменка" in row['description'].lower():
             logging.info(f"Пропуск товара с ID: {
                          row['xmlid']} из-за слова 'обменка'")
             return None
-        result_from_gpt = self.get_product_details_from_gpt(
-            f'json: {row["description"]}')
+        cache_key = description_cache_key(row['description'])
+        cached = await asyncio.to_thread(gpt_cache.get, cache_key)
+        if cached is not None:
+            logging.info(f"Ответ GPT для товара с ID {
+                         row['xmlid']} взят из кэша")
+            result_from_gpt = tuple(cached.get(field) for field in gpt_fields)
+        else:
+            result_from_gpt = await self.gpt_details(row)
+            # Кэшируем только удачные ответы, иначе товар навсегда останется с заглушками
+            if result_from_gpt[4] not in ["", None]:
+                await asyncio.to_thread(gpt_cache.set, cache_key, dict(zip(gpt_fields, result_from_gpt)))
         product_data = {}
         product_data['xmlid'] = row['xmlid']
 
@@ -284,12 +819,16 @@ class XMLGenerator:
             product_data['vendor'] = self.extract_vendor(
                 html.unescape(row['description']))
         product_data['price'] = row['price']
-        product_data['calculated_price'] = self.calculate_price(row['price'])
+        product_data['calculated_price'] = calculate_price(row['price'])
 
-        all_images = self.image_searcher.get_image_urls(
-            row['description'], self.image_count)
-        all_images = self.image_searcher.get_image_urls(result_from_gpt[4] if result_from_gpt[4] not in [
-            "", None] else row['description'], self.image_count)
+        image_stats = {'queries': 0, 'validated': 0, 'bytes': 0}
+        images_started = time.monotonic()
+        # Сначала точное название от GPT, затем исходное описание из Excel
+        all_images = await self.image_searcher.find_images(
+            [result_from_gpt[4], row['description']], self.image_count, stats=image_stats)
+        logging.info(f"Картинки для товара {row['xmlid']}: запросов {image_stats['queries']}, "
+                     f"проверено {image_stats['validated']}, скачано {image_stats['bytes']} байт "
+                     f"за {time.monotonic() - images_started:.2f} с")
 
         product_data['pictures'] = all_images
         if result_from_gpt[0] != "" and result_from_gpt[0] != None:
@@ -307,15 +846,83 @@ class XMLGenerator:
         else:
             product_data['categoryId'] = 1
 
-        time.sleep(0.06)
         return product_data
 
-    def generate_xml(self, products):
-        logging.info("Генерация XML файла")
-        yml_catalog = ET.Element(
-            "yml_catalog", date=datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z"))
-        shop = ET.SubElement(yml_catalog, "shop")
-        name = ET.SubElement(shop, "name")
+    # Обработка товара, исключение возвращается вместе со строкой, чтобы залогировать его по ID товара
+    async def _process_row(self, row):
+        try:
+            return row, await self.process_product_async(row)
+        except Exception as exc:
+            return row, exc
+
+    # Обогащение списка товаров одним запуском конвейера, результаты в том же порядке, что и rows
+    def enrich_products(self, rows):
+        async def run():
+            async with self.pipeline():
+                results = await asyncio.gather(*(self._process_row(row) for row in rows))
+            products = []
+            for row, product_data in results:
+                if isinstance(product_data, Exception):
+                    logging.error(f"Ошибка обработки товара с ID: {
+                                  row['xmlid']}: {product_data}")
+                    product_data = None
+                products.append(product_data)
+            return products
+
+        if not rows:
+            return []
+        return run_sync(run())
+
+    def process_product(self, row):
+        return self.enrich_products([row])[0]
+
+    def generate_xml(self, products, partial_publish=None):
+        return run_sync(self.generate_xml_async(products, partial_publish))
+
+    # Элемент offer для products.xml из обогащенного товара
+    def build_offer(self, product_data):
+        offer = ET.Element("offer", id=str(product_data['xmlid']))
+        name = ET.SubElement(offer, "name")
+        name.text = product_data['name']
+        vendor = ET.SubElement(offer, "vendor")
+        vendor.text = product_data['vendor']
+        count = ET.SubElement(offer, "count")
+        count.text = "1"
+        archived = ET.SubElement(offer, "archived")
+        archived.text = "false"
+        disabled = ET.SubElement(offer, "disabled")
+        disabled.text = "false"
+        price = ET.SubElement(offer, "price")
+        price.text = format_price(product_data['calculated_price'])
+        categoryId = ET.SubElement(offer, "categoryId")
+        # GPT может вернуть номер категории числом
+        categoryId.text = str(
+            product_data['categoryId']) if product_data['categoryId'] else "1"
+        currencyId = ET.SubElement(offer, "currencyId")
+        currencyId.text = "RUR"
+        description = ET.SubElement(offer, "description")
+        description.text = product_data['description']
+
+        for image_url in product_data.get('pictures', []):
+            picture = ET.SubElement(offer, "picture")
+            picture.text = image_url
+
+        warranty_days = ET.SubElement(offer, "warranty-days")
+        # Один год значение от Яндекс Маркет
+        warranty_days.text = "P1Y"
+        service_life_days = ET.SubElement(
+            offer, "service-life-days")
+        # Один год значение от Яндекс Маркет
+        service_life_days.text = "P1Y"
+        dimensions = ET.SubElement(offer, "dimensions")
+        dimensions.text = product_data['dimensions']
+        weight = ET.SubElement(offer, "weight")
+        weight.text = product_data['weight']
+        return offer
+
+    # Шапка каталога: название магазина и категории
+    def build_shop_header(self):
+        name = ET.Element("name")
         name.text = "smart-dostup"
         categories_dict = {
             1: "Uncategorized",
@@ -334,100 +941,126 @@ class XMLGenerator:
             14: "ПЫЛЕСОСЫ"
         }
 
-        categories = ET.SubElement(shop, "categories")
+        categories = ET.Element("categories")
         for i in range(1, 15):
             category = ET.SubElement(categories, "category", id=str(i))
             category.text = categories_dict[i]
+        return [name, categories]
+
+    # Начало каталога до открытого <offers>, дальше offer'ы пишутся по одному
+    def start_catalog(self, writer):
+        writer.start_document()
+        writer.start("yml_catalog", {
+                     'date': datetime.now().strftime("%Y-%m-%dT%H:%M:%S%z")})
+        writer.start("shop")
+        for element in self.build_shop_header():
+            writer.element(element)
+        writer.start("offers")
+
+    # Сборка products.xml из журнала: offer'ы пишутся в файл по одному, в памяти весь каталог не держится.
+    # Цена берется из текущего Excel (он мог поменяться между падением и перезапуском), товары, которых
+    # в Excel уже нет, в каталог не попадают
+    def write_catalog(self, products, journal, output_file):
+        prices = dict(zip(products['xmlid'].astype(str), products['price']))
+        written = 0
+        with publish(output_file) as f:
+            writer = XMLStreamWriter(f)
+            self.start_catalog(writer)
+            for product_data in journal.entries():
+                xmlid = str(product_data['xmlid'])
+                if xmlid not in prices:
+                    continue
+                product_data['price'] = prices[xmlid]
+                product_data['calculated_price'] = calculate_price(
+                    prices[xmlid])
+                writer.element(self.build_offer(product_data))
+                written += 1
+            writer.close()
+        return written
 
-        offers = ET.SubElement(shop, "offers")
+    # partial_publish=True - публиковать промежуточные версии products.xml по ходу сборки (см. PartialCatalog)
+    async def generate_xml_async(self, products, partial_publish=None):
+        logging.info("Генерация XML файла")
+        output_file = feed_file
+        journal = BuildJournal()
+        if partial_publish is None:
+            partial_publish = bool(
+                partial_publish_offers or partial_publish_seconds)
+        # Товары, готовые с прошлого (упавшего) запуска, повторно не обогащаются
+        done = journal.xmlids()
+        if done:
+            logging.info(f"Найден журнал прошлой сборки {journal.path}: готово {
+                         len(done)} товаров, продолжаем с оставшихся")
+        pending = products[~products['xmlid'].astype(str).isin(done)]
+        partial = PartialCatalog(
+            self, output_file) if partial_publish else None
+        if partial is not None and done:
+            prices = dict(zip(products['xmlid'].astype(str), products['price']))
+            for product_data in journal.entries():
+                xmlid = str(product_data['xmlid'])
+                if xmlid in prices:
+                    product_data['calculated_price'] = calculate_price(
+                        prices[xmlid])
+                    partial.add(product_data)
+            partial.maybe_publish()
+        # Большая сборка сначала обогащается одним заданием Batch API, ошибка задания не останавливает сборку
+        if gpt_bulk_min_rows and len(pending) >= gpt_bulk_min_rows:
+            try:
+                await self.bulk_enrich(pending)
+            except Exception as e:
+                logging.error(f"Офлайн-обогащение GPT не удалось, товары запрашиваются по одному: {e}")
         product_count = 0
-        total_products = len(products)
+        total_products = len(pending)
         start_time = time.time()
 
-        # Определение количества потоков
-        # num_cores = os.cpu_count()
-        # max_workers = num_cores * 2  # Для I/O задач можно увеличить количество потоков
-        if os.cpu_count() <= 4:
-            max_workers = os.cpu_count() * 4
-        else:
-            max_workers = os.cpu_count() * 2
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_product = {
-                executor.submit(self.process_product, row): row for index, row in products.iterrows()
-            }
-            for future in as_completed(future_to_product):
-                product_count += 1
-                row = future_to_product[future]
-                try:
-                    product_data = future.result()
-                    if product_data is None:
-                        continue
-                    logging.info(f"Обработка товара с ID: {product_data['xmlid']} ({
-                                 product_count}/{total_products}), осталось {total_products - product_count}")
-                    logging.info(f"Цена для товара ID {product_data['xmlid']} до наценки: {
-                                 product_data['price']}, после наценки: {product_data['calculated_price']}")
-
-                    offer = ET.SubElement(
-                        offers, "offer", id=str(product_data['xmlid']))
-                    name = ET.SubElement(offer, "name")
-                    name.text = product_data['name']
-                    vendor = ET.SubElement(offer, "vendor")
-                    vendor.text = product_data['vendor']
-                    count = ET.SubElement(offer, "count")
-                    count.text = "1"
-                    archived = ET.SubElement(offer, "archived")
-                    archived.text = "false"
-                    disabled = ET.SubElement(offer, "disabled")
-                    disabled.text = "false"
-                    price = ET.SubElement(offer, "price")
-                    price.text = str(
-                        round(product_data['calculated_price'], 2))
-                    categoryId = ET.SubElement(offer, "categoryId")
-                    categoryId.text = product_data['categoryId'] if product_data['categoryId'] else "1"
-                    currencyId = ET.SubElement(offer, "currencyId")
-                    currencyId.text = "RUR"
-                    description = ET.SubElement(offer, "description")
-                    description.text = product_data['description']
-
-                    for image_url in product_data.get('pictures', []):
-                        picture = ET.SubElement(offer, "picture")
-                        picture.text = image_url
-
-                    warranty_days = ET.SubElement(offer, "warranty-days")
-                    # Один год значение от Яндекс Маркет
-                    warranty_days.text = "P1Y"
-                    service_life_days = ET.SubElement(
-                        offer, "service-life-days")
-                    # Один год значение от Яндекс Маркет
-                    service_life_days.text = "P1Y"
-                    dimensions = ET.SubElement(offer, "dimensions")
-                    dimensions.text = product_data['dimensions']
-                    weight = ET.SubElement(offer, "weight")
-                    weight.text = product_data['weight']
-
-                except Exception as exc:
-                    logging.error(f"Ошибка обработки товара с ID: {
-                                  row['xmlid']}: {exc}")
+        # Все товары запускаются сразу, одновременность ограничивают стадии конвейера
+        try:
+            async with self.pipeline():
+                tasks = [asyncio.ensure_future(self._process_row(row))
+                         for index, row in pending.iterrows()]
+                for next_done in asyncio.as_completed(tasks):
+                    row, product_data = await next_done
+                    product_count += 1
+                    try:
+                        if isinstance(product_data, Exception):
+                            raise product_data
+                        if product_data is None:
+                            continue
+                        logging.info(f"Обработка товара с ID: {product_data['xmlid']} ({
+                                     product_count}/{total_products}), осталось {total_products - product_count}")
+                        logging.info(f"Цена для товара ID {product_data['xmlid']} до наценки: {
+                                     product_data['price']}, после наценки: {product_data['calculated_price']}")
+                        # Готовый товар сразу сохраняется в журнал
+                        journal.append(product_data)
+                        if partial is not None:
+                            partial.add(product_data)
+                            partial.maybe_publish()
 
-                offer_end_time = time.time()
-                average_time_per_offer = (
-                    offer_end_time - start_time) / product_count
-                estimated_time_remaining = average_time_per_offer * \
-                    (total_products - product_count)
-                logging.info(f"Среднее время на обработку одного товара: {
-                             average_time_per_offer:.2f} секунд. Примерное оставшееся время: {estimated_time_remaining:.2f} секунд.")
+                    except Exception as exc:
+                        logging.error(f"Ошибка обработки товара с ID: {
+                                      row['xmlid']}: {exc}")
 
-        # Форматирование XML с отступами
-        xml_str = ET.tostring(yml_catalog, encoding='utf-8')
-        parsed_str = minidom.parseString(xml_str).toprettyxml(indent="  ")
+                    offer_end_time = time.time()
+                    average_time_per_offer = (
+                        offer_end_time - start_time) / product_count
+                    estimated_time_remaining = average_time_per_offer * \
+                        (total_products - product_count)
+                    logging.info(f"Среднее время на обработку одного товара: {
+                                 average_time_per_offer:.2f} секунд. Примерное оставшееся время: {estimated_time_remaining:.2f} секунд.")
+        finally:
+            journal.close()
+            if partial is not None:
+                partial.close()
 
-        output_file = "products.xml"
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(parsed_str)
+        # Форматирование XML с отступами и запись сразу в файл
+        written = self.write_catalog(products, journal, output_file)
+        journal.remove()
+        if partial is not None:
+            logging.info(f"Промежуточные публикации: {partial.stats()}")
 
         logging.info(f"XML файл успешно создан: {output_file}")
-        logging.info(f"Обработано товаров: {product_count}")
+        logging.info(f"Обработано товаров: {product_count}, в каталоге: {written}")
+        logging.info(f"Кэш ответов GPT: {gpt_cache.stats()}")
 
 
 if __name__ == "__main__":
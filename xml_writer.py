@@ -0,0 +1,161 @@
+import io
+import re
+import xml.etree.ElementTree as ET
+from publisher import publish
+
+# Этот модуль - общий писатель XML для products.xml.
+# Раньше каждый скрипт делал ET.tostring -> minidom.parseString(...).toprettyxml() -> split/join строк -> write,
+# то есть держал в памяти сразу три полные копии каталога, а minidom сам по себе очень медленный.
+# Здесь XML пишется сразу в файл по мере обхода дерева, с теми же отступами, что и у toprettyxml(indent="  "),
+# так что результат совпадает с прежним форматом байт в байт:
+# 1. Заголовок <?xml version="1.0" ?>.
+# 2. Элемент только с текстом пишется в одну строку, пустой элемент как <tag/>.
+# 3. Экранирование &, <, ", > как в minidom.
+# 4. strip_blank_lines=True повторяет старый фильтр '\n'.join([line for line in ... if line.strip()]),
+# без него (как было в XMLGenerator.generate_xml) в конце файла остается перевод строки.
+# 5. lines() дописывает готовые строки (offer'ы из базы, см. catalog_store.py) без разбиения по строкам,
+# если в них нет пустых строк: результат тот же, что и через фильтр.
+
+
+def _escape(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+# Парсер при чтении XML превращает \r\n и \r в \n, minidom видел текст уже в таком виде
+def _normalize_newlines(data):
+    return data.replace("\r\n", "\n").replace("\r", "\n")
+
+
+# Пустая строка внутри текста и в его начале. Квантификатор без отката: иначе поиск откатывается по отступу каждой строки
+_blank_line = re.compile(r"\n[^\S\n]*+\n")
+_leading_blank_line = re.compile(r"[^\S\n]*+\n")
+
+
+class XMLStreamWriter:
+    def __init__(self, file, indent="  ", strip_blank_lines=True):
+        self.file = file
+        self.indent = indent
+        self.strip_blank_lines = strip_blank_lines
+        self._stack = []
+        # Открывающий тег, который еще не записан: пока у элемента нет детей, его надо будет закрыть как <tag/>
+        self._pending_start = None
+        self._buffer = ""
+        self._first_line = True
+
+    # Запись с построчным фильтром пустых строк. Строка уходит в файл, как только она закончилась
+    def _write(self, data):
+        if not self.strip_blank_lines:
+            self.file.write(data)
+            return
+        lines = (self._buffer + data).split("\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                if not self._first_line:
+                    self.file.write("\n")
+                self.file.write(line)
+                self._first_line = False
+
+    def _flush_pending_start(self):
+        if self._pending_start is not None:
+            self._write(self._pending_start + ">\n")
+            self._pending_start = None
+
+    def _open_tag(self, tag, attrib, level):
+        parts = [self.indent * level, "<", tag]
+        for key, value in attrib.items():
+            parts.append(f' {key}="{_escape(value)}"')
+        return "".join(parts)
+
+    def start_document(self):
+        self._write('<?xml version="1.0" ?>\n')
+
+    # Открыть контейнер (yml_catalog, shop, offers), дети которого будут записаны позже по одному
+    def start(self, tag, attrib=None):
+        self._flush_pending_start()
+        self._pending_start = self._open_tag(tag, attrib or {}, len(self._stack))
+        self._stack.append(tag)
+
+    def end(self):
+        tag = self._stack.pop()
+        if self._pending_start is not None:
+            self._write(self._pending_start + "/>\n")
+            self._pending_start = None
+        else:
+            self._write(f"{self.indent * len(self._stack)}</{tag}>\n")
+
+    # Записать элемент целиком (со всеми вложенными) на текущем уровне вложенности
+    def element(self, elem):
+        self._flush_pending_start()
+        self._element(elem, len(self._stack))
+
+    def text(self, data):
+        self._flush_pending_start()
+        self._text(data, len(self._stack))
+
+    # Дописать уже сериализованные элементы (см. serialize_element) на текущем уровне вложенности
+    def raw(self, data):
+        self._flush_pending_start()
+        self._write(data)
+
+    # То же, что raw() для строк, каждая из которых заканчивается переводом строки, но без построчного фильтра
+    def lines(self, data):
+        self._flush_pending_start()
+        if not data:
+            return
+        if not self.strip_blank_lines or self._buffer or _leading_blank_line.match(data) or _blank_line.search(data):
+            self._write(data)
+            return
+        if not self._first_line:
+            self.file.write("\n")
+        self.file.write(data[:-1])
+        self._first_line = False
+
+    def _text(self, data, level):
+        self._write(_escape(f"{self.indent * level}{_normalize_newlines(data)}\n"))
+
+    def _element(self, elem, level):
+        head = self._open_tag(elem.tag, elem.attrib, level)
+        children = list(elem)
+        if not children:
+            if elem.text:
+                self._write(
+                    f"{head}>{_escape(_normalize_newlines(elem.text))}</{elem.tag}>\n")
+            else:
+                self._write(f"{head}/>\n")
+            return
+
+        self._write(head + ">\n")
+        if elem.text:
+            self._text(elem.text, level + 1)
+        for child in children:
+            self._element(child, level + 1)
+            if child.tail:
+                self._text(child.tail, level + 1)
+        self._write(f"{self.indent * level}</{elem.tag}>\n")
+
+    def close(self):
+        while self._stack:
+            self.end()
+        if self._buffer:
+            self._write("\n")
+
+
+# Сериализовать элемент заранее, с отступом для уровня вложенности level, чтобы потом дописывать его через raw()
+def serialize_element(elem, level=0, indent="  "):
+    buffer = io.StringIO()
+    writer = XMLStreamWriter(buffer, indent=indent, strip_blank_lines=False)
+    writer._element(elem, level)
+    return buffer.getvalue()
+
+
+# Записать дерево целиком в файл, заменяет связку ET.tostring + minidom.toprettyxml.
+# Файл публикуется атомарно (временный файл + rename), см. publisher.py
+def write_xml(root, file_xml, strip_blank_lines=True):
+    if isinstance(root, ET.ElementTree):
+        root = root.getroot()
+    with publish(file_xml) as f:
+        writer = XMLStreamWriter(f, strip_blank_lines=strip_blank_lines)
+        writer.start_document()
+        writer.element(root)
+        writer.close()